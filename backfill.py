@@ -0,0 +1,198 @@
+"""
+Process a whole archive of videos offline
+
+To reprocess an archive (e.g. after a change of the settings) without going through RabbitMQ and Clowder, the videos
+are listed from directories or manifests and every video is processed in its own process, a bounded number at a time.
+A process that takes too long is killed together with everything it started (the encoder, ffmpeg, ...).
+
+The results of every video end up in a directory of the output tree: the slides, the previews, the thumbnail and the
+metadata (metadata.json, shaped like the metadata the extractor uploads). A marker with a fingerprint of the settings
+is written last, so a video is only processed again when it didn't finish or the settings changed.
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+METADATA_FILE = 'metadata.json'
+DONE_FILE = 'backfill.json'
+THUMBNAIL_NAME = 'thumbnail'  # with the extension of the slides
+# The environment variable with the key for Clowder (it is never passed on the command line, where ps shows it)
+KEY_VARIABLE = 'CLOWDER_KEY'
+
+default_extensions = ['.mp4', '.webm']
+
+
+def read_manifest(manifest):
+    """
+    Read a manifest: a video per line (relative paths are relative to the manifest), optionally followed by a tab and
+    the id of its file in Clowder. Empty lines and lines starting with # are skipped.
+    :return list of dicts with the path, the name (the path relative to the manifest) and the file id of every video
+    """
+    root = os.path.dirname(os.path.abspath(manifest))
+    videos = []
+    with open(manifest, 'r') as manifestfile:
+        for line in manifestfile:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path, _, file_id = line.partition('\t')
+            path = os.path.join(root, path.strip())
+            videos.append({'path': path, 'name': output_name(path, root), 'file_id': file_id.strip() or None})
+
+    return videos
+
+
+def find_videos(inputs, extensions=None):
+    """
+    List the videos to process
+    :param inputs: list of directories (searched recursively), videos and manifests (see read_manifest)
+    :param extensions: the extensions of the videos in the directories
+    :return list of dicts with the path, the name (the path relative to the directory) and the file id (from a
+    manifest, otherwise None) of every video
+    """
+    extensions = [extension.lower() for extension in extensions or default_extensions]
+    videos = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[1].lower() in extensions:
+                        video = os.path.join(dirpath, filename)
+                        videos.append({'path': video, 'name': output_name(video, path), 'file_id': None})
+        elif os.path.splitext(path)[1].lower() in extensions:
+            videos.append({'path': path, 'name': os.path.basename(path), 'file_id': None})
+        else:
+            videos.extend(read_manifest(path))
+
+    return videos
+
+
+def output_name(path, root):
+    """The name of the directory in the output tree for a video: its path relative to root (without going up)"""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    return os.path.join(*[part for part in relative.split(os.sep) if part not in ('', os.curdir, os.pardir)])
+
+
+def read_key(key_file=None):
+    """
+    The key for Clowder: the first line of the key file if there is one, otherwise the environment variable
+    :return the key (None if there is none)
+    """
+    if key_file:
+        with open(key_file, 'r') as keyfile:
+            return keyfile.readline().strip() or None
+
+    return os.environ.get(KEY_VARIABLE) or None
+
+
+def settings_fingerprint(settings):
+    """A fingerprint of the settings (a JSON serializable dict) to check if the results are up to date"""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def write_json(path, data):
+    """Write a JSON file (atomically, so it is either complete or not there)"""
+    with open(path + '.tmp', 'w') as jsonfile:
+        json.dump(data, jsonfile, indent=4, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def read_done(directory):
+    """The marker of a video that was processed (None if it wasn't)"""
+    try:
+        with open(os.path.join(directory, DONE_FILE), 'r') as donefile:
+            return json.load(donefile)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_done(directory, fingerprint):
+    """Check if a video was processed with the same settings"""
+    done = read_done(directory)
+    return done is not None and done.get('settings') == fingerprint
+
+
+def referenced_files(metadata):
+    """The files of the output directory of a video that the metadata refers to"""
+    files = set([METADATA_FILE, DONE_FILE])
+    files.update([name for name in metadata.get('previews', {}).values() if name])
+    files.update([slide[2] for slide in metadata.get('listslides', []) if slide[2]])
+    files.update([THUMBNAIL_NAME + os.path.splitext(name)[1] for name in list(files) if name.startswith('slide')])
+    return files
+
+
+def prune(directory, metadata):
+    """Remove the files of an earlier run (e.g. slides with other settings) the metadata doesn't refer to"""
+    keep = referenced_files(metadata)
+    for name in os.listdir(directory):
+        if name not in keep and os.path.isfile(os.path.join(directory, name)):
+            logger.debug("Removing %s of an earlier run", os.path.join(directory, name))
+            os.remove(os.path.join(directory, name))
+
+
+def _run_job(target, job):
+    """Runs in the child process: in a new process group, so everything the job starts can be killed"""
+    os.setsid()
+    target(job)
+
+
+def _kill(process):
+    """Kill a job and every process it started"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # The job didn't get to start its own process group
+        process.terminate()
+    process.join()
+
+
+def run_pool(jobs, target, processes=1, timeout=0, listener=None):
+    """
+    Run target(job) for every job in its own process, at most processes at a time. The job fails if target raises
+    an exception.
+    :param jobs: list of tuples with the name and the job (the argument of target)
+    :param timeout: kill a job (and every process it started) after this many seconds, 0 to wait forever
+    :param listener: function that is called with the name and the outcome of every job when it ends
+    :return dict with the outcome (done, failed or timeout) of every job by name
+    """
+    # The target doesn't have to be picklable, the children are forks
+    context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    pending = list(jobs)
+    running = {}
+    outcomes = {}
+    try:
+        while pending or running:
+            while pending and len(running) < max(processes, 1):
+                name, job = pending.pop(0)
+                process = context.Process(target=_run_job, args=(target, job))
+                process.start()
+                running[name] = (process, time.time())
+
+            time.sleep(0.2)
+            for name, (process, start_time) in list(running.items()):
+                if not process.is_alive():
+                    process.join()
+                    outcomes[name] = 'done' if process.exitcode == 0 else 'failed'
+                elif timeout and time.time() - start_time > timeout:
+                    logger.error("Processing %s took more than %d s, killing it", name, timeout)
+                    _kill(process)
+                    outcomes[name] = 'timeout'
+                else:
+                    continue
+                del running[name]
+                if listener is not None:
+                    listener(name, outcomes[name])
+    finally:
+        # e.g. interrupted
+        for process, _ in running.values():
+            _kill(process)
+
+    return outcomes
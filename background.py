@@ -0,0 +1,108 @@
+"""
+Background models for the advanced algorithm
+
+The advanced algorithm counts the pixels of every frame that differ from a model of the background. The default model
+is the KNN background subtractor of OpenCV, which keeps a number of samples per pixel (and channel) and is expensive
+in memory and CPU. For slides, where the question is mostly 'did a large part of the screen change', a running
+(exponentially weighted) average of the grayscale frames does the job at a fraction of the cost. The transitions
+found are not always the same: gradual changes like a slow fade may stay below the threshold of the running average.
+
+Every model has the interface of the OpenCV background subtractors: apply(frame, fgmask, learning_rate) writes the
+pixels that changed into fgmask (255 for a change, 0 otherwise) and updates the model, with the learning rate of the
+history when it is negative (the default).
+"""
+
+import logging
+
+import cv2  # OpenCV
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class RunningAverageBackground(object):
+    """
+    The background is the exponentially weighted average of the grayscale frames, a pixel changed when it differs
+    more than the threshold from the background. The model is a single float image and all intermediate images are
+    preallocated, so applying it doesn't allocate anything.
+    """
+
+    def __init__(self, history, threshold=30):
+        """
+        :param history: the number of frames the average covers (the weight of a new frame is 2 / (history + 1))
+        :param threshold: the difference with the background (0..255) for a pixel to count as changed
+        """
+        self.alpha = 2.0 / (max(history, 1) + 1)
+        self.threshold = threshold
+        self._average = None
+        self._background = None
+        self._gray = None
+        self._diff = None
+
+    def _allocate(self, size):
+        """Allocate the model and the buffers for frames of the given size (height, width)"""
+        self._average = np.zeros(size, np.float32)
+        self._background = np.zeros(size, np.uint8)
+        self._gray = np.zeros(size, np.uint8)
+        self._diff = np.zeros(size, np.uint8)
+
+    def apply(self, frame, fgmask, learning_rate=-1.0):
+        """
+        Find the pixels that differ from the background and add the frame to the background
+        :param frame: the frame (BGR or grayscale)
+        :param fgmask: the output, a single channel image of the size of the frame
+        :param learning_rate: the weight of the frame in the background (negative for the one of the history)
+        """
+        first = self._average is None
+        if first:
+            self._allocate(frame.shape[:2])
+        if frame.ndim == 3:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            frame = self._gray
+
+        if first:
+            # The first frame is the background
+            self._average[...] = frame
+            fgmask[...] = 0
+            return fgmask
+
+        cv2.convertScaleAbs(self._average, dst=self._background)
+        cv2.absdiff(frame, self._background, dst=self._diff)
+        cv2.threshold(self._diff, self.threshold, 255, cv2.THRESH_BINARY, dst=fgmask)
+        cv2.accumulateWeighted(frame, self._average, self.alpha if learning_rate < 0 else learning_rate)
+        return fgmask
+
+
+background_models = ['knn', 'running_average']
+
+
+def create_background_model(name, history):
+    """
+    Create a background model
+    :param name: knn or running_average
+    :param history: the number of frames the model learns from
+    :return the model, with the apply(frame, fgmask) method of the OpenCV background subtractors
+    """
+    if name == 'running_average':
+        return RunningAverageBackground(history)
+    if name == 'knn':
+        return cv2.createBackgroundSubtractorKNN(history=history, detectShadows=False)
+
+    raise ValueError("Unknown background model %s, possible choices: %s" % (name, ', '.join(background_models)))
+
+
+def sample_learning_rate(name, history, frame_step):
+    """
+    The learning rate for a frame that stands for frame_step frames, so the model learns as much from it as from all
+    those frames (a negative rate, the default of the model, without sampling)
+    :param name: knn or running_average
+    :param history: the number of frames the model learns from
+    :param frame_step: the number of frames of the video the frame stands for
+    """
+    if frame_step <= 1:
+        return -1.0
+    if name == 'running_average':
+        rate = 2.0 / (max(history, 1) + 1)
+    else:
+        rate = 1.0 / max(history, 1)
+    return 1.0 - (1.0 - rate) ** frame_step
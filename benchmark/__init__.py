@@ -0,0 +1,11 @@
+"""
+Benchmark suite for the slide transition detection
+
+Synthetic lecture videos with known slide transitions (see generator) are generated once and cached, every algorithm
+runs on every video in a separate process (see measure) and the throughput, memory use and accuracy are collected in
+a JSON report (see suite). The video-benchsuite.py script runs it from the command line.
+"""
+
+from benchmark.generator import default_specs, generate_video
+from benchmark.measure import run_measured
+from benchmark.suite import algorithms, compare_reports, run_suite
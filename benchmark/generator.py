@@ -0,0 +1,199 @@
+"""
+Synthetic lecture videos with known slide transitions
+
+A video is described by a spec (a dict, see default_specs): the resolution, frame rate and length, how long the
+slides are shown, the animation of the transitions (cut, fade or wipe), an optional presenter overlay in the
+bottom-right corner (where the default mask is), noise on every frame and the compression (crf of x264). The slides
+are text slides drawn with OpenCV, some with a coloured block. The ground truth is written next to the video in the
+format of tuning.read_ground_truth.
+
+Generating is deterministic (the spec has a seed) and the videos are cached: a video is only generated again when its
+spec changes.
+"""
+
+import json
+import logging
+import os
+import subprocess
+
+import cv2  # OpenCV
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+default_spec = {
+    'width' : 1280,
+    'height' : 720,
+    'fps' : 25,
+    'duration' : 180,  # seconds
+    'slide_length' : [25, 50],  # range of the time a slide is shown (seconds)
+    'transition' : 'cut',  # cut, fade or wipe
+    'transition_time' : 0.0,  # duration of the animation (seconds)
+    'presenter' : False,
+    'noise' : 0,  # standard deviation of the noise on every frame (in gray levels)
+    'crf' : 23,  # the quality of the x264 encode (higher compresses more)
+    'seed' : 0,
+}
+
+# The videos of the suite. The slides are shown at least 25 s, longer than the default minimum_slide_length.
+default_specs = [
+    dict(default_spec, name='cut-720p25'),
+    dict(default_spec, name='fade-1080p30', width=1920, height=1080, fps=30, duration=120, transition='fade',
+         transition_time=1.0, seed=1),
+    dict(default_spec, name='wipe-presenter-720p25', transition='wipe', transition_time=0.5, presenter=True, seed=2),
+    dict(default_spec, name='noisy-480p15', width=854, height=480, fps=15, duration=240, noise=6, crf=35, seed=3),
+    dict(default_spec, name='long-360p25', width=640, height=360, duration=600, seed=4),
+]
+
+WORDS = ("slide detection lecture video frame signal keyframe encoder background motion average trigger ratio "
+         "transition presenter overlay sampling window resolution pixel threshold model").split()
+
+
+def change_times(spec):
+    """The times (in seconds) at which a new slide starts, the first slide starts at 0"""
+    rng = np.random.RandomState(spec['seed'])
+    times = [0.0]
+    shortest, longest = spec['slide_length']
+    while True:
+        next_time = round(times[-1] + rng.uniform(shortest, longest), 2)
+        # The last slide is shown long enough as well
+        if next_time + shortest > spec['duration']:
+            return times
+        times.append(next_time)
+
+
+def slide_image(width, height, index, seed):
+    """Draw a text slide"""
+    rng = np.random.RandomState(seed * 1000 + index)
+    scale = height / 720.0
+    image = np.full((height, width, 3), 245, np.uint8)
+    cv2.rectangle(image, (0, 0), (width, int(110 * scale)), (120, 60, 20), -1)
+    title = 'Slide %d: %s %s' % (index + 1, WORDS[rng.randint(len(WORDS))], WORDS[rng.randint(len(WORDS))])
+    cv2.putText(image, title, (int(50 * scale), int(75 * scale)), cv2.FONT_HERSHEY_SIMPLEX, 1.6 * scale,
+                (255, 255, 255), max(int(3 * scale), 1))
+    for line in range(rng.randint(5, 10)):
+        text = '- ' + ' '.join([WORDS[word] for word in rng.randint(0, len(WORDS), rng.randint(3, 8))])
+        cv2.putText(image, text, (int(70 * scale), int((170 + line * 45) * scale)), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.9 * scale, (30, 30, 30), max(int(2 * scale), 1))
+    if index % 2:
+        x1 = int(width * rng.uniform(0.5, 0.6))
+        y1 = int(height * rng.uniform(0.25, 0.35))
+        cv2.rectangle(image, (x1, y1), (x1 + int(width * 0.2), y1 + int(height * 0.3)),
+                      tuple([int(value) for value in rng.randint(0, 255, 3)]), -1)
+
+    return image
+
+
+def draw_presenter(image, time_idx):
+    """Draw a presenter that moves a bit in the bottom-right corner"""
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = int(width * 0.82), int(height * 0.82), int(width * 0.99), int(height * 0.99)
+    cv2.rectangle(image, (x1, y1), (x2, y2), (70, 70, 70), -1)
+    radius = max((y2 - y1) // 4, 2)
+    center = (int((x1 + x2) / 2 + radius * 0.5 * np.sin(time_idx * 2.0)),
+              int((y1 + y2) / 2 + radius * 0.3 * np.cos(time_idx * 1.7)))
+    cv2.circle(image, center, radius, (150, 170, 210), -1)
+
+
+class VideoWriter(object):
+    """Write BGR frames to an mp4 file, with x264 in an ffmpeg process or with cv2.VideoWriter (mp4v)"""
+
+    def __init__(self, path, width, height, fps, crf, encoder='ffmpeg'):
+        self.proc = None
+        self.writer = None
+        if encoder == 'ffmpeg':
+            command = ['ffmpeg', '-loglevel', 'error', '-nostdin', '-y', '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                       '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', 'pipe:0', '-c:v', 'libx264',
+                       '-preset', 'veryfast', '-crf', str(crf), '-pix_fmt', 'yuv420p', path]
+            self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+        else:
+            self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+    def write(self, frame):
+        """Add a frame"""
+        if self.proc is not None:
+            self.proc.stdin.write(frame.tobytes())
+        else:
+            self.writer.write(frame)
+
+    def close(self):
+        """Finish the video"""
+        if self.proc is not None:
+            self.proc.stdin.close()
+            if self.proc.wait() != 0:
+                raise RuntimeError("ffmpeg failed to encode the video")
+        else:
+            self.writer.release()
+
+
+def generate_video(spec, directory, encoder='ffmpeg'):
+    """
+    Generate a video (unless it was generated before with the same spec)
+    :param spec: the description of the video (see default_spec), with a name
+    :param directory: where to write the video, its ground truth and its spec
+    :param encoder: ffmpeg (x264 with the crf of the spec) or opencv (cv2.VideoWriter with mp4v, ignores the crf)
+    :return tuple with the path to the video and the path to the ground truth
+    """
+    spec = dict(default_spec, **spec)
+    path = os.path.join(directory, spec['name'] + '.mp4')
+    truth_path = os.path.join(directory, spec['name'] + '.txt')
+    spec_path = os.path.join(directory, spec['name'] + '.json')
+    description = dict(spec, encoder=encoder)
+    if os.path.exists(path) and os.path.exists(truth_path) and os.path.exists(spec_path):
+        with open(spec_path, 'r') as specfile:
+            if json.load(specfile) == json.loads(json.dumps(description)):
+                return path, truth_path
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    width, height, fps = spec['width'], spec['height'], spec['fps']
+    times = change_times(spec)
+    slides = [slide_image(width, height, index, spec['seed']) for index in range(len(times))]
+    logger.info("Generating %s: %dx%d at %s fps, %d s, %d slides", path, width, height, fps, spec['duration'],
+                len(slides))
+
+    # A few noise patterns are reused, adding and subtracting (saturated) positive noise keeps the brightness
+    rng = np.random.RandomState(spec['seed'])
+    noise = []
+    if spec['noise']:
+        for _ in range(4):
+            pattern = rng.normal(0, spec['noise'], (height, width, 3))
+            noise.append((np.clip(pattern, 0, 255).astype(np.uint8), np.clip(-pattern, 0, 255).astype(np.uint8)))
+
+    writer = VideoWriter(path, width, height, fps, spec['crf'], encoder)
+    frame = np.zeros((height, width, 3), np.uint8)
+    slide = 0
+    for frame_idx in range(int(round(spec['duration'] * fps))):
+        time_idx = frame_idx / float(fps)
+        while slide + 1 < len(times) and times[slide + 1] <= time_idx:
+            slide += 1
+
+        progress = (time_idx - times[slide]) / spec['transition_time'] if spec['transition_time'] else 1.0
+        if slide == 0 or progress >= 1.0 or spec['transition'] == 'cut':
+            np.copyto(frame, slides[slide])
+        elif spec['transition'] == 'fade':
+            cv2.addWeighted(slides[slide - 1], 1.0 - progress, slides[slide], progress, 0, dst=frame)
+        else:
+            # wipe from left to right
+            edge = int(width * progress)
+            frame[:, :edge] = slides[slide][:, :edge]
+            frame[:, edge:] = slides[slide - 1][:, edge:]
+
+        if spec['presenter']:
+            draw_presenter(frame, time_idx)
+        if noise:
+            positive, negative = noise[frame_idx % len(noise)]
+            cv2.add(frame, positive, dst=frame)
+            cv2.subtract(frame, negative, dst=frame)
+        writer.write(frame)
+    writer.close()
+
+    with open(truth_path, 'w') as truthfile:
+        truthfile.write("# slide transitions of %s (seconds)\n" % spec['name'])
+        for time_idx in times[1:]:
+            truthfile.write("%.3f\n" % time_idx)
+    with open(spec_path, 'w') as specfile:
+        json.dump(description, specfile, indent=4, sort_keys=True)
+
+    return path, truth_path
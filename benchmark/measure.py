@@ -0,0 +1,86 @@
+"""
+Measure the wall time and the memory use of a function in a separate process
+
+The function runs in a fork of the current process, which starts with a copy of its memory. The memory the parent
+freed is given back to the system first and the peak RSS of the child is reset (Linux only), so the growth of the
+peak RSS is the memory the function needed itself.
+"""
+
+import ctypes
+import multiprocessing
+import os
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+
+try:
+    libc = ctypes.CDLL('libc.so.6')  # pylint: disable=invalid-name
+except OSError:
+    libc = None  # pylint: disable=invalid-name
+
+
+def memory_status(field):
+    """A field of /proc/self/status in bytes (Linux only)"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+    return None
+
+
+def can_measure_memory():
+    """Check if the peak RSS can be reset and read"""
+    return os.path.exists('/proc/self/clear_refs')
+
+
+def run_measured(function, *args, **kwargs):
+    """
+    Run a function in a separate process
+    :return tuple with the result of the function (it has to be picklable), the wall time (in seconds) and how much
+    the peak RSS grew (in bytes, None if it can't be measured). Without support to measure the memory, the function
+    runs in this process.
+    """
+    if not can_measure_memory():
+        start_time = time.time()
+        result = function(*args, **kwargs)
+        return result, time.time() - start_time, None
+
+    def measure(results):
+        """Runs in the child process, which starts as a copy of the parent"""
+        try:
+            if libc is not None:
+                # Give the memory the parent freed back to the system, otherwise the child can reuse it unnoticed
+                libc.malloc_trim(0)
+            # Reset the peak RSS to the current RSS
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+            before = memory_status('VmRSS')
+            start_time = time.time()
+            result = function(*args, **kwargs)
+            wall_time = time.time() - start_time
+            results.put((True, (result, wall_time, memory_status('VmHWM') - before)))
+        except Exception:  # pylint: disable=broad-except
+            results.put((False, traceback.format_exc()))
+
+    # The function doesn't have to be picklable, the child is a fork
+    context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    results = context.Queue()
+    process = context.Process(target=measure, args=(results,))
+    process.start()
+    while True:
+        try:
+            success, outcome = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError("The measured process died with exit code %s" % process.exitcode)
+    process.join()
+
+    if not success:
+        raise RuntimeError("The measured function failed:\n%s" % outcome)
+    return outcome
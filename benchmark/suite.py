@@ -0,0 +1,146 @@
+"""
+Run the slide detection algorithms on a set of videos with a ground truth and collect a report
+
+Every algorithm runs on every video in a separate process (see measure), which gives the wall time and the growth of
+the peak RSS. The transitions are scored against the ground truth with tuning.score_transitions. The report is a dict
+that can be stored as JSON and compared with the report of an earlier version (compare_reports) to catch performance
+or accuracy regressions.
+"""
+
+import datetime
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+
+import cv2  # OpenCV
+
+from benchmark.measure import run_measured
+from framesource import open_frame_source
+from slidedetection import slide_find_advanced, slide_find_basic, slide_find_packets
+from tuning import read_ground_truth, score_transitions
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# The algorithms that can be benchmarked: name -> function(filename, output_dir, **settings) that returns the slides
+algorithms = {
+    'advanced': slide_find_advanced,
+    'basic': slide_find_basic,
+    'packets': slide_find_packets,
+}
+
+
+def video_properties(filename):
+    """The resolution, frame rate, number of frames and duration (in seconds) of a video"""
+    source = open_frame_source(filename)
+    height, width = source.source_size
+    properties = {
+        'width': width,
+        'height': height,
+        'fps': source.source_fps,
+        'frames': source.source_num_frames,
+        'duration': source.source_num_frames / source.source_fps if source.source_fps else 0.0,
+    }
+    source.release()
+    return properties
+
+
+def detect(algorithm, filename, settings):
+    """Run an algorithm and return the transitions (in msec), without the start and the end of the video"""
+    output_dir = tempfile.mkdtemp(prefix='video-benchsuite')
+    try:
+        slides = algorithms[algorithm](filename, output_dir, **settings)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return [slide[1] for slide in slides[:-1] if slide[1] > 0]
+
+
+def run_suite(videos, configurations, tolerance=2.0):
+    """
+    Run every configuration on every video
+    :param videos: list of tuples with the path to a video and the path to its ground truth (None if there is none)
+    :param configurations: list of dicts with a name, the algorithm and its settings
+    :param tolerance: tolerance (in seconds) to match a transition with the ground truth
+    :return the report: a dict with the environment, a result per video and configuration and a summary per
+    configuration
+    """
+    results = []
+    for filename, truth_path in videos:
+        properties = video_properties(filename)
+        truth = read_ground_truth(truth_path) if truth_path else None
+        for configuration in configurations:
+            logger.info("Running %s on %s", configuration['name'], filename)
+            transitions, wall_time, peak_rss = run_measured(detect, configuration['algorithm'], filename,
+                                                            configuration['settings'])
+            result = {
+                'video': os.path.basename(filename),
+                'configuration': configuration['name'],
+                'wall_time': wall_time,
+                'frames_per_second': properties['frames'] / wall_time if wall_time else None,
+                'seconds_per_video_hour': wall_time * 3600.0 / properties['duration'] if properties['duration']
+                                          else None,
+                'peak_rss': peak_rss,
+                'transitions': len(transitions),
+            }
+            result.update(properties)
+            if truth is not None:
+                result.update(score_transitions(transitions, truth, tolerance * 1000.0))
+            results.append(result)
+
+    summary = {}
+    for configuration in configurations:
+        runs = [result for result in results if result['configuration'] == configuration['name']]
+        scored = [result for result in runs if 'f1' in result]
+        duration = sum([result['duration'] for result in runs])
+        summary[configuration['name']] = {
+            'algorithm': configuration['algorithm'],
+            'settings': configuration['settings'],
+            'seconds_per_video_hour': sum([result['wall_time'] for result in runs]) * 3600.0 / duration
+                                      if duration else None,
+            'peak_rss': max([result['peak_rss'] or 0 for result in runs]) if runs else None,
+        }
+        for metric in ['precision', 'recall', 'f1']:
+            summary[configuration['name']][metric] = sum([result[metric] for result in scored]) / len(scored) \
+                if scored else None
+
+    return {
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count(),
+        },
+        'tolerance': tolerance,
+        'results': results,
+        'summary': summary,
+    }
+
+
+def compare_reports(report, baseline, max_slowdown=0.2, max_f1_drop=0.05):
+    """
+    Compare a report with the report of an earlier version. Only the videos and configurations in both count.
+    :param max_slowdown: the fraction the time per video hour may grow
+    :param max_f1_drop: how much the f1 score may drop
+    :return list with a description of every regression
+    """
+    previous = dict([((result['video'], result['configuration']), result) for result in baseline['results']])
+    regressions = []
+    for result in report['results']:
+        key = (result['video'], result['configuration'])
+        if key not in previous:
+            continue
+        old = previous[key]
+        if old.get('seconds_per_video_hour') and result.get('seconds_per_video_hour') and \
+                result['seconds_per_video_hour'] > old['seconds_per_video_hour'] * (1 + max_slowdown):
+            regressions.append("%s on %s: %.1f s per video hour, was %.1f s" % (
+                result['configuration'], result['video'], result['seconds_per_video_hour'],
+                old['seconds_per_video_hour']))
+        if old.get('f1') is not None and result.get('f1') is not None and result['f1'] < old['f1'] - max_f1_drop:
+            regressions.append("%s on %s: f1 %.2f, was %.2f" % (result['configuration'], result['video'],
+                                                                 result['f1'], old['f1']))
+
+    return regressions
@@ -0,0 +1,113 @@
+"""
+CPU budget for the extractor
+
+multiprocessing.cpu_count() returns the number of cores of the host, also inside a container which is only allowed
+to use a fraction of them. The effective number of CPUs is determined from the CPU quota of the cgroup (v1 or v2)
+and the CPU affinity of the process. It is then split between the background encoding of the previews and the
+slide detection, so they don't oversubscribe the container together.
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+default_settings_resources = {
+    'cpus': 0,  # 0 means all CPUs the container may use
+    'encoding_share': 0.5,
+    'uploads': 1,
+}
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def read_first_line(path):
+    """Read the first line of a (cgroup) file, None if it doesn't exist"""
+    try:
+        with open(path, 'r') as cgroupfile:
+            return cgroupfile.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def cgroup_cpu_quota(root=CGROUP_ROOT):
+    """
+    Get the CPU quota of the cgroup we run in
+    :param root: mount point of the cgroup filesystem
+    :return the quota as a (fractional) number of CPUs or None if there is no quota
+    """
+    # cgroup v2: cpu.max contains "$MAX $PERIOD" where $MAX can be "max"
+    cpu_max = read_first_line(os.path.join(root, 'cpu.max'))
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max':
+            try:
+                return float(quota) / float(period or 100000)
+            except (ValueError, ZeroDivisionError):
+                logger.warning("Failed to parse cgroup cpu.max: %s", cpu_max)
+        return None
+
+    # cgroup v1: the quota is -1 if not set
+    for controller in ['cpu', 'cpu,cpuacct', 'cpuacct,cpu']:
+        quota = read_first_line(os.path.join(root, controller, 'cpu.cfs_quota_us'))
+        period = read_first_line(os.path.join(root, controller, 'cpu.cfs_period_us'))
+        if quota is None or period is None:
+            continue
+        try:
+            if int(quota) > 0 and int(period) > 0:
+                return float(quota) / float(period)
+        except ValueError:
+            logger.warning("Failed to parse cgroup cpu quota: %s / %s", quota, period)
+        return None
+
+    return None
+
+
+def available_cpus():
+    """The number of CPUs this process can effectively use"""
+    cpus = multiprocessing.cpu_count()
+
+    # Not available in python 2
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = min(cpus, len(os.sched_getaffinity(0)))  # pylint: disable=no-member
+
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, int(math.ceil(quota)))
+
+    return max(cpus, 1)
+
+
+def cpu_budget(settings=None):
+    """
+    Split the available CPUs between the preview encoding and the slide detection
+    :param settings: dict with the resources settings (see default_settings_resources):
+      - cpus: the number of CPUs to use (0 to use all CPUs the container may use)
+      - encoding_share: the fraction of the CPUs for the preview encoding, the rest is for the detection
+      - uploads: the number of concurrent uploads (these wait on the network, so they don't count as CPUs)
+    :return dict with the number of CPUs and the threads for encoding, detection and uploads
+    """
+    options = dict(default_settings_resources)
+    options.update(settings or {})
+
+    cpus = available_cpus()
+    if options.get('cpus'):
+        cpus = min(cpus, int(options.get('cpus')))
+
+    share = min(max(float(options.get('encoding_share')), 0.0), 1.0)
+    # Both always get at least one thread, even if that means a small oversubscription on a single CPU
+    encoding = max(int(round(cpus * share)), 1)
+    detection = max(cpus - encoding, 1)
+
+    budget = {
+        'cpus': cpus,
+        'encoding': encoding,
+        'detection': detection,
+        'uploads': max(int(options.get('uploads')), 1),
+    }
+    logger.info("CPU budget: %(cpus)d CPUs, %(encoding)d for encoding, %(detection)d for detection, "
+                "%(uploads)d concurrent uploads", budget)
+
+    return budget
@@ -0,0 +1,416 @@
+"""
+Single pass detection engine
+
+The video is decoded once and every analysis frame is handed to any number of detectors. The engine takes care of
+everything the detectors share: decoding (with the downscaling, gray conversion and sampling of the frame source),
+the masks, the screenshots of the slides, the progress and the timing of every detector. This allows to run several
+algorithms (e.g. to compare a new one with the one in production) at the cost of a single decode.
+
+A detector implements the Detector interface: setup() once the analysis frames are known, consume() for every frame
+and finalize() at the end, which returns its slides. A detector that doesn't need a frame (e.g. right after a
+transition) says so with skip(): when none of the detectors needs a frame, it is skipped without converting it into an
+image (also by the prefetching decoder, which is told in advance).
+
+With the follow option the engine reads a recording that is still being written (see FollowFrameSource). The detectors
+keep their state over the whole recording and the screenshots are taken as soon as the decoder passed them, so the
+slides come out while the recording goes on.
+"""
+
+import bisect
+import copy
+import datetime
+import logging
+import time
+
+import cv2  # OpenCV
+import numpy as np
+
+from framesource import FollowFrameSource, PrefetchFrameSource, open_frame_source
+from instrumentation import Instruments
+from masks import analysis_resolution, apply_masks, compile_masks, masked_area, prepare_masks, roi_masks, scale_masks
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# The number of frames at the original resolution the detectors are timed on to report the speedup of the analysis
+# resolution (after one frame to get them started), with the measure_baseline option
+BASELINE_FRAMES = 10
+
+
+class Detector(object):
+    """Interface of the detectors that run on the engine"""
+    name = 'detector'
+    # Whether the detector works on grayscale frames
+    grayscale = False
+
+    def setup(self, engine):  # pylint: disable=unused-argument,no-self-use
+        """
+        Prepare for the analysis frames of the engine (see the attributes of DetectionEngine)
+        :return list of errors in the settings of the detector (empty if there are none)
+        """
+        return []
+
+    def skip(self, index):  # pylint: disable=unused-argument,no-self-use
+        """
+        Check if the detector can do without the analysis frame with the given number. The answer may only change in
+        consume(): the engine asks ahead for the frames after the current one.
+        """
+        return False
+
+    def consume(self, frame, index, timestamp):
+        """
+        Process an analysis frame. The frame is masked (and cropped) and shared with the other detectors, so it must
+        not be changed.
+        :param frame: the analysis frame
+        :param index: the number of the analysis frame
+        :param timestamp: the timestamp of the frame (in msec)
+        """
+        raise NotImplementedError
+
+    def copy(self):  # pylint: disable=no-self-use
+        """A new detector with the same settings that doesn't take screenshots (None if it can't be copied)"""
+        return None
+
+    def finalize(self, final_frame, final_timestamp):
+        """
+        The end of the video (or segment) was reached
+        :param final_frame: the number of the analysis frame after the last one
+        :param final_timestamp: the timestamp of the last frame (in msec)
+        :return list with tuples of frame number, timestamp and path to screenshot of slide
+        """
+        raise NotImplementedError
+
+
+class DetectionEngine(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Decode a video once for a number of detectors. After prepare(), the detectors can use:
+      - frame_size, source_fps, source_num_frames: the resolution, frame rate and number of frames of the video
+      - live: whether the video is a recording that is followed, its length (source_num_frames and num_frames) is
+        only known at the end
+      - analysis_size, scale: the resolution of the analysis frames and the scale compared to the video
+      - fps, frame_step, num_frames: the frame rate and number of analysis frames, every analysis frame covers
+        frame_step frames of the video
+      - source_masks, masks: the masks in pixels of the video and of the analysis frames
+      - cropped_size: the resolution of the frames the detectors get (the masks at the borders are cropped away)
+      - pixels: the number of pixels of the analysis frames that aren't masked
+    """
+
+    def __init__(self, filename, output_dir, options):
+        """
+        :param filename: path to the video
+        :param output_dir: directory to write the screenshots of the slides to
+        :param options: the settings shared by all detectors: masks, roi, analysis_width, decoder, sampling_fps,
+        prefetch, preview_outputs, follow, instruments and measure_baseline (see slide_find_advanced)
+        """
+        self.filename = filename
+        self.output_dir = output_dir
+        self.options = options
+        self.detectors = []
+        # The time of the decoding, the detectors and the screenshots
+        self.instruments = options.get('instruments') or Instruments()
+
+        if options.get('follow'):
+            self.source = FollowFrameSource(filename, options.get('decoder'), options.get('follow'))
+        else:
+            self.source = open_frame_source(filename, options.get('decoder'), options.get('preview_outputs'))
+        self.live = getattr(self.source, 'live', False)
+        self.frame_size = self.source.source_size
+        self.source_fps = self.source.source_fps
+        self.source_num_frames = self.source.source_num_frames
+
+        masks = options.get('masks', [])
+        if not isinstance(masks, list):
+            masks = [masks]
+        self.source_masks = prepare_masks(masks, self.frame_size) + roi_masks(options.get('roi'), self.frame_size)
+
+        # The detection can run on downscaled frames: a slide change is still visible at a fraction of the pixels
+        self.analysis_size, self.scale = analysis_resolution(self.frame_size, options.get('analysis_width'))
+        self.masks = scale_masks(self.source_masks, self.scale)
+        self.crop, self.mask_regions = compile_masks(self.masks, self.analysis_size)
+        self.cropped_size = (self.crop[0].stop - self.crop[0].start, self.crop[1].stop - self.crop[1].start)
+        self.pixels = self.analysis_size[0] * self.analysis_size[1] - masked_area(self.masks, self.analysis_size)
+
+        self.fps = self.source_fps
+        self.frame_step = 1
+        self.num_frames = self.source_num_frames
+        self.grayscale = False
+
+        # Screenshots are taken when the decoder passes their timestamp: sorted list of (timestamp, sequence number,
+        # path, imwrite parameters, callback). The ones without a full frame at hand are taken at the end.
+        self._pending = []
+        self._deferred = []
+        self._sequence = 0
+        self._screenshot_margin = 0.0
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Check if the video could be opened"""
+        return self.source.isOpened()
+
+    def add(self, detector):
+        """Add a detector, must be done before prepare()"""
+        self.detectors.append(detector)
+
+    def prepare(self):
+        """
+        Set up the frame source for the detectors and let them prepare
+        :return list of errors in the settings of the detectors (empty if there are none)
+        """
+        # Decode straight to grayscale when no detector needs the colours
+        self.grayscale = all([detector.grayscale for detector in self.detectors])
+        self.source.set_output(self.analysis_size, grayscale=self.grayscale, fps=self.options.get('sampling_fps'))
+        if self.options.get('prefetch'):
+            self.source = PrefetchFrameSource(self.source, self.options.get('prefetch'))
+        self.fps = self.source.fps
+        self.frame_step = self.source.frame_step
+        self.num_frames = self.source.num_frames
+        # Allow for rounding of the timestamps: a screenshot is due when we are within half a frame of it
+        self._screenshot_margin = 500.0 / self.source_fps
+        logger.debug("Analysis resolution: %s (scale %.3f, grayscale: %s, decoder: %s), sampling every %d frames, "
+                     "detectors: %s", self.analysis_size, self.scale, self.grayscale, self.source.name,
+                     self.frame_step, ', '.join([detector.name for detector in self.detectors]))
+
+        errors = []
+        for detector in self.detectors:
+            errors += detector.setup(self)
+        return errors
+
+    def screenshot(self, timestamp, path, params=None, callback=None):
+        """
+        Write the full resolution frame at the given timestamp to a file, as soon as the decoder reaches it
+        :param timestamp: the timestamp of the frame (in msec)
+        :param path: the file to write the frame to
+        :param params: the parameters for cv2.imwrite
+        :param callback: function that is called with the path once it is written
+        """
+        bisect.insort(self._pending, (timestamp, self._sequence, path, params or [], callback))
+        self._sequence += 1
+        if isinstance(self.source, PrefetchFrameSource):
+            # The decoder is ahead, it has to keep the full frame
+            self.source.want_full_frame(timestamp - self._screenshot_margin)
+
+    def _take_screenshots(self):
+        """Take the screenshots the decoder has passed"""
+        while self._pending and self.source.timestamp >= self._pending[0][0] - self._screenshot_margin:
+            # When sampling, the frame of the screenshot can be one of the frames the decoder skipped
+            frame = None
+            if self.source.timestamp <= self._pending[0][0] + self._screenshot_margin:
+                frame = self.source.full_frame()
+            if frame is None and not self.live:
+                # This decoder can't give us the frame (e.g. ffmpeg, sampling), take the screenshot at the end
+                self._deferred.append(self._pending.pop(0))
+                continue
+            timestamp, _, path, params, callback = self._pending.pop(0)
+            with self.instruments.timer('screenshots'):
+                if frame is None:
+                    # A recording doesn't end any time soon, decode the frame again
+                    written = self.source.save_frame(timestamp, path, params)
+                else:
+                    written = cv2.imwrite(path, frame, params)
+            if written and callback:
+                callback(path)
+
+    def _skipped_until(self, index, end_frame):
+        """The number of the first analysis frame from index on that one of the detectors needs (at most end_frame)"""
+        while index < end_frame:
+            for detector in self.detectors:
+                if not detector.skip(index):
+                    return index
+            index += 1
+        return index
+
+    def _measure_baseline(self):  # pylint: disable=too-many-locals
+        """
+        Time copies of the detectors on a few frames at the original resolution, to compare with the analysis
+        resolution
+        :return tuple with the time per frame of the downscaling and a dict with the time per frame of every detector
+        at the original resolution (empty if none of the detectors could be timed)
+        """
+        # What the detectors see of the engine at the original resolution (without sampling)
+        full = copy.copy(self)
+        full.analysis_size, full.scale, full.masks = self.frame_size, 1.0, self.source_masks
+        full.crop, full.mask_regions = compile_masks(full.masks, full.analysis_size)
+        full.cropped_size = (full.crop[0].stop - full.crop[0].start, full.crop[1].stop - full.crop[1].start)
+        full.pixels = self.frame_size[0] * self.frame_size[1] - masked_area(full.masks, self.frame_size)
+        full.fps, full.frame_step, full.num_frames = self.source_fps, 1, self.source_num_frames
+
+        detectors = [detector.copy() for detector in self.detectors]
+        detectors = [detector for detector in detectors if detector is not None and not detector.setup(full)]
+        if not detectors:
+            return 0.0, {}
+
+        source = open_frame_source(self.filename, self.options.get('decoder'))
+        source.set_output(grayscale=self.grayscale)
+        times = dict([(detector.name, 0.0) for detector in detectors])
+        resize_time = 0.0
+        frames = 0
+        timestamp = 0.0
+        convert = not self.grayscale and any(detector.grayscale for detector in detectors)
+        for index in range(BASELINE_FRAMES + 1):
+            frame = source.read()
+            if frame is None:
+                break
+            timestamp = source.timestamp
+
+            # The first frame only gets the detectors started (e.g. the index 0 transition), it isn't timed
+            start_time = time.time()
+            cv2.resize(frame, (self.analysis_size[1], self.analysis_size[0]), interpolation=cv2.INTER_AREA)
+            if index > 0:
+                resize_time += time.time() - start_time
+
+            frame = apply_masks(frame, full.crop, full.mask_regions)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if convert else None
+            for detector in detectors:
+                start_time = time.time()
+                detector.consume(gray if detector.grayscale and gray is not None else frame, index, timestamp)
+                if index > 0:
+                    times[detector.name] += time.time() - start_time
+            frames = index
+
+        for detector in detectors:
+            detector.finalize(frames + 1, timestamp)
+        source.release()
+        if not frames:
+            return 0.0, {}
+
+        return resize_time / frames, dict([(name, total / frames) for name, total in times.items()])
+
+    def run(self, start_frame=0, stop_frame=None):  # pylint: disable=too-many-locals,too-many-branches
+        """
+        Decode the analysis frames and hand them to the detectors
+        :param start_frame: the number of the first analysis frame
+        :param stop_frame: the number of the analysis frame to stop at (None for the end of the video)
+        :return dict with the slides of every detector (by name)
+        """
+        source = self.source
+        if start_frame > 0:
+            source.seek(start_frame)
+
+        # When the frames aren't decoded to grayscale, the grayscale detectors share a converted copy
+        gray = None
+        if not self.grayscale and any(detector.grayscale for detector in self.detectors):
+            gray = np.zeros(self.cropped_size, np.uint8)
+        analysis_time = dict([(detector.name, 0.0) for detector in self.detectors])
+        analysed_frames = dict([(detector.name, 0) for detector in self.detectors])
+        skipped_frames = 0
+        decoded_frames = 0
+        decode_time = 0.0
+
+        end_frame = self.num_frames if stop_frame is None else min(stop_frame, self.num_frames)
+        progress_step = max(round((end_frame - start_frame) / 100.0), 1)
+        if self.live:
+            # The length of a recording isn't known, log every minute of the recording instead
+            progress_step = max(int(round(60 * self.fps)), 1)
+        self.instruments.progress(0, end_frame - start_frame)
+        percent_processed = 0
+        frame_index = start_frame
+        timestamp = 0.0
+        # The detectors that want the frame, the list is reused for every frame
+        detectors = []
+        prefetch = isinstance(source, PrefetchFrameSource)
+        # The number of frames in the container is not always exact, without stop_frame the video is read to the end
+        while stop_frame is None or frame_index < stop_frame:
+            del detectors[:]
+            convert = False
+            for detector in self.detectors:
+                if not detector.skip(frame_index):
+                    detectors.append(detector)
+                    convert = convert or detector.grayscale
+            if not detectors:
+                # Don't do any of the hard work: the frame is skipped without converting it into an image
+                start_time = time.time()
+                grabbed = source.grab()
+                decode_time += time.time() - start_time
+                if not grabbed:
+                    break
+                timestamp = source.timestamp
+                skipped_frames += 1
+            else:
+                start_time = time.time()
+                frame = source.read()
+                decode_time += time.time() - start_time
+                if frame is None:
+                    break
+                decoded_frames += 1
+
+                timestamp = source.timestamp
+                frame = apply_masks(frame, self.crop, self.mask_regions)
+                if gray is not None and convert:
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+                for detector in detectors:
+                    start_time = time.time()
+                    detector.consume(gray if detector.grayscale and gray is not None else frame, frame_index,
+                                     timestamp)
+                    analysis_time[detector.name] += time.time() - start_time
+                    analysed_frames[detector.name] += 1
+
+                if prefetch:
+                    # The decoder is ahead: tell it which of the next frames the detectors skip (e.g. the ignore
+                    # window after a transition) so it doesn't convert them into images either. Nothing changes the
+                    # state of the detectors until they get a frame again, so the skipped frames are known now.
+                    source.grab_until(self._skipped_until(frame_index + 1, end_frame))
+
+            # Grab the slide images as soon as we pass them
+            self._take_screenshots()
+
+            # Let people know how far along we are
+            frame_index += 1
+            if (frame_index - start_frame) % progress_step == 0:
+                if self.live:
+                    logger.debug("Processed %s of the recording", datetime.timedelta(milliseconds=int(timestamp)))
+                else:
+                    percent_processed += 1
+                    logger.debug("Processed at %3d %%", percent_processed)
+                    self.instruments.progress(frame_index - start_frame, end_frame - start_frame)
+
+        # On request, the speedup of the analysis resolution is measured against the detectors at the original
+        # resolution (once, on the first segment). This decodes the start of the video again, so it is off by default.
+        resize_time, baseline = 0.0, {}
+        if self.options.get('measure_baseline') and self.scale < 1 and start_frame == 0 and not self.live and \
+                any(analysed_frames.values()):
+            resize_time, baseline = self._measure_baseline()
+        for detector in self.detectors:
+            if not analysed_frames[detector.name]:
+                continue
+            frame_time = analysis_time[detector.name] / analysed_frames[detector.name]
+            logger.info("Detector %s on %d frames at %dx%d took %.2f s (%.1f frames/s)", detector.name,
+                        analysed_frames[detector.name], self.analysis_size[1], self.analysis_size[0],
+                        analysis_time[detector.name], 1.0 / max(frame_time, 1e-6))
+            if detector.name in baseline:
+                logger.info("Detector %s at %dx%d is %.1fx faster than at %dx%d (%.2f ms per frame including %.2f ms "
+                            "to downscale, against %.2f ms)", detector.name, self.analysis_size[1],
+                            self.analysis_size[0], baseline[detector.name] / max(frame_time + resize_time, 1e-6),
+                            self.frame_size[1], self.frame_size[0], 1000 * (frame_time + resize_time),
+                            1000 * resize_time, 1000 * baseline[detector.name])
+        logger.debug("Skipped %d frames without decoding them into images", skipped_frames)
+        self.instruments.add_time('decode', decode_time, decoded_frames + skipped_frames)
+        for detector in self.detectors:
+            self.instruments.add_time('detector:' + detector.name, analysis_time[detector.name],
+                                      analysed_frames[detector.name])
+        self.instruments.count('frames_decoded', decoded_frames)
+        self.instruments.count('frames_skipped', skipped_frames)
+
+        # Grab the slide images we couldn't take while decoding (e.g. the offset runs past the end of the video). The
+        # timestamp of the source isn't valid anymore after a failed read, the video ends at the last frame we got.
+        final_timestamp = timestamp
+        for timestamp, _, path, params, callback in sorted(self._deferred + self._pending):
+            with self.instruments.timer('screenshots'):
+                written = source.save_frame(timestamp, path, params)
+            if written and callback:
+                callback(path)
+        self._pending = []
+        self._deferred = []
+
+        if self.live:
+            # Now we know the length of the recording
+            self.source_num_frames = source.source_num_frames
+            self.num_frames = source.num_frames
+        if self.frame_step > 1 and frame_index > start_frame:
+            # The last analysis frame stands for the frames up to the next sample, the video ends at the last of them
+            last_frame = (frame_index - 1) * self.frame_step
+            covered = min(self.frame_step - 1, self.source_num_frames - 1 - last_frame)
+            final_timestamp += max(covered, 0) * 1000.0 / self.source_fps
+        slides = dict([(detector.name, detector.finalize(frame_index, final_timestamp))
+                       for detector in self.detectors])
+        source.release()
+
+        return slides
@@ -0,0 +1,38 @@
+"""
+The settings file of the extractor
+
+The extractor reads config/settings.yml for every job. The tools next to it (e.g. video-tune.py) read the same file,
+so they analyse the videos with the masks and settings the extractor used.
+"""
+
+import os
+
+import yaml
+
+# The settings file of the extractor
+DEFAULT_SETTINGS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config', 'settings.yml')
+
+
+def read_settings_file(filename=None):
+    """
+    Read the settings of the extractor
+    :param filename: path to the settings file (None for the settings file of the extractor)
+    :return dict with the settings, raises IOError or yaml.YAMLError if the file can't be read or parsed
+    """
+    with open(filename or DEFAULT_SETTINGS_FILE, 'r') as settingsfile:
+        return yaml.safe_load(settingsfile) or {}
+
+
+def algorithm_settings(settings, algorithm, defaults):
+    """
+    The settings of an algorithm in the settings of the extractor, like the extractor uses them
+    :param settings: the settings of the extractor (see read_settings_file)
+    :param algorithm: the name of the algorithm
+    :param defaults: the default settings of the algorithm, the other settings are left out
+    :return dict with the settings of the algorithm (the defaults if the extractor uses another algorithm)
+    """
+    result = dict(defaults)
+    slides = settings.get('slides')
+    if slides and slides[0].get('algorithm', 'advanced') == algorithm:
+        result.update(dict([(key, value) for key, value in slides[0].items() if key in defaults]))
+    return result
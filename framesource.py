@@ -0,0 +1,918 @@
+"""
+Frame sources for the slide transition detection
+
+A frame source decodes a video and hands out the frames the detection algorithms work on (the 'analysis frames'),
+which can be downscaled and/or converted to grayscale. Two backends are available:
+  - opencv: decodes with cv2.VideoCapture (requires an OpenCV build with ffmpeg support)
+  - ffmpeg: runs ffmpeg as a subprocess which does the decoding, scaling and pixel format conversion and sends the
+    raw frames through a pipe. This moves all the decoding work to a separate process (which uses its own threads).
+
+Both backends can also sample the video at a lower frame rate: only every `frame_step`-th frame of the video is
+then handed out. `position` is the number of analysis frames read so far (analysis frame i is frame
+i * frame_step of the video) and `timestamp` is the presentation time (in milliseconds) of the last frame that was
+read, like CAP_PROP_POS_MSEC of cv2.VideoCapture.
+
+The ffmpeg backend can also write extra outputs (e.g. the compressed previews) from the same decoded frames, so the
+video only has to be decoded once.
+
+Any frame source can be wrapped in a PrefetchFrameSource, which decodes the frames in a separate thread while the
+detection works on the previous ones. A FollowFrameSource reads a recording that is still being written.
+"""
+
+import bisect
+import glob
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+import cv2  # OpenCV
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+
+from videoinput import redact_url
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def probe_video(filename, ffprobe='ffprobe'):
+    """
+    Get the basic properties of the first video stream in a file using ffprobe
+    :param filename: path to the video
+    :param ffprobe: the ffprobe executable to use
+    :return dict with width, height, fps and num_frames
+    """
+    command = [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate,nb_frames,duration:format=duration',
+               '-of', 'json', filename]
+    output = json.loads(subprocess.check_output(command).decode('utf-8'))
+
+    streams = output.get('streams', [])
+    if not streams:
+        raise ValueError("No video stream found in %s" % redact_url(filename))
+    stream = streams[0]
+
+    def parserate(rate):
+        """handle rates like 30000/1001"""
+        num, _, den = str(rate).partition('/')
+        try:
+            return float(num) / float(den or 1)
+        except (ValueError, ZeroDivisionError):
+            return 0.0
+
+    fps = parserate(stream.get('avg_frame_rate')) or parserate(stream.get('r_frame_rate'))
+
+    try:
+        num_frames = int(stream['nb_frames'])
+    except (KeyError, ValueError):
+        # Not all containers (e.g. webm) store the number of frames, estimate it from the duration
+        duration = stream.get('duration', output.get('format', {}).get('duration', 0))
+        num_frames = int(round(float(duration) * fps))
+
+    return {
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'fps': fps,
+        'num_frames': num_frames,
+    }
+
+
+def sampling_step(source_fps, fps):
+    """
+    Determine how many frames of the video are covered by one analysis frame
+    :param source_fps: the frame rate of the video
+    :param fps: the requested sampling rate (0 or None to keep every frame)
+    """
+    if not fps or fps >= source_fps:
+        return 1
+
+    return max(int(round(source_fps / fps)), 1)
+
+
+class OpenCVFrameSource(object):
+    """Decode the frames with cv2.VideoCapture, downscaling and gray conversion is done in OpenCV"""
+    name = 'opencv'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.cap = cv2.VideoCapture(filename)
+
+        self.source_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        self.source_fps = self.cap.get(cv2.CAP_PROP_FPS)  # Assuming non-variable FPS
+        self.source_num_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.source_fps
+        self.num_frames = self.source_num_frames
+
+        self.frame_size = self.source_size
+        self.grayscale = False
+        self.frame_step = 1
+        self.position = 0
+
+        self._skip = False
+        self._frame = None
+        self._gray = None
+        self._buffer = None
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Check if the video could be opened"""
+        return self.cap.isOpened()
+
+    def set_output(self, frame_size=None, grayscale=False, fps=None):
+        """
+        Set the resolution, pixel format and frame rate of the analysis frames. Must be called before reading any
+        frame.
+        :param frame_size: tuple (height, width) of the analysis frames (None for the original resolution)
+        :param grayscale: convert the analysis frames to grayscale
+        :param fps: only hand out frames at (approximately) this frame rate (None to keep every frame)
+        """
+        self.frame_size = tuple(frame_size or self.source_size)
+        self.grayscale = grayscale
+        self.frame_step = sampling_step(self.source_fps, fps)
+        self.fps = self.source_fps / self.frame_step
+        self.num_frames = int(np.ceil(self.source_num_frames / float(self.frame_step)))
+
+    @property
+    def timestamp(self):
+        """The timestamp (in msec) of the last frame read"""
+        return self.cap.get(cv2.CAP_PROP_POS_MSEC)
+
+    def seek(self, position):
+        """
+        Continue reading from the given analysis frame. This is slow (the decoder restarts from the previous keyframe)
+        so only use it sparingly.
+        :param position: index of the analysis frame
+        """
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, position * self.frame_step)
+        self.position = position
+        self._skip = False
+
+    def _skip_samples(self):
+        """Skip the frames between two samples: grab() doesn't convert them into an image"""
+        if self._skip:
+            for _ in range(self.frame_step - 1):
+                if not self.cap.grab():
+                    return False
+
+        self._skip = True
+        return True
+
+    def grab(self):
+        """Skip the next analysis frame: it is decoded but never converted into an image"""
+        if not self._skip_samples() or not self.cap.grab():
+            return False
+
+        self.position += 1
+        return True
+
+    def read(self):
+        """
+        Read the next analysis frame
+        :return the frame or None at the end of the video. The frame is only valid until the next call to read.
+        """
+        if not self._skip_samples():
+            return None
+
+        ret, self._frame = self.cap.read(self._frame)
+        if not ret:
+            return None
+
+        self.position += 1
+
+        # All conversions write into buffers that are reused for every frame
+        frame = self._frame
+        if self.grayscale:
+            self._gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            frame = self._gray
+        if self.frame_size != self.source_size:
+            self._buffer = cv2.resize(frame, (self.frame_size[1], self.frame_size[0]), dst=self._buffer,
+                                      interpolation=cv2.INTER_AREA)
+            frame = self._buffer
+
+        return frame
+
+    def full_frame(self):
+        """
+        The last frame read or grabbed at the original resolution in BGR (or None if not available). The frame is
+        converted again, so it is not affected by any changes made to the analysis frame.
+        """
+        ret, frame = self.cap.retrieve()
+        return frame if ret else None
+
+    def save_frame(self, timestamp, path, params=None):
+        """
+        Save the frame at a given time to disk (at the original resolution). This changes the position in the video.
+        :param timestamp: time in the video (in msec)
+        :param path: where to write the image
+        :param params: extra parameters for cv2.imwrite
+        """
+        self.cap.set(cv2.CAP_PROP_POS_MSEC, timestamp)
+        ret, frame = self.cap.read()
+        if not ret:
+            logger.error("Failed to grab frame at %s msec from %s", timestamp, redact_url(self.filename))
+            return False
+
+        return cv2.imwrite(path, frame, params or [])
+
+    def release(self):
+        """Close the video"""
+        self.cap.release()
+
+
+class FFmpegFrameSource(object):
+    """
+    Decode the frames in an ffmpeg subprocess which also does the downscaling, gray conversion and (optionally)
+    frame rate decimation. The raw frames are read from a pipe into a reused buffer. Seeking restarts ffmpeg.
+
+    Extra outputs are written by the same ffmpeg process. They are only complete if the video is read from the
+    start without seeking after the first frame: release() reads the remainder of the video to finish them.
+    """
+    name = 'ffmpeg'
+
+    def __init__(self, filename, ffmpeg='ffmpeg', ffprobe='ffprobe', outputs=None, follow=0):  # pylint: disable=too-many-arguments
+        """
+        :param filename: path to the video
+        :param ffmpeg: the ffmpeg executable to use
+        :param ffprobe: the ffprobe executable to use
+        :param outputs: list of extra outputs for ffmpeg, every output is a list with its options and file name
+        :param follow: keep reading the file while it is being written, until no new data arrived for this many
+        seconds (0 for a finished file)
+        """
+        self.filename = filename
+        self.ffmpeg = ffmpeg
+        self.outputs = outputs or []
+        self.follow = follow
+
+        try:
+            info = probe_video(filename, ffprobe=ffprobe)
+        except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as err:
+            logger.error("Failed to probe %s: %s", redact_url(filename), err)
+            info = None
+
+        self._opened = info is not None
+        info = info or {'width': 0, 'height': 0, 'fps': 0.0, 'num_frames': 0}
+
+        self.source_size = (info['height'], info['width'])
+        self.source_fps = info['fps']
+        self.source_num_frames = info['num_frames']
+        self.fps = self.source_fps
+        self.num_frames = self.source_num_frames
+
+        self.frame_size = self.source_size
+        self.grayscale = False
+        self.frame_step = 1
+        self.position = 0
+
+        self._proc = None
+        self._stderr = None
+        self._buffer = None
+        self._frame = None
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Check if the video could be opened"""
+        return self._opened
+
+    def set_output(self, frame_size=None, grayscale=False, fps=None):
+        """
+        Set the resolution, pixel format and frame rate of the analysis frames. Must be called before reading any
+        frame.
+        :param frame_size: tuple (height, width) of the analysis frames (None for the original resolution)
+        :param grayscale: let ffmpeg convert the analysis frames to grayscale
+        :param fps: let ffmpeg decimate the video to (approximately) this frame rate (None to keep every frame)
+        """
+        self.frame_size = tuple(frame_size or self.source_size)
+        self.grayscale = grayscale
+        self.frame_step = sampling_step(self.source_fps, fps)
+        self.fps = self.source_fps / self.frame_step
+        self.num_frames = int(np.ceil(self.source_num_frames / float(self.frame_step)))
+
+    @property
+    def timestamp(self):
+        """The timestamp (in msec) of the last frame read"""
+        return max(self.position - 1, 0) * self.frame_step * 1000.0 / self.source_fps
+
+    def seek(self, position):
+        """
+        Continue reading from the given analysis frame. This restarts the decoder so only use it sparingly.
+        :param position: index of the analysis frame
+        """
+        self._stop()
+        self.position = position
+
+    def _start(self):
+        """Start the ffmpeg decoder"""
+        filters = []
+        if self.frame_step > 1:
+            # select the exact frames instead of the fps filter so the frame indices match the original video
+            filters.append('select=not(mod(n\\,%d))' % self.frame_step)
+        if self.frame_size != self.source_size:
+            filters.append('scale=%d:%d:flags=area' % (self.frame_size[1], self.frame_size[0]))
+
+        command = [self.ffmpeg, '-loglevel', 'error', '-nostdin']
+        if self.position:
+            # Input seeking is frame accurate when transcoding, aim half a frame early to avoid rounding issues
+            start = (self.position * self.frame_step - 0.5) / self.source_fps
+            command += ['-ss', '%.3f' % start]
+        if self.follow:
+            # Wait for more data at the end of the file, it ends when the file stopped growing
+            command += ['-follow', '1', '-rw_timeout', str(int(self.follow * 1000000))]
+        command += ['-i', self.filename]
+        for output in self.outputs:
+            command += output
+        command += ['-an', '-sn']
+        if filters:
+            command += ['-vf', ','.join(filters)]
+        # Make sure ffmpeg doesn't duplicate or drop frames, we want exactly the frames in the video
+        command += ['-vsync', 'passthrough', '-pix_fmt', 'gray' if self.grayscale else 'bgr24', '-f', 'rawvideo', 'pipe:1']
+        logger.debug("Starting decoder: %s", ' '.join([redact_url(part) for part in command]))
+
+        channels = 1 if self.grayscale else 3
+        shape = self.frame_size if self.grayscale else self.frame_size + (channels,)
+        self._buffer = bytearray(self.frame_size[0] * self.frame_size[1] * channels)
+        self._frame = np.frombuffer(self._buffer, dtype=np.uint8).reshape(shape)
+
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self._stderr,
+                                      bufsize=len(self._buffer))
+
+    def _fill(self):
+        """Read one complete frame from the pipe into the buffer"""
+        view = memoryview(self._buffer)
+        filled = 0
+        while filled < len(self._buffer):
+            count = self._proc.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+
+        return True
+
+    def grab(self):
+        """Skip the next analysis frame, the frame data is read from the pipe but not returned"""
+        if self._proc is None:
+            self._start()
+
+        if not self._fill():
+            return False
+
+        self.position += 1
+        return True
+
+    def read(self):
+        """
+        Read the next analysis frame
+        :return the frame or None at the end of the video. The frame is only valid until the next call to read.
+        """
+        if not self.grab():
+            return None
+
+        return self._frame
+
+    def full_frame(self):  # pylint: disable=no-self-use
+        """The decoder only produces analysis frames, use save_frame to get frames at the original resolution"""
+        return None
+
+    def save_frame(self, timestamp, path, params=None):  # pylint: disable=unused-argument
+        """
+        Save the frame at a given time to disk (at the original resolution) with a separate ffmpeg process.
+        :param timestamp: time in the video (in msec)
+        :param path: where to write the image
+        :param params: ignored, only for compatibility with OpenCVFrameSource
+        """
+        command = [self.ffmpeg, '-loglevel', 'error', '-nostdin', '-y', '-ss', '%.3f' % (timestamp / 1000.0),
+                   '-i', self.filename, '-frames:v', '1', '-q:v', '2', path]
+        try:
+            subprocess.check_output(command, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError) as err:
+            logger.error("Failed to grab frame at %s msec from %s: %s", timestamp, redact_url(self.filename), err)
+            return False
+
+        return os.path.exists(path)
+
+    def release(self):
+        """Stop the decoder. With extra outputs, the rest of the video is decoded first to complete them."""
+        if self.outputs and self._opened:
+            if self._proc is None:
+                self._start()
+            self._drain()
+        self._stop()
+
+    def _drain(self):
+        """Read the pipe until ffmpeg is done with the video"""
+        logger.debug("Decoding the rest of %s to finish the extra outputs", redact_url(self.filename))
+        while self._proc.stdout.read(1 << 20):
+            pass
+
+    def _stop(self):
+        """Stop the ffmpeg process (if running)"""
+        if self._proc is None:
+            return
+
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.stdout.close()
+        if self._proc.wait() > 0:
+            self._stderr.seek(0)
+            logger.error("Decoder for %s failed: %s", redact_url(self.filename),
+                         redact_url(self._stderr.read().decode('utf-8', 'replace')))
+        self._stderr.close()
+        self._proc = None
+
+
+class PrefetchFrameSource(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Decode the frames of another frame source in a separate thread. Decoding and the detection both release the GIL,
+    so they run in parallel. The decoded frames are copied into a ring of reused buffers: when all buffers are full
+    the decoder waits for the detection (and the other way around when they are all empty).
+
+    The decoder is ahead of the detection, so it only skips frames without converting them into images when it is told
+    in advance with grab_until (otherwise grab() skips a frame that was already decoded). Likewise the full frames that
+    are needed (for the screenshots) have to be asked for in advance with want_full_frame: they are copied into the ring together with the analysis frame, if the wrapped frame source has
+    them. release() logs how full the ring was on average and who waited for whom, which tells if the decoding or the
+    detection is the bottleneck.
+    """
+
+    def __init__(self, source, depth=8):
+        """
+        :param source: the frame source to decode the frames with (set_output can still be called on the wrapper)
+        :param depth: the number of frames that can be decoded ahead
+        """
+        self.source = source
+        self.name = source.name + '+prefetch'
+        self.filename = source.filename
+        self.depth = max(depth, 2)
+
+        self.source_size = source.source_size
+        self.source_fps = source.source_fps
+        self.source_num_frames = source.source_num_frames
+        self._copy_output()
+
+        self.position = source.position
+        self.timestamp = 0.0
+
+        self._buffers = [None] * self.depth
+        self._full_buffers = [None] * self.depth
+        # Sorted timestamps (in msec) of the full frames that are needed, and whether the current frame has one
+        self._wanted = []
+        self._wanted_lock = threading.Lock()
+        self._current_full = False
+        self._current_grabbed = False
+        # The analysis frames before this position are only grabbed by the decoder
+        self._grab_until = 0
+        self._free = None
+        self._filled = None
+        self._thread = None
+        self._stop_decoder = threading.Event()
+        self._current = None
+
+        self.frames = 0
+        self.occupancy = 0
+        self.read_wait = 0.0
+        self.decode_wait = 0.0
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Check if the video could be opened"""
+        return self.source.isOpened()
+
+    def set_output(self, frame_size=None, grayscale=False, fps=None):
+        """Set the resolution, pixel format and frame rate of the analysis frames (see the wrapped frame source)"""
+        self.source.set_output(frame_size, grayscale, fps)
+        self._copy_output()
+
+    def _copy_output(self):
+        """Take over the output settings of the wrapped frame source"""
+        self.frame_size = self.source.frame_size
+        self.grayscale = self.source.grayscale
+        self.frame_step = self.source.frame_step
+        self.fps = self.source.fps
+        self.num_frames = self.source.num_frames
+
+    def seek(self, position):
+        """Continue reading from the given analysis frame, the frames decoded ahead are dropped"""
+        self._stop()
+        self.source.seek(position)
+        self.position = position
+        self._grab_until = 0
+
+    def _start(self):
+        """Start the decoder thread with all buffers free"""
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        for idx in range(self.depth):
+            self._free.put(idx)
+        self._stop_decoder.clear()
+        self._current = None
+        self._thread = threading.Thread(target=self._decode, name='prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _decode(self):
+        """
+        The decoder thread: fill the free buffers with the next frames (or only grab them, see grab_until). Puts None
+        in the queue at the end of the video and the exception if decoding fails.
+        """
+        failed = False
+        try:
+            while True:
+                start_time = time.time()
+                idx = self._free.get()
+                self.decode_wait += time.time() - start_time
+                if self._stop_decoder.is_set():
+                    return
+
+                grabbed = self.source.position < self._grab_until
+                if grabbed:
+                    frame = None
+                    if not self.source.grab():
+                        self._filled.put(None)
+                        return
+                else:
+                    frame = self.source.read()
+                    if frame is None:
+                        self._filled.put(None)
+                        return
+
+                    if self._buffers[idx] is None or self._buffers[idx].shape != frame.shape:
+                        self._buffers[idx] = np.empty_like(frame)
+                    np.copyto(self._buffers[idx], frame)
+                timestamp = self.source.timestamp
+                self._filled.put((idx, self.source.position, timestamp, self._copy_full_frame(idx, timestamp),
+                                  grabbed))
+        except Exception as err:  # pylint: disable=broad-except
+            failed = True
+            self._filled.put(err)
+        finally:
+            if failed:
+                # Nothing reads from the video anymore, the caller gets the exception and may never release us
+                self.source.release()
+
+    def _copy_full_frame(self, idx, timestamp):
+        """In the decoder thread: copy the full frame into the ring if it is needed, returns whether it was copied"""
+        with self._wanted_lock:
+            if not self._wanted or self._wanted[0] > timestamp:
+                return False
+            while self._wanted and self._wanted[0] <= timestamp:
+                self._wanted.pop(0)
+
+        frame = self.source.full_frame()
+        if frame is None:
+            return False
+        if self._full_buffers[idx] is None or self._full_buffers[idx].shape != frame.shape:
+            self._full_buffers[idx] = np.empty_like(frame)
+        np.copyto(self._full_buffers[idx], frame)
+        return True
+
+    def want_full_frame(self, timestamp):
+        """
+        Ask for the full frame of the first frame at or after the given time, full_frame returns it when that frame
+        is read. It is only available if the decoder hasn't passed that time yet.
+        :param timestamp: time in the video (in msec)
+        """
+        with self._wanted_lock:
+            bisect.insort(self._wanted, timestamp)
+
+    def grab_until(self, position):
+        """
+        Tell the decoder that the analysis frames before the given position will be skipped with grab(), so it doesn't
+        convert them into images. Those frames can't be read anymore.
+        :param position: index of the first analysis frame that is read again
+        """
+        self._grab_until = max(self._grab_until, position)
+
+    def _next(self):
+        """
+        Take the next frame of the decoder
+        :return True if it is there, False at the end of the video
+        """
+        if self._thread is None:
+            self._start()
+
+        # The buffer of the previous frame can be filled again
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+
+        self.occupancy += self._filled.qsize()
+        start_time = time.time()
+        item = self._filled.get()
+        self.read_wait += time.time() - start_time
+        if isinstance(item, Exception):
+            # Keep the end of the video for the next reads
+            self._filled.put(None)
+            raise item
+        if item is None:
+            self._filled.put(None)
+            return False
+
+        self._current, self.position, self.timestamp, self._current_full, self._current_grabbed = item
+        self.frames += 1
+        return True
+
+    def read(self):
+        """
+        Read the next analysis frame
+        :return the frame or None at the end of the video. The frame is only valid until the next call to read.
+        """
+        if not self._next():
+            return None
+        if self._current_grabbed:
+            raise ValueError("Analysis frame %d was only grabbed by the decoder (see grab_until)" % (self.position - 1))
+
+        return self._buffers[self._current]
+
+    def grab(self):
+        """Skip the next analysis frame"""
+        return self._next()
+
+    def full_frame(self):
+        """
+        The last frame read at the original resolution in BGR, if it was asked for with want_full_frame (otherwise
+        None). The frame is only valid until the next call to read.
+        """
+        if self._current is None or not self._current_full:
+            return None
+
+        return self._full_buffers[self._current]
+
+    def save_frame(self, timestamp, path, params=None):
+        """Save the frame at a given time to disk (at the original resolution), this stops the decoder thread"""
+        self._stop()
+        return self.source.save_frame(timestamp, path, params)
+
+    def release(self):
+        """Stop the decoder thread and close the video"""
+        self._stop()
+        self.source.release()
+
+    def _stop(self):
+        """Stop the decoder thread (if running) and log the statistics of the ring"""
+        if self._thread is None:
+            return
+
+        self._stop_decoder.set()
+        # Wake the decoder up if it is waiting for a free buffer
+        self._free.put(None)
+        self._thread.join()
+        self._thread = None
+
+        if self.frames:
+            average = self.occupancy / float(self.frames)
+            logger.info("Prefetched %d frames, on average %.1f of %d buffers were filled, the detection waited %.2f s "
+                        "for the decoder and the decoder %.2f s for the detection (%s is the bottleneck)", self.frames,
+                        average, self.depth, self.read_wait, self.decode_wait,
+                        'decoding' if self.read_wait > self.decode_wait else 'detection')
+        self.frames = 0
+        self.occupancy = 0
+        self.read_wait = 0.0
+        self.decode_wait = 0.0
+
+
+class FollowFrameSource(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Follow a recording while it is being written, as one video: a growing file or a sequence of segment files (a glob
+    pattern like /recordings/lecture-*.mkv, the segments are read in the order of their names). The recording has
+    ended when no new data arrived for idle_timeout seconds.
+
+    A growing file is decoded by ffmpeg as it grows, so its container must be readable while it is written (e.g.
+    MPEG-TS or Matroska, not mp4). A segment is decoded with the chosen decoder once it is complete: when a next
+    segment appeared or it didn't grow for idle_timeout seconds. The timestamps continue over the segments, the
+    sampling of the frames starts again at every segment.
+
+    The length of the recording isn't known in advance: source_num_frames and num_frames are the frames read so far.
+    Screenshots are taken with save_frame as soon as the frame was decoded, which reads the segment again.
+    """
+    name = 'follow'
+    live = True
+    # How often to look for new data (in seconds)
+    poll_interval = 1.0
+
+    def __init__(self, path, decoder='opencv', idle_timeout=60.0):
+        """
+        :param path: path to the growing file or glob pattern of the segment files
+        :param decoder: the frame source for the segments: opencv or ffmpeg (a growing file always uses ffmpeg)
+        :param idle_timeout: the recording has ended when no new data arrived for this many seconds
+        """
+        self.filename = path
+        self.decoder = decoder
+        self.idle_timeout = idle_timeout
+        self.segmented = glob.has_magic(path)
+        if not self.segmented and decoder != FFmpegFrameSource.name:
+            logger.info("A growing file can only be followed with the %s decoder", FFmpegFrameSource.name)
+
+        # The segments opened so far with the number of frames before them
+        self.segments = []
+        self._segment = None
+        self._frames = 0
+        self._output = (None, False, None)
+        self._last_change = time.time()
+        self._sizes = {}
+
+        self.frame_size = self.source_size = (0, 0)
+        self.source_fps = self.fps = 0.0
+        self.grayscale = False
+        self.frame_step = 1
+        self.position = 0
+        if self._open_next():
+            self.source_size = self.frame_size = self._segment.source_size
+            self.source_fps = self.fps = self._segment.source_fps
+
+    @property
+    def source_num_frames(self):
+        """The number of frames read so far"""
+        if self._segment is None:
+            return self._frames
+        return self._frames + self._segment.position * self._segment.frame_step
+
+    @property
+    def num_frames(self):
+        """The number of analysis frames read so far"""
+        return self.position
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Check if the first segment could be opened"""
+        return self.source_fps > 0
+
+    def set_output(self, frame_size=None, grayscale=False, fps=None):
+        """Set the resolution, pixel format and frame rate of the analysis frames of all segments"""
+        self._output = (frame_size, grayscale, fps)
+        self.frame_size = tuple(frame_size or self.source_size)
+        self.grayscale = grayscale
+        self.frame_step = sampling_step(self.source_fps, fps)
+        self.fps = self.source_fps / self.frame_step
+        if self._segment is not None:
+            self._segment.set_output(*self._output)
+
+    @property
+    def timestamp(self):
+        """The timestamp (in msec) of the last frame read"""
+        if self._segment is None or not self.source_fps:
+            return 0.0
+        return (self._frames + max(self._segment.position - 1, 0) * self.frame_step) * 1000.0 / self.source_fps
+
+    def seek(self, position):  # pylint: disable=no-self-use
+        """A recording that is followed is read from start to end"""
+        raise ValueError("Can't seek to frame %d in a recording that is followed" % position)
+
+    def _changed(self, name):
+        """Check if a file grew since the last time we looked"""
+        try:
+            size = os.path.getsize(name)
+        except OSError:
+            return False
+        changed = self._sizes.get(name) != size
+        self._sizes[name] = size
+        if changed:
+            self._last_change = time.time()
+        return changed
+
+    def _next_segment(self):
+        """Wait for the next complete segment (or the growing file), None when the recording has ended"""
+        while True:
+            if not self.segmented:
+                # A growing file is a single segment, which can be read as soon as it has data
+                if self.segments:
+                    return None
+                self._changed(self.filename)
+                if self._sizes.get(self.filename):
+                    return self.filename
+                names = []
+            else:
+                last = self.segments[-1][0] if self.segments else None
+                names = [name for name in sorted(glob.glob(self.filename)) if last is None or name > last]
+                if len(names) > 1:
+                    # The writer moved on to the next segment
+                    return names[0]
+                if names:
+                    self._changed(names[0])
+
+            if time.time() - self._last_change >= self.idle_timeout:
+                # The last segment stopped growing, or nothing arrived at all
+                return names[0] if names else None
+            time.sleep(self.poll_interval)
+
+    def _open_next(self):
+        """Open the next segment, False when the recording has ended"""
+        if self._segment is not None:
+            if self.segmented and self.frame_step > 1 and self._segment.source_num_frames:
+                # The last sampled frame isn't the last frame of the segment
+                self._frames += self._segment.source_num_frames
+            else:
+                self._frames += self._segment.position * self.frame_step
+            self._segment.release()
+            self._segment = None
+
+        while True:
+            name = self._next_segment()
+            if name is None:
+                logger.info("The recording %s ended after %d frames", redact_url(self.filename), self._frames)
+                return False
+
+            if self.segmented:
+                segment = open_frame_source(name, self.decoder)
+            else:
+                segment = FFmpegFrameSource(name, follow=self.idle_timeout)
+            if segment.isOpened():
+                break
+            segment.release()
+            if self.segmented:
+                logger.error("Failed to open segment %s, skipping it", name)
+                self.segments.append((name, self._frames))
+            elif time.time() - self._last_change >= self.idle_timeout:
+                logger.error("Failed to open %s", name)
+                return False
+            else:
+                # Not enough of the file was written yet to find the video stream
+                time.sleep(self.poll_interval)
+
+        logger.debug("Following %s from frame %d", name, self._frames)
+        self.segments.append((name, self._frames))
+        segment.set_output(*self._output)
+        self._segment = segment
+        return True
+
+    def grab(self):
+        """Skip the next analysis frame, waiting for the next segment at the end of a segment"""
+        while self._segment is not None:
+            if self._segment.grab():
+                self.position += 1
+                return True
+            self._open_next()
+
+        return False
+
+    def read(self):
+        """
+        Read the next analysis frame, waiting for the next segment at the end of a segment
+        :return the frame or None at the end of the recording. The frame is only valid until the next call to read.
+        """
+        while self._segment is not None:
+            frame = self._segment.read()
+            if frame is not None:
+                self.position += 1
+                return frame
+            self._open_next()
+
+        return None
+
+    def full_frame(self):
+        """The last frame read or grabbed at the original resolution (if the decoder of the segment has it)"""
+        return self._segment.full_frame() if self._segment is not None else None
+
+    def save_frame(self, timestamp, path, params=None):
+        """
+        Save the frame at a given time to disk (at the original resolution), from a separate frame source for its
+        segment
+        :param timestamp: time in the recording (in msec)
+        :param path: where to write the image
+        :param params: extra parameters for cv2.imwrite
+        """
+        if not self.segments:
+            return False
+        starts = [frames * 1000.0 / self.source_fps for _, frames in self.segments]
+        idx = max(bisect.bisect_right(starts, timestamp) - 1, 0)
+        if self.segmented:
+            source = open_frame_source(self.segments[idx][0], self.decoder)
+        else:
+            source = FFmpegFrameSource(self.filename)
+        try:
+            return source.save_frame(timestamp - starts[idx], path, params)
+        finally:
+            source.release()
+
+    def release(self):
+        """Close the current segment"""
+        if self._segment is not None:
+            self._segment.release()
+            self._segment = None
+
+
+frame_sources = {
+    OpenCVFrameSource.name: OpenCVFrameSource,
+    FFmpegFrameSource.name: FFmpegFrameSource,
+}
+
+
+def open_frame_source(filename, decoder='opencv', outputs=None):
+    """
+    Open a video with the requested decoder backend
+    :param filename: path to the video
+    :param decoder: name of the backend: opencv or ffmpeg
+    :param outputs: extra outputs to write while decoding (only supported by the ffmpeg backend)
+    """
+    if decoder not in frame_sources:
+        logger.error("Unknown decoder %s, falling back to opencv. Possible choices: %s", decoder,
+                     ', '.join(sorted(frame_sources)))
+        decoder = OpenCVFrameSource.name
+
+    if outputs:
+        if decoder != FFmpegFrameSource.name:
+            raise ValueError("Extra outputs are only supported by the %s decoder" % FFmpegFrameSource.name)
+        return frame_sources[decoder](filename, outputs=outputs)
+
+    return frame_sources[decoder](filename)
@@ -0,0 +1,174 @@
+"""
+Timers and counters for the stages of a job
+
+An Instruments object collects how long every stage of a job took (download, encoding, decoding, the detectors,
+screenshots, uploads, ...) and counters (frames, screenshots, retries). Stages can be timed with a context manager or
+by adding measured time, which is cheaper for work that happens per frame. The detection reports its progress, from
+which the frame rate and the remaining time are estimated and handed to a listener (e.g. the status updates of the
+extractor).
+
+At the end of a job the summary is written to a sink: a JSON-lines file (a line per job) or a Prometheus textfile
+for the textfile collector of the node exporter (the metrics of the last job).
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Instruments(object):
+    """The timers and counters of a job, safe to use from multiple threads"""
+
+    def __init__(self, progress_listener=None, progress_interval=30.0):
+        """
+        :param progress_listener: function that is called with the fraction done, the frame rate (frames/s) and the
+        estimated remaining time (in seconds) of the detection
+        :param progress_interval: minimum time (in seconds) between two calls of the progress listener
+        """
+        self.start_time = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.progress_listener = progress_listener
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._progress_start = None
+        self._progress_reported = 0.0
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Time a stage (a stage can be timed more than once, the times add up)"""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.time() - start_time)
+
+    def add_time(self, stage, seconds, calls=1):
+        """Add time measured elsewhere to a stage"""
+        with self._lock:
+            timer = self.timers.setdefault(stage, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+
+    def count(self, name, value=1):
+        """Increase a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def progress(self, done, total):
+        """
+        Report the progress of the detection (in frames), the first call (with done 0) starts the clock
+        """
+        now = time.time()
+        if self._progress_start is None or done == 0:
+            self._progress_start = now
+            return
+        if self.progress_listener is None or total <= 0:
+            return
+        if now - self._progress_reported < self.progress_interval and done < total:
+            return
+
+        self._progress_reported = now
+        fps = done / max(now - self._progress_start, 1e-6)
+        self.progress_listener(min(done / float(total), 1.0), fps, max(total - done, 0) / fps)
+
+    def summary(self):
+        """The timers (seconds and number of calls per stage) and counters as a JSON serializable dict"""
+        with self._lock:
+            return {
+                'wall_time': round(time.time() - self.start_time, 3),
+                'stages': dict([(stage, {'seconds': round(seconds, 3), 'calls': calls})
+                                for stage, (seconds, calls) in self.timers.items()]),
+                'counters': dict(self.counters),
+            }
+
+
+def compact_summary(summary):
+    """The summary without the number of calls, e.g. to store in the metadata"""
+    compact = {
+        'wall_time': summary['wall_time'],
+        'stages': dict([(stage, timer['seconds']) for stage, timer in summary['stages'].items()]),
+    }
+    if summary['counters']:
+        compact['counters'] = summary['counters']
+    return compact
+
+
+class JsonLinesSink(object):
+    """Append the summary of every job as a line of JSON to a file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, job, summary):
+        """Write the summary of a job (a dict with the identification of the job)"""
+        record = dict(job)
+        record['time'] = time.time()
+        record.update(summary)
+        with open(self.path, 'a') as sinkfile:
+            sinkfile.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class PrometheusSink(object):
+    """Write the summary of the last job as a Prometheus textfile (replaced atomically)"""
+    prefix = 'video_presentation'
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, job, summary):
+        """Write the summary of a job (a dict with the identification of the job, added as labels)"""
+        labels = ','.join(['%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in sorted(job.items())])
+
+        def metric(name, value, extra=''):
+            """A line of the textfile"""
+            return '%s_%s{%s} %s\n' % (self.prefix, name, ','.join([part for part in [labels, extra] if part]),
+                                       repr(float(value)))
+
+        lines = ['# TYPE %s_job_seconds gauge\n' % self.prefix,
+                 metric('job_seconds', summary['wall_time']),
+                 '# TYPE %s_job_timestamp_seconds gauge\n' % self.prefix,
+                 metric('job_timestamp_seconds', time.time()),
+                 '# TYPE %s_stage_seconds gauge\n' % self.prefix]
+        for stage, timer in sorted(summary['stages'].items()):
+            lines.append(metric('stage_seconds', timer['seconds'], 'stage="%s"' % stage))
+        lines.append('# TYPE %s_stage_calls gauge\n' % self.prefix)
+        for stage, timer in sorted(summary['stages'].items()):
+            lines.append(metric('stage_calls', timer['calls'], 'stage="%s"' % stage))
+        lines.append('# TYPE %s_count gauge\n' % self.prefix)
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(metric('count', value, 'name="%s"' % name))
+
+        # The collector must never see a half written file
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as sinkfile:
+            sinkfile.writelines(lines)
+        os.rename(temporary, self.path)
+
+
+sinks = {
+    'jsonl': JsonLinesSink,
+    'prometheus': PrometheusSink,
+}
+
+
+def open_sink(settings):
+    """
+    Create the sink from the instrumentation settings
+    :param settings: dict with the sink (jsonl or prometheus) and its path
+    :return the sink, or None if there is none (or it is unknown)
+    """
+    name = settings.get('sink')
+    if not name:
+        return None
+    if name not in sinks or not settings.get('path'):
+        logger.error("Unknown instrumentation sink %s or no path given, possible choices: %s", name,
+                     ', '.join(sorted(sinks)))
+        return None
+
+    return sinks[name](settings['path'])
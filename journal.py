@@ -0,0 +1,109 @@
+"""
+Journal of the stages of a job
+
+Encoding the previews and detecting the slides take a long time. When a job fails afterwards (e.g. Clowder is down
+during the uploads), the message is requeued and would start from scratch. With a persistent work directory, the
+files of the job are kept in a directory keyed by the resource id and the settings, together with a journal of the
+completed stages and the uploads that succeeded. A retried job resumes from the first incomplete stage.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+JOURNAL_FILE = 'journal.json'
+
+
+class JobJournal(object):
+    """
+    The work directory and the journal of a job. Without a persistent directory, the work directory is a new
+    temporary directory and the journal is only kept in memory.
+    """
+
+    def __init__(self, resource_id, settings, directory=None, keep_days=7):
+        """
+        :param resource_id: the id of the file in Clowder
+        :param settings: dict with all settings of the job
+        :param directory: where to keep the work directories of the jobs (None for a temporary work directory)
+        :param keep_days: remove work directories of failed jobs that weren't retried after this many days
+        """
+        self._lock = threading.Lock()
+        self.persistent = bool(directory)
+        self.stages = {}
+
+        if not self.persistent:
+            self.work_dir = tempfile.mkdtemp(prefix='clowder-video-presentation')
+            return
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.cleanup(directory, keep_days)
+
+        key = json.dumps({'resource': resource_id, 'settings': settings}, sort_keys=True)
+        self.work_dir = os.path.join(directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        journal_path = os.path.join(self.work_dir, JOURNAL_FILE)
+        if os.path.exists(journal_path):
+            try:
+                with open(journal_path, 'r') as journalfile:
+                    self.stages = json.load(journalfile)
+                logger.info("Resuming job for %s from %s, completed stages: %s", resource_id, self.work_dir,
+                            ', '.join(sorted(self.stages)))
+            except (IOError, ValueError) as err:
+                logger.warning("Failed to read the journal in %s, starting from scratch: %s", self.work_dir, err)
+        elif not os.path.isdir(self.work_dir):
+            os.makedirs(self.work_dir)
+
+    @staticmethod
+    def cleanup(directory, keep_days):
+        """Remove the work directories that weren't touched in keep_days days"""
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path) and time.time() - os.path.getmtime(path) > keep_days * 86400:
+                logger.info("Removing work directory %s of an old job", path)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def done(self, stage):
+        """Check if a stage is completed"""
+        return stage in self.stages
+
+    def get(self, stage, default=None):
+        """The value recorded for a completed stage"""
+        return self.stages.get(stage, default)
+
+    def record(self, stage, value=True):
+        """Mark a stage as completed (with an optional JSON serializable value)"""
+        with self._lock:
+            self.stages[stage] = value
+            self._write()
+
+    def record_upload(self, name, uploadid):
+        """Remember the id of a successful upload"""
+        with self._lock:
+            self.stages.setdefault('uploads', {})[name] = uploadid
+            self._write()
+
+    def upload_id(self, name):
+        """The id of an earlier upload (None if it wasn't uploaded yet)"""
+        with self._lock:
+            return self.stages.get('uploads', {}).get(name)
+
+    def _write(self):
+        """Write the journal (atomically, so a crash never leaves a broken journal)"""
+        if not self.persistent:
+            return
+
+        journal_path = os.path.join(self.work_dir, JOURNAL_FILE)
+        with open(journal_path + '.tmp', 'w') as journalfile:
+            json.dump(self.stages, journalfile)
+        os.rename(journal_path + '.tmp', journal_path)
+
+    def finish(self):
+        """The job is done, remove the work directory"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -0,0 +1,192 @@
+"""
+Masks and analysis resolution of the frames
+
+Masks are given as a location (e.g. bottom-right) and a size, and are turned into rectangles in pixels of the video
+(x1..x2 and y1..y2), scaled to the analysis resolution and finally compiled into a plan that is cheap to apply to
+every frame: a crop and a list of regions to zero out.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def prepare_masks(masks, frame):
+    """
+    Convert masks to 'proper' masks: x1..x2 and y1..y2
+    :param masks: the list of areas to mask out
+    :param frame: tuple contain the resolution of the video
+    """
+    locations_hori = ['right', 'left']
+    locations_vert = ['top', 'bottom']
+
+    def parsevalue(size, max_size):
+        """handle % values"""
+        if str(size).endswith('%'):
+            return int(max_size * float(size.strip('%'))/100.0)
+
+        return int(size)
+
+    parsed_masks = []
+    for mask in masks:
+        where = mask.get('location', '').split('-')
+        if len(where) != 2 or where[0] not in locations_vert or where[1] not in locations_hori:
+            logger.error("Invalid location setting: %s. Possible choices: %s", mask.get('location'),
+                         ', '.join(["%s-%s" % (y, x) for x in locations_hori for y in locations_vert]))
+            continue
+
+        if where[0] == "bottom":
+            y2 = frame[0]
+            y1 = frame[0] - parsevalue(mask.get('size_y', 0), frame[0])
+        else:
+            y1 = 0
+            y2 = parsevalue(mask.get('size_y', 0), frame[0])
+
+        if where[1] == "right":
+            x2 = frame[1]
+            x1 = frame[1] - parsevalue(mask.get('size_x', 0), frame[1])
+        else:
+            x1 = 0
+            x2 = parsevalue(mask.get('size_x', 0), frame[1])
+
+        parsed_masks.append({
+            'x1': x1,
+            'x2': x2,
+            'y1': y1,
+            'y2': y2,
+        })
+
+    logger.debug("Masks after preparing: %s", parsed_masks)
+    return parsed_masks
+
+
+def scale_masks(masks, scale):
+    """
+    Rescale prepared masks (x1..x2 and y1..y2) to a downscaled analysis frame. The masks are grown to whole
+    pixels so the scaled mask always covers at least the original area.
+    :param masks: the list of prepared masks
+    :param scale: the ratio between the analysis resolution and the original resolution
+    """
+    if scale == 1.0:
+        return masks
+
+    scaled_masks = []
+    for mask in masks:
+        scaled_masks.append({
+            'x1': int(np.floor(mask['x1'] * scale)),
+            'x2': int(np.ceil(mask['x2'] * scale)),
+            'y1': int(np.floor(mask['y1'] * scale)),
+            'y2': int(np.ceil(mask['y2'] * scale)),
+        })
+
+    logger.debug("Masks after scaling by %.3f: %s", scale, scaled_masks)
+    return scaled_masks
+
+
+def roi_masks(roi, frame_size):
+    """
+    Express a region of interest as masks: everything outside the region is masked out, which compile_masks turns
+    into a crop.
+    :param roi: dict with the region (x1..x2 and y1..y2) in pixels of the original frames (None for the whole frame)
+    :param frame_size: tuple (height, width) of the original frames
+    :return list of prepared masks
+    """
+    if not roi:
+        return []
+
+    height, width = frame_size
+    try:
+        x1, x2 = max(int(roi['x1']), 0), min(int(roi['x2']), width)
+        y1, y2 = max(int(roi['y1']), 0), min(int(roi['y2']), height)
+    except (KeyError, TypeError, ValueError) as err:
+        logger.error("Invalid region of interest %s: %s", roi, err)
+        return []
+
+    if x2 <= x1 or y2 <= y1:
+        logger.error("Region of interest %s is empty, analysing the whole frame", roi)
+        return []
+
+    masks = [
+        {'x1': 0, 'x2': width, 'y1': 0, 'y2': y1},
+        {'x1': 0, 'x2': width, 'y1': y2, 'y2': height},
+        {'x1': 0, 'x2': x1, 'y1': 0, 'y2': height},
+        {'x1': x2, 'x2': width, 'y1': 0, 'y2': height},
+    ]
+    return [mask for mask in masks if mask['x2'] > mask['x1'] and mask['y2'] > mask['y1']]
+
+
+def masked_area(masks, frame_size):
+    """The number of pixels covered by the masks (pixels covered by several masks count once)"""
+    covered = np.zeros(frame_size, dtype=bool)
+    for mask in masks:
+        covered[max(mask['y1'], 0):max(mask['y2'], 0), max(mask['x1'], 0):max(mask['x2'], 0)] = True
+
+    return int(np.count_nonzero(covered))
+
+
+def compile_masks(masks, frame_size):
+    """
+    Turn the prepared masks into a plan that is cheap to apply to every frame. Masks covering the full width or height
+    of the frame at its border crop the frame instead (a view, so no copy is made), the other masks become regions of
+    the cropped frame to zero out.
+    :param masks: the list of prepared masks (x1..x2 and y1..y2)
+    :param frame_size: tuple (height, width) of the frames
+    :return tuple with the crop (tuple of slices) and the list of regions (tuples of slices)
+    """
+    height, width = frame_size
+    top, bottom, left, right = 0, height, 0, width
+    for mask in masks:
+        if mask['x1'] <= 0 and mask['x2'] >= width:
+            if mask['y1'] <= 0:
+                top = max(top, mask['y2'])
+            elif mask['y2'] >= height:
+                bottom = min(bottom, mask['y1'])
+        elif mask['y1'] <= 0 and mask['y2'] >= height:
+            if mask['x1'] <= 0:
+                left = max(left, mask['x2'])
+            elif mask['x2'] >= width:
+                right = min(right, mask['x1'])
+
+    if bottom <= top or right <= left:
+        # Everything is masked, don't crop the frame to nothing
+        top, bottom, left, right = 0, height, 0, width
+
+    regions = []
+    for mask in masks:
+        x1, x2 = max(mask['x1'], left) - left, min(mask['x2'], right) - left
+        y1, y2 = max(mask['y1'], top) - top, min(mask['y2'], bottom) - top
+        if x2 > x1 and y2 > y1:
+            regions.append((slice(y1, y2), slice(x1, x2)))
+
+    crop = (slice(top, bottom), slice(left, right))
+    logger.debug("Masks compiled to crop %s and regions %s", crop, regions)
+    return crop, regions
+
+
+def apply_masks(frame, crop, regions):
+    """
+    Apply compiled masks to a frame
+    :return the cropped frame (a view of the frame) with the regions zeroed
+    """
+    frame = frame[crop]
+    for region in regions:
+        frame[region] = 0
+
+    return frame
+
+
+def analysis_resolution(frame_size, analysis_width):
+    """
+    Determine the resolution at which the slide detection runs
+    :param frame_size: tuple (height, width) with the resolution of the video
+    :param analysis_width: requested width of the analysis frames (0 or None means the original resolution)
+    :return tuple (height, width) of the analysis frames and the scale factor compared to the original
+    """
+    height, width = frame_size
+    if not analysis_width or analysis_width >= width:
+        return frame_size, 1.0
+
+    scale = float(analysis_width) / width
+    return (max(int(round(height * scale)), 1), int(analysis_width)), scale
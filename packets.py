@@ -0,0 +1,81 @@
+"""
+Slide transition signal from the compressed video
+
+Screen capture encoders spend very few bits on a frame that doesn't change and a lot on a frame that shows a new
+slide: the size of the packets of the video stream is a cheap measure of how much every frame changed. The packets
+are only demuxed by ffprobe, no frame is decoded, so this is orders of magnitude faster than the pixel based
+algorithms.
+
+Keyframes are large whether the slide changed or not. A keyframe at the regular keyframe interval of the encoder
+only counts with the difference of its size and the size of the previous keyframe, a keyframe that the encoder
+inserted earlier (a scene cut) counts with its full size.
+"""
+
+import logging
+import subprocess
+
+import numpy as np
+
+from signalstore import SIGNAL_DTYPE
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def read_packets(filename, ffprobe='ffprobe'):
+    """
+    Read the timestamp, size and keyframe flag of every packet of the first video stream using ffprobe
+    :param filename: path to the video
+    :param ffprobe: the ffprobe executable to use
+    :return tuple with arrays of the timestamps (in seconds), the sizes (in bytes) and the keyframe flags, in
+    presentation order
+    """
+    command = [ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,dts_time,size,flags',
+               '-of', 'csv=p=0', filename]
+    output = subprocess.check_output(command).decode('utf-8')
+
+    packets = []
+    for line in output.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 4:
+            continue
+        pts_time, dts_time, size, flags = fields[:4]
+        try:
+            timestamp = float(pts_time if pts_time not in ('', 'N/A') else dts_time)
+            packets.append((timestamp, int(size), 'K' in flags))
+        except ValueError:
+            logger.debug("Skipping packet without timestamp or size: %s", line)
+
+    # Packets are stored in decoding order, with B-frames that differs from the order in which they are shown
+    packets.sort(key=lambda packet: packet[0])
+    timestamps = np.array([packet[0] for packet in packets], dtype=float)
+    sizes = np.array([packet[1] for packet in packets], dtype=int)
+    keyframes = np.array([packet[2] for packet in packets], dtype=bool)
+
+    return timestamps, sizes, keyframes
+
+
+def packet_signal(timestamps, sizes, keyframes):
+    """
+    Turn the packets into a per-frame signal (see the module documentation)
+    :return tuple with the signal (like the stored signals of signalstore) and the typical size of a keyframe
+    """
+    signal = np.zeros(len(sizes), dtype=SIGNAL_DTYPE)
+    signal['frame'] = np.arange(len(sizes))
+    signal['timestamp'] = (timestamps - timestamps[0]) * 1000.0 if len(timestamps) else timestamps
+    signal['signal'] = sizes
+
+    key_indices = np.flatnonzero(keyframes)
+    if len(key_indices) < 2:
+        return signal, float(sizes.max()) if len(sizes) else 0.0
+
+    # The regular keyframe interval is the most common one
+    intervals = np.diff(key_indices)
+    regular_interval = np.bincount(intervals).argmax()
+    for previous, current in zip(key_indices[:-1].tolist(), key_indices[1:].tolist()):
+        if current - previous >= regular_interval:
+            signal['signal'][current] = abs(sizes[current] - sizes[previous])
+
+    key_size = float(np.median(sizes[key_indices]))
+    logger.debug("%d keyframes, regular interval of %d frames, typical size %d bytes", len(key_indices),
+                 regular_interval, key_size)
+    return signal, key_size
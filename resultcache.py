@@ -0,0 +1,159 @@
+"""
+Local cache of the results of the extractor
+
+Clowder sends the same video again when its metadata is edited, a dataset is copied, or it is resubmitted manually.
+The detected slides, their screenshots and the previews are cached on disk, keyed by a fast content hash of the
+video and the effective settings. When the cache grows beyond its maximum size, the least recently used entries are
+removed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from videoinput import open_video_file
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+RESULTS_FILE = 'results.json'
+INFO_FILE = 'info.json'
+
+
+def parse_size(size):
+    """Convert sizes like 500M or 10G to bytes"""
+    size = str(size).strip().upper()
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(float(size))
+
+
+def fast_checksum(filename, blocks=16, blocksize=1 << 20):
+    """
+    A checksum of the size and a number of blocks spread over the file. Reading a few MB is a lot faster than
+    reading a complete video of several GB, while it is still very unlikely that two different videos collide. The
+    video can also be a URL (see videoinput).
+    """
+    with open_video_file(filename) as infile:
+        infile.seek(0, os.SEEK_END)
+        size = infile.tell()
+        infile.seek(0)
+        checksum = hashlib.sha1(str(size).encode('utf-8'))
+        if size <= blocks * blocksize:
+            checksum.update(infile.read())
+        else:
+            for idx in range(blocks):
+                infile.seek(idx * (size - blocksize) // (blocks - 1))
+                checksum.update(infile.read(blocksize))
+
+    return checksum.hexdigest()
+
+
+class ResultCache(object):
+    """The cache: every entry is a directory with the results (as JSON) and the files"""
+
+    def __init__(self, directory, max_size='10G'):
+        self.directory = directory
+        self.max_size = parse_size(max_size)
+
+    def key(self, filename, settings):
+        """
+        The key of the results of a video
+        :param filename: path to the video
+        :param settings: dict with all settings that change the results
+        """
+        key = json.dumps({'file': fast_checksum(filename), 'settings': settings}, sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key, output_dir):
+        """
+        Look up the results and copy the cached files to the output directory
+        :return list with tuples of frame number, timestamp and path to screenshot of slide (None if not cached)
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, RESULTS_FILE), 'r') as resultsfile:
+                results = json.load(resultsfile)
+
+            for name in os.listdir(entry):
+                if name not in (RESULTS_FILE, INFO_FILE):
+                    shutil.copy(os.path.join(entry, name), output_dir)
+            # Mark the entry as recently used
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError) as err:
+            if os.path.isdir(entry):
+                logger.warning("Failed to read cache entry %s: %s", entry, err)
+            return None
+
+        logger.info("Found %d cached results in %s", len(results), entry)
+        return [(frame_idx, time_idx, os.path.join(output_dir, slide) if slide else None)
+                for frame_idx, time_idx, slide in results]
+
+    def info(self, key):
+        """The extra information stored with the results (empty if there is none)"""
+        try:
+            with open(os.path.join(self.directory, key, INFO_FILE), 'r') as infofile:
+                return json.load(infofile)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def put(self, key, results, files, info=None):
+        """
+        Store the results with the screenshots and other files
+        :param key: the key of the results
+        :param results: list with tuples of frame number, timestamp and path to screenshot of slide
+        :param files: list with the paths of other files to keep (e.g. the previews)
+        :param info: JSON serializable dict with extra information that isn't part of the key (e.g. a detected region)
+        """
+        entry = os.path.join(self.directory, key)
+        if os.path.isdir(entry):
+            return
+
+        tmpdir = None
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Build the entry next to its final location (hidden) and move it in place when complete
+            tmpdir = tempfile.mkdtemp(prefix='.' + key, dir=self.directory)
+            for path in [slide for _, _, slide in results if slide] + list(files):
+                shutil.copy(path, tmpdir)
+            with open(os.path.join(tmpdir, RESULTS_FILE), 'w') as resultsfile:
+                json.dump([(frame_idx, time_idx, os.path.basename(slide) if slide else None)
+                           for frame_idx, time_idx, slide in results], resultsfile)
+            if info:
+                with open(os.path.join(tmpdir, INFO_FILE), 'w') as infofile:
+                    json.dump(info, infofile)
+            os.rename(tmpdir, entry)
+        except (IOError, OSError) as err:
+            logger.error("Failed to store the results in the cache: %s", err)
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+
+        logger.debug("Stored %d results in %s", len(results), entry)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in its maximum size"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum([os.path.getsize(os.path.join(entry, filename)) for filename in os.listdir(entry)])
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.info("Removing %s (%.1f MB) from the cache", entry, size / float(1 << 20))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+        logger.debug("Cache size: %.1f MB", total / float(1 << 20))
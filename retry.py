@@ -0,0 +1,122 @@
+"""
+Retry policy for the calls to Clowder
+
+Errors are classified as retryable (connection problems, timeouts, 408/429 and 5xx responses) or fatal (other 4xx
+responses, missing files, bugs). Retryable errors are retried with a jittered exponential backoff until the maximum
+number of attempts or the deadline is reached, fatal errors are raised immediately.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+
+try:
+    from urllib2 import HTTPError as UrllibHTTPError
+except ImportError:  # python 3
+    from urllib.error import HTTPError as UrllibHTTPError
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+default_settings_retry = {
+    'max_attempts': 20,
+    'initial_delay': 1.0,  # in seconds
+    'max_delay': 60.0,
+    'multiplier': 2.0,
+    'jitter': 0.5,  # fraction of the delay that is randomized
+    'deadline': 300.0,  # total time for all attempts of a single call
+}
+
+RETRYABLE_STATUS_CODES = (408, 429)
+
+
+def is_retryable(err):
+    """
+    Check if a failed call is worth retrying
+    :param err: the exception raised by the call
+    """
+    status = None
+    if isinstance(err, requests.HTTPError):
+        status = err.response.status_code if err.response is not None else None
+    elif isinstance(err, UrllibHTTPError):
+        status = err.code
+
+    if status is not None:
+        return status >= 500 or status in RETRYABLE_STATUS_CODES
+
+    # Connection errors, timeouts, broken responses, ...
+    return isinstance(err, requests.RequestException)
+
+
+class RetryPolicy(object):
+    """
+    Jittered exponential backoff with a deadline. The policy can be shared between threads, it keeps counters of
+    all calls made through it.
+    """
+
+    def __init__(self, **kwargs):
+        """:param kwargs: the settings of the policy, see default_settings_retry"""
+        options = dict(default_settings_retry)
+        options.update(kwargs)
+
+        self.max_attempts = max(int(options.get('max_attempts')), 1)
+        self.initial_delay = float(options.get('initial_delay'))
+        self.max_delay = float(options.get('max_delay'))
+        self.multiplier = float(options.get('multiplier'))
+        self.jitter = min(max(float(options.get('jitter')), 0.0), 1.0)
+        self.deadline = float(options.get('deadline'))
+
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'attempts': 0,
+            'retries': 0,
+            'failures': 0,
+            'waited': 0.0,
+        }
+
+    def _count(self, name, value=1):
+        """Update a counter"""
+        with self._lock:
+            self.counters[name] += value
+
+    def delay(self, attempt):
+        """The time to wait after the given (failed) attempt, starting from 0"""
+        delay = min(self.initial_delay * self.multiplier ** attempt, self.max_delay)
+        return delay * (1.0 - self.jitter * random.random())
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) and retry it according to the policy
+        :return the result of func
+        """
+        self._count('calls')
+        start = time.time()
+        attempt = 0
+        while True:
+            self._count('attempts')
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:  # pylint: disable=broad-except
+                attempt += 1
+                delay = self.delay(attempt - 1)
+                remaining = self.deadline - (time.time() - start)
+                if not is_retryable(err):
+                    logger.error("%s failed with a fatal error, not retrying: %r", getattr(func, '__name__', func), err)
+                elif attempt >= self.max_attempts:
+                    logger.error("%s failed %d times, giving up: %r", getattr(func, '__name__', func), attempt, err)
+                elif delay > remaining:
+                    logger.error("%s failed, giving up after %.1f s (deadline %.0f s): %r",
+                                 getattr(func, '__name__', func), time.time() - start, self.deadline, err)
+                else:
+                    logger.warning("%s failed (attempt %d of %d), retrying in %.2f s: %r",
+                                   getattr(func, '__name__', func), attempt, self.max_attempts, delay, err)
+                    self._count('retries')
+                    self._count('waited', delay)
+                    time.sleep(delay)
+                    continue
+
+                self._count('failures')
+                raise
@@ -0,0 +1,116 @@
+"""
+Persisted per-frame change signals
+
+The expensive part of the slide detection is decoding the video and computing how much every frame changed (the
+'signal'). The trigger logic on top of it is cheap. The signal of a run is stored in a memory-mapped .npy file (with
+a .json file describing it), keyed by the checksum of the video and the settings the signal depends on. A later run
+with only different trigger thresholds can then replay the trigger logic on the stored signal without decoding.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from resultcache import fast_checksum
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+SIGNAL_DTYPE = np.dtype([('frame', np.int32), ('timestamp', np.float64), ('signal', np.float64)])
+
+
+class SignalStore(object):
+    """
+    The stored signal of one video for one algorithm and set of settings. The signal is a structured array with the
+    frame number, the timestamp (in msec) and the change of every analysed frame.
+    """
+
+    def __init__(self, directory, filename, algorithm, settings):
+        """
+        :param directory: where to keep the signals
+        :param filename: path to the video
+        :param algorithm: name of the algorithm that produces the signal
+        :param settings: dict with all settings the signal depends on
+        """
+        self.directory = directory
+        self.filename = filename
+
+        key = json.dumps({'file': fast_checksum(filename), 'algorithm': algorithm, 'settings': settings},
+                         sort_keys=True)
+        self.key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.data_path = os.path.join(directory, self.key + '.npy')
+        self.meta_path = os.path.join(directory, self.key + '.json')
+
+        self.meta = None
+        self._signal = None
+        self._count = 0
+
+    def exists(self):
+        """Check if the signal was stored before (the description is written last)"""
+        return os.path.exists(self.meta_path) and os.path.exists(self.data_path)
+
+    def load(self):
+        """
+        Open the stored signal
+        :return the signal (memory-mapped, read only) and the dict describing it
+        """
+        with open(self.meta_path, 'r') as metafile:
+            self.meta = json.load(metafile)
+        signal = np.load(self.data_path, mmap_mode='r')[:self.meta['count']]
+        logger.debug("Loaded signal of %d frames from %s", len(signal), self.data_path)
+
+        return signal, self.meta
+
+    def create(self, capacity, meta):
+        """
+        Start recording a new signal
+        :param capacity: the maximum number of frames
+        :param meta: dict describing the signal (e.g. the frame rate)
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # A previous recording may have been interrupted
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+
+        self.meta = dict(meta)
+        self._signal = np.lib.format.open_memmap(self.data_path, mode='w+', dtype=SIGNAL_DTYPE, shape=(capacity,))
+        self._count = 0
+
+    def append(self, frame, timestamp, value):
+        """Add the signal of a frame, the recording is dropped if the capacity is exceeded"""
+        if self._signal is None:
+            return
+
+        if self._count >= len(self._signal):
+            logger.warning("More frames than expected in %s, not storing the signal", self.filename)
+            self.discard()
+            return
+
+        self._signal[self._count] = (frame, timestamp, value)
+        self._count += 1
+
+    def close(self, **meta):
+        """
+        Finish the recording
+        :param meta: extra values for the description (e.g. the final timestamp)
+        """
+        if self._signal is None:
+            return
+
+        self._signal.flush()
+        self._signal = None
+        self.meta.update(meta)
+        self.meta['count'] = self._count
+        with open(self.meta_path, 'w') as metafile:
+            json.dump(self.meta, metafile)
+        logger.debug("Stored signal of %d frames in %s", self._count, self.data_path)
+
+    def discard(self):
+        """Stop the recording without keeping anything"""
+        self._signal = None
+        for path in [self.data_path, self.meta_path]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,1085 @@
+"""
+Slide transition detection in the video of a presentation
+
+Author Ward Poelmans <wpoely86@gmail.com>
+Author Alan O'Cais <a.ocais@fz-juelich.de>
+"""
+
+import datetime
+import logging
+import multiprocessing
+import os
+import subprocess
+import time
+
+import cv2  # OpenCV
+import numpy as np
+
+from background import background_models, create_background_model, sample_learning_rate
+from engine import DetectionEngine, Detector
+from framesource import open_frame_source
+from instrumentation import Instruments
+from masks import analysis_resolution, apply_masks
+from packets import packet_signal, read_packets
+from signalstore import SignalStore
+from videoinput import redact_url
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+default_settings_advanced = {
+    'trigger_ratio' : 5,
+    'minimum_total_change' : 0.06,
+    'minimum_slide_length' : 20,
+    'motion_capture_averaging_time' : 10,
+    'msec_to_delay_screenshot' : 1000,
+    'analysis_width' : 0,
+    'analysis_grayscale' : False,
+    'background_model' : 'knn',
+    'decoder' : 'opencv',
+    'sampling_fps' : 0,
+    'prefetch' : 0,
+    'workers' : 1,
+    'signal_store' : '',
+    'auto_roi' : False,
+    'roi' : None,
+    'follow' : 0,
+}
+
+default_settings_basic = {
+    'threshold_cutoff' : 115,
+    'trigger' : 0.01,
+    'analysis_width' : 0,
+    'decoder' : 'opencv',
+    'prefetch' : 0,
+    'signal_store' : '',
+    'auto_roi' : False,
+    'roi' : None,
+    'follow' : 0,
+}
+
+default_settings_packets = {
+    'trigger_ratio' : 5,
+    'minimum_total_change' : 0.2,
+    'minimum_slide_length' : 20,
+    'motion_capture_averaging_time' : 10,
+    'msec_to_delay_screenshot' : 1000,
+    'decoder' : 'opencv',
+}
+
+# The settings that change the per-frame signals, all other settings can be changed by replaying a stored signal
+signal_settings_advanced = ['masks', 'motion_capture_averaging_time', 'analysis_width', 'analysis_grayscale',
+                            'background_model', 'decoder', 'sampling_fps', 'auto_roi', 'roi']
+signal_settings_basic = ['masks', 'threshold_cutoff', 'analysis_width', 'decoder', 'auto_roi', 'roi']
+
+# When sampling, the frames before a sample are analysed at the full frame rate if at least this fraction of the
+# changed pixels a transition needs changed more than SAMPLING_THRESHOLD (0..255) since the previous sample, or
+# differ from the background model
+SAMPLING_MARGIN = 0.5
+SAMPLING_THRESHOLD = 30
+
+# The settings that need the whole video in advance, with the value that turns them off to follow a recording
+follow_unsupported = {
+    'sampling_fps' : 0,
+    'prefetch' : 0,
+    'workers' : 1,
+    'signal_store' : '',
+    'auto_roi' : False,
+    'preview_outputs' : None,
+}
+
+
+def follow_options(options):
+    """
+    Turn off the settings that can't be used to follow a recording (if the follow setting is used)
+    :return the options that can be used
+    """
+    if not options.get('follow'):
+        return options
+
+    options = dict(options)
+    for key, value in follow_unsupported.items():
+        if options.get(key, value) != value:
+            logger.warning("Setting %s can't be used to follow a recording, ignoring it", key)
+            options[key] = value
+    return options
+
+
+def detect_roi(filename, decoder='opencv', samples=30, analysis_width=320, pixel_threshold=30, min_fraction=0.02,  # pylint: disable=too-many-arguments,too-many-locals
+               margin=0.02):
+    """
+    Find the region of the video in which the slides are shown. Frames are sampled over the whole video: the slides
+    are the pixels that differ between the samples, but not between two frames half a second apart at the same
+    sample (those are moving overlays, e.g. the presenter). Static borders and logos never change. The region is
+    the bounding box of the rows and columns with enough slide pixels, grown by a small margin.
+
+    :param filename: path to the video
+    :param decoder: the frame source used to decode the video: opencv or ffmpeg
+    :param samples: the number of positions in the video to sample
+    :param analysis_width: the width to downscale the samples to
+    :param pixel_threshold: minimal change in intensity for a pixel to count as changed
+    :param min_fraction: the fraction of slide pixels a row or column needs to be part of the region
+    :param margin: grow the region by this fraction of the frame size on every side
+    :return dict with the region (x1..x2 and y1..y2) in pixels of the original frames (None if it wasn't found)
+    """
+    start_time = time.time()
+    source = open_frame_source(filename, decoder)
+    if not source.isOpened():
+        logger.error("Failed to open file %s", redact_url(filename))
+        return None
+
+    height, width = source.source_size
+    sample_size, scale = analysis_resolution(source.source_size, min(analysis_width, width))
+    source.set_output(sample_size, grayscale=True)
+    gap = max(int(round(source.fps / 2.0)), 1)
+    step = max((source.num_frames - gap) // samples, 1)
+
+    lowest = None
+    highest = None
+    moving = np.zeros(sample_size, dtype=int)
+    sampled = 0
+    for position in range(step // 2, max(source.num_frames - gap, 1), step)[:samples]:
+        source.seek(position)
+        frame = source.read()
+        if frame is None:
+            break
+        if lowest is None:
+            lowest = np.copy(frame)
+            highest = np.copy(frame)
+        else:
+            np.minimum(lowest, frame, out=lowest)
+            np.maximum(highest, frame, out=highest)
+        first = np.copy(frame)
+
+        for _ in range(gap - 1):
+            source.grab()
+        frame = source.read()
+        if frame is not None:
+            moving += cv2.absdiff(frame, first) > pixel_threshold
+        sampled += 1
+    source.release()
+
+    if sampled < 2:
+        logger.warning("Not enough frames in %s to detect the slide region", redact_url(filename))
+        return None
+
+    # A slide transition can fall between the two frames of a sample now and then, overlays move in many samples.
+    # The overlay is grown a bit as it also covers pixels in between the positions it was seen moving at.
+    overlay = (moving >= max(2, sampled // 10)).astype(np.uint8)
+    grow = max(int(round(0.05 * sample_size[1])), 1)
+    overlay = cv2.dilate(overlay, np.ones((grow, grow), np.uint8))
+    slide_pixels = (cv2.absdiff(highest, lowest) > pixel_threshold) & (overlay == 0)
+    rows = np.flatnonzero(slide_pixels.mean(axis=1) >= min_fraction)
+    cols = np.flatnonzero(slide_pixels.mean(axis=0) >= min_fraction)
+    if not rows.size or not cols.size:
+        logger.warning("No slide region found in %s", redact_url(filename))
+        return None
+
+    margin_x = int(round(margin * width))
+    margin_y = int(round(margin * height))
+    roi = {
+        'x1': max(int(np.floor(cols[0] / scale)) - margin_x, 0),
+        'x2': min(int(np.ceil((cols[-1] + 1) / scale)) + margin_x, width),
+        'y1': max(int(np.floor(rows[0] / scale)) - margin_y, 0),
+        'y2': min(int(np.ceil((rows[-1] + 1) / scale)) + margin_y, height),
+    }
+    logger.info("Detected slide region %s in %s (%.0f%% of the frame) in %.2f s", roi, redact_url(filename),
+                100.0 * (roi['x2'] - roi['x1']) * (roi['y2'] - roi['y1']) / (width * height),
+                time.time() - start_time)
+    return roi
+
+
+def resolve_roi(filename, options):
+    """
+    Detect the slide region if auto_roi is set and no region was given
+    :return the options with the region
+    """
+    if not options.get('auto_roi') or options.get('roi'):
+        return options
+
+    options = dict(options)
+    with (options.get('instruments') or Instruments()).timer('roi'):
+        options['roi'] = detect_roi(filename, options.get('decoder'))
+    return options
+
+
+def open_signal_store(filename, options, algorithm, signal_settings):
+    """
+    Open the store for the per-frame signals of a video (if enabled with the signal_store setting)
+    :param filename: path to the video
+    :param options: the settings of the algorithm
+    :param algorithm: name of the algorithm
+    :param signal_settings: the names of the settings the signal depends on
+    :return SignalStore or None
+    """
+    if not options.get('signal_store'):
+        return None
+
+    try:
+        return SignalStore(options.get('signal_store'), filename, algorithm,
+                           dict([(key, options.get(key)) for key in signal_settings]))
+    except (IOError, OSError) as err:
+        logger.error("Failed to open the signal store for %s: %s", redact_url(filename), err)
+        return None
+
+
+def slide_find_advanced(filename, output_dir, **kwargs):
+    """
+    Gather a list of transitions from an input video.
+    The algorithm leverages motion tracking techniques and works well with unprocessed screen capture (heavy compression
+    can introduce false positives). A portion of the image can be masked out for cases where you may have live video
+    superimposed on the frame.
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param masks: list of area to mask out before doing slide transition detection
+    :param trigger_ratio: the relative ratio of changed pixels that causes a trigger
+    :param minimum_total_change: minimum number of pixels that must change to register a trigger (on a scale between 0
+    to 1, with a default of 6%)
+    :param minimum_slide_length: minimum length of a slide (in seconds)
+    :param motion_capture_averaging_time: the time over which to build up our average of the background (in seconds)
+    :param msec_to_delay_screenshot: The amount of delay before taking a screenshot (good for animated slide
+    transitions) in milliseconds
+    :param analysis_width: downscale the frames to this width before the detection (0 to use the full resolution).
+    Screenshots are always taken at the full resolution.
+    :param measure_baseline: also time the detection on a few frames at the full resolution and log the speedup of
+    analysis_width (this decodes the start of the video again, for benchmarks)
+    :param analysis_grayscale: convert the (downscaled) frames to grayscale before the detection
+    :param background_model: the model of the background the frames are compared with: knn (the KNN background
+    subtractor of OpenCV) or running_average (a much cheaper running average of the grayscale frames, see background)
+    :param decoder: the frame source used to decode the video: opencv or ffmpeg. The ffmpeg decoder only produces
+    the analysis frames, so the screenshots are then taken at the end with a seek per slide.
+    :param sampling_fps: only analyse the video at this frame rate (0 to analyse every frame). The sampled frames
+    only point out where a transition can be, the frames since the previous sample are then analysed at the full frame
+    rate so the transitions are (nearly) the ones found without sampling. The signal isn't stored when sampling.
+    :param prefetch: decode this many frames ahead in a separate thread, while the detection works on the previous
+    frames (0 to decode and detect in turns)
+    :param workers: split the video in segments and process them in parallel with this many processes
+    :param preview_outputs: extra ffmpeg outputs (e.g. previews) to write from the same decoded frames (requires
+    the ffmpeg decoder and a single worker)
+    :param slide_callback: function that is called with the path of every screenshot as soon as it is written
+    :param instruments: Instruments to add the time of the stages (decoding, detection, screenshots, ...) and the
+    progress to
+    :param signal_store: directory to store the per-frame signal in. When the video is processed again with only
+    different trigger_ratio, minimum_total_change, minimum_slide_length or msec_to_delay_screenshot, the stored
+    signal is replayed instead of decoding the video. Not used with multiple workers.
+    :param auto_roi: detect the region in which the slides are shown (see detect_roi) and only analyse that region
+    :param roi: the region to analyse (x1..x2 and y1..y2 in pixels of the original frames), e.g. detected for an
+    earlier video of the same series. Takes precedence over auto_roi.
+    :param follow: follow a recording that is still being written (filename is a growing file or a glob pattern of
+    segment files, see FollowFrameSource): the recording has ended when no new data arrived for this many seconds
+    (0 for a finished video). Sampling, prefetching, workers, the signal store and auto_roi aren't used then.
+    :param transition_callback: function that is called with every transition (a tuple of frame number, timestamp
+    and path to the screenshot, which is written later) as soon as the detection found it
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    options = dict(default_settings_advanced)
+    options.update(kwargs)
+    options = follow_options(options)
+
+    if options.get('workers') > 1:
+        if options.get('preview_outputs'):
+            logger.error("Extra outputs can't be written when splitting the video in segments")
+            return []
+        return find_slides_parallel(filename, output_dir, resolve_roi(filename, options))
+
+    signal_store = open_signal_store(filename, options, 'advanced', signal_settings_advanced)
+    # The extra outputs need a full decode anyway
+    if signal_store is not None and signal_store.exists() and not options.get('preview_outputs'):
+        with (options.get('instruments') or Instruments()).timer('replay'):
+            slides = replay_slides_advanced(filename, output_dir, options, signal_store)
+        if slides:
+            return slides
+        logger.warning("Replaying the stored signal failed, processing the video again")
+
+    return find_slides_segment(filename, output_dir, resolve_roi(filename, options), signal_store=signal_store)
+
+
+class AdvancedDetector(Detector):  # pylint: disable=too-many-instance-attributes
+    """
+    The advanced algorithm (see slide_find_advanced) as a detector of the engine. When not starting at the beginning
+    of the video, the algorithm starts motion_capture_averaging_time earlier (first_frame) to prime the background
+    model and the average number of changed pixels, but only transitions after start_time are reported.
+    """
+    name = 'advanced'
+
+    def __init__(self, options, start_time=0.0, slide_name='slide%05d.jpg', signal_store=None):
+        """
+        :param options: the settings of the algorithm (see slide_find_advanced)
+        :param start_time: start of the segment (in seconds)
+        :param slide_name: file name template for the screenshots (None to not take screenshots)
+        :param signal_store: SignalStore to record the signal of every analysed frame in (only for the whole video)
+        """
+        self.options = options
+        # The running average only looks at the grayscale frames
+        self.grayscale = bool(options.get('analysis_grayscale')) or options.get('background_model') == 'running_average'
+        self.start_time = start_time
+        self.slide_name = slide_name
+        self.signal_store = signal_store
+        self.engine = None
+        self.slides = []
+
+    def setup(self, engine):  # pylint: disable=too-many-locals
+        options = self.options
+        trigger_ratio = options.get('trigger_ratio')
+        minimum_total_change = options.get('minimum_total_change')
+        minimum_slide_length = options.get('minimum_slide_length')
+        motion_capture_averaging_time = options.get('motion_capture_averaging_time')
+
+        # Verify the algorithm parameters make sense:
+        #
+        errors = []
+        height, width = engine.frame_size
+        # Verify the mask is set for a sensible region
+        for mask in engine.source_masks:
+            if (mask['x2'] > width) or (mask['y2'] > height):
+                errors += ["Mask is outside bounds of image!"]
+        # Give some reasonable bounds for the trigger ratio
+        if trigger_ratio < 2 or trigger_ratio > 10:
+            errors += ["Expected a trigger ratio in range from 2 to 10!"]
+        # Give some reasonable bounds for the minimum total change
+        if minimum_total_change < 0 or minimum_total_change > 1:
+            errors += ["Expected a minimum_total_change on a scale from 0.0 to 1.0!"]
+        # Check minimum slide length is less than the length of the video (a recording can still grow)
+        if not engine.live and minimum_slide_length > engine.source_fps * engine.source_num_frames:
+            errors += ["The video length is less than the minimum slide length!"]
+        # Check the motion_capture_averaging_time makes sense
+        if motion_capture_averaging_time > minimum_slide_length:
+            errors += ["motion_capture_averaging_time cannot be longer than minimum_slide_length!"]
+        if options.get('background_model') not in background_models:
+            errors += ["Expected a background_model out of %s!" % ', '.join(background_models)]
+        if errors:
+            return errors
+
+        self.engine = engine
+        # The algorithm counts in frames of the video, also when sampling: a sample stands for the frames since the
+        # previous one
+        fps = engine.source_fps
+        self.frame_step = engine.frame_step
+
+        # Set lower bound on our pixel change average (in pixels of the analysis frames)
+        self.min_pixel_change_av = (minimum_total_change / trigger_ratio) * engine.pixels
+
+        # Set the number of frames for the minimum length of a slide
+        self.minimum_slide_length_in_frames = int(round(minimum_slide_length * fps))
+
+        #  Allocate space for our average of the changes of the frames in the last averaging_time seconds
+        self.averaging_frames = int(motion_capture_averaging_time * fps)
+        self.av_array = np.zeros(self.averaging_frames, dtype=int)
+        self.average = 0.0
+
+        # Set up the motion capture algorithm to learn over our set averaging time and output B/W images. The output
+        # of the model is written into the same buffer every frame.
+        self.fgbg = create_background_model(options.get('background_model'), self.averaging_frames)
+        self.fgmask = np.zeros(engine.cropped_size, np.uint8)
+
+        # Set the number of frames we can safely ignore after we have a trigger,which is the minimum slide length
+        # adjusted for our averaging_frames frames so that we have the correct average and bg memory
+        self.ignore_frames = (minimum_slide_length * fps) - self.averaging_frames
+
+        # When sampling, the model learns from a sample as much as from the frames it stands for. The frames before a
+        # sample that changed enough, or while the model is learning a change, are read with a second frame source and
+        # analysed one by one. The samples are compared in grayscale.
+        self.sample_learning_rate = sample_learning_rate(options.get('background_model'), self.averaging_frames,
+                                                         self.frame_step)
+        self.full_rate_source = None
+        self.sample_gray = np.zeros(engine.cropped_size, np.uint8)
+        self.previous_sample = np.zeros(engine.cropped_size, np.uint8)
+        self.sample_diff = np.zeros(engine.cropped_size, np.uint8)
+        self.sample_thres = np.zeros(engine.cropped_size, np.uint8)
+        self.sample_threshold = SAMPLING_MARGIN * options.get('trigger_ratio') * self.min_pixel_change_av
+        self.model_changed = True
+
+        self.first_frame = 0
+        self.previous_trigger_frame = 0
+        start_index = int(round(self.start_time * engine.fps))
+        if start_index > 0:
+            # Start averaging_frames early to warm up. We pretend the last trigger happened just long enough ago so
+            # that the warm up frames are analysed but can't trigger.
+            self.first_frame = max(start_index - self.averaging_frames // self.frame_step, 0)
+            self.previous_trigger_frame = start_index * self.frame_step - self.minimum_slide_length_in_frames - 1
+
+        if self.signal_store is not None and self.frame_step > 1:
+            logger.info("The signal of a sampled video isn't stored")
+            self.signal_store = None
+        if self.signal_store is not None:
+            # Leave some room as the number of frames in the container is not always exact
+            self.signal_store.create(engine.num_frames + int(fps) + 1, {
+                'fps': fps,
+                'frame_step': engine.frame_step,
+                'pixels': engine.pixels,
+                'averaging_frames': self.averaging_frames,
+                'minimum_slide_length': options.get('minimum_slide_length'),
+            })
+
+        return []
+
+    def copy(self):
+        return AdvancedDetector(self.options, slide_name=None)
+
+    def skip(self, index):
+        # The frames of a sample are all in the ignore window if the sample is
+        return self.skip_frame(index * self.frame_step)
+
+    def skip_frame(self, frame_index):
+        """Check if a frame of the video is in the ignore window after a transition"""
+        # In the region where a slide will never be extracted (due to min_slide_length), don't do any of the hard work
+        return frame_index <= (self.previous_trigger_frame + self.ignore_frames) and frame_index != 0
+
+    def consume(self, frame, index, timestamp):
+        if self.frame_step > 1:
+            self.consume_sample(frame, index, timestamp)
+        else:
+            self.analyse(frame, index, timestamp)
+
+    def consume_sample(self, frame, index, timestamp):
+        """Analyse a sample, it stands for the frames of the video since the previous sample"""
+        last = index * self.frame_step
+        if frame.ndim == 3:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.sample_gray)
+        else:
+            np.copyto(self.sample_gray, frame)
+        changed = changed_pixels(self.sample_gray, self.previous_sample, SAMPLING_THRESHOLD, self.sample_diff,
+                                 self.sample_thres)
+        # The frame is reused by the decoder, so keep a copy
+        np.copyto(self.previous_sample, self.sample_gray)
+
+        if index == self.first_frame:
+            self.analyse(frame, last, timestamp)
+            return
+
+        # The model learns a change differently from the samples than from every frame, so keep analysing every frame
+        # until it has
+        if self.model_changed or ((last - self.previous_trigger_frame) > self.minimum_slide_length_in_frames
+                                  and changed > self.sample_threshold):
+            with self.engine.instruments.timer('full_rate'):
+                self.analyse_full_rate(last - self.frame_step + 1, last)
+            return
+
+        # The frames since the previous sample are like the sample
+        self.fgbg.apply(frame, self.fgmask, self.sample_learning_rate)
+        whites = int(cv2.countNonZero(self.fgmask))
+        self.model_changed = whites > self.sample_threshold
+        for frame_index in range(last - self.frame_step + 1, last + 1):
+            if not self.skip_frame(frame_index):
+                self.update_average(frame_index, whites)
+
+    def analyse(self, frame, index, timestamp):
+        """Analyse a frame of the video"""
+        self.fgbg.apply(frame, self.fgmask)
+        # If you want to see what the algorithm is looking at, uncomment the below
+        # cv2.imshow('frame', self.fgmask)
+        # cv2.waitKey(1)
+
+        # Count the changed pixels (based on the learned background)
+        whites = int(cv2.countNonZero(self.fgmask))
+        self.model_changed = whites > self.sample_threshold
+        if self.signal_store is not None:
+            self.signal_store.append(index, timestamp, whites)
+
+        # Check if we have a trigger
+        if (index - self.previous_trigger_frame) > self.minimum_slide_length_in_frames or index == 0:
+            proxy_average = max(self.average, self.min_pixel_change_av)
+            if (whites > self.options.get('trigger_ratio') * proxy_average) or index == 0:
+                # Grab the slide
+                self.add_slide(index, timestamp)
+
+                self.previous_trigger_frame = index
+                # Restart the averaging process
+                self.average = 0.0
+                self.av_array[:] = 0
+
+        self.update_average(index, whites)
+
+    def update_average(self, index, whites):
+        """Add the changed pixels of a frame to the average"""
+        # Update our average and the associated array. Since we know that the average is restarted after every
+        # trigger things are sequential and it is safe to use modulo here.
+        if self.previous_trigger_frame != index:
+            # First remove the value of the previous entry from the average
+            self.average -= self.av_array[index % self.averaging_frames] / float(self.averaging_frames)
+            # Add the new value to the array
+            self.av_array[index % self.averaging_frames] = whites
+            # Update the average
+            self.average += self.av_array[index % self.averaging_frames] / float(self.averaging_frames)
+
+    def analyse_full_rate(self, first, last):
+        """Analyse the frames first to last of the video one by one, with the second frame source"""
+        engine = self.engine
+        if self.full_rate_source is None:
+            self.full_rate_source = open_frame_source(engine.filename, self.options.get('decoder'))
+            self.full_rate_source.set_output(engine.analysis_size, grayscale=self.grayscale)
+        source = self.full_rate_source
+
+        # The source only seeks when the previous sample wasn't analysed at the full frame rate too
+        if source.position != first:
+            source.seek(first)
+        while source.position <= last:
+            frame_index = source.position
+            if self.skip_frame(frame_index):
+                if not source.grab():
+                    break
+                continue
+            frame = source.read()
+            if frame is None:
+                break
+            self.analyse(apply_masks(frame, engine.crop, engine.mask_regions), frame_index, source.timestamp)
+
+    def add_slide(self, transition_frame, timestamp):
+        """Report a transition and take the screenshot of the slide"""
+        logger.debug("Found slide transition at %s", timestamp)
+
+        # Set the path now, the engine writes the image when the decoder reaches it
+        slidepath = None
+        if self.slide_name:
+            slidepath = os.path.join(self.engine.output_dir, self.slide_name % (len(self.slides)+1))
+            self.engine.screenshot(timestamp + self.options.get('msec_to_delay_screenshot'), slidepath,
+                                   [cv2.IMWRITE_JPEG_QUALITY, 90], self.options.get('slide_callback'))
+
+        self.slides.append((transition_frame, timestamp, slidepath))
+        if self.slide_name and self.options.get('transition_callback'):
+            self.options['transition_callback'](self.slides[-1])
+
+    def finalize(self, final_frame, final_timestamp):
+        # Add am empty slide to hold the terminating timestamp
+        slides = self.slides + [(min(final_frame * self.engine.frame_step, self.engine.source_num_frames),
+                                 final_timestamp, None)]
+        if self.signal_store is not None:
+            self.signal_store.close(final_frame=slides[-1][0], final_timestamp=final_timestamp)
+        if self.full_rate_source is not None:
+            self.full_rate_source.release()
+
+        return slides
+
+
+def find_slides_segment(filename, output_dir, options, start_time=0.0, stop_time=None, slide_name='slide%05d.jpg',  # pylint: disable=too-many-arguments
+                        signal_store=None):
+    """
+    Run the advanced algorithm on a part of the video (see AdvancedDetector)
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param options: the settings of the algorithm (see slide_find_advanced)
+    :param start_time: start of the segment (in seconds)
+    :param stop_time: end of the segment (in seconds, None for the end of the video)
+    :param slide_name: file name template for the screenshots
+    :param signal_store: SignalStore to record the signal of every frame in (only for the whole video)
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    engine = DetectionEngine(filename, output_dir, options)
+    if not engine.isOpened():
+        logger.error("Failed to open file %s", redact_url(filename))
+        return []
+
+    detector = AdvancedDetector(options, start_time, slide_name, signal_store)
+    engine.add(detector)
+    errors = engine.prepare()
+    if errors:
+        for error in errors:
+            logger.error("Algorithm parameter error: %s", error)
+        engine.source.release()
+        return []
+
+    stop_frame = int(round(stop_time * engine.fps)) if stop_time is not None else None
+    return engine.run(detector.first_frame, stop_frame)[detector.name]
+
+
+def advanced_transitions(signal, meta, trigger_ratio, minimum_total_change, minimum_slide_length):
+    """
+    The trigger logic of the advanced algorithm (see find_slides_segment) on a per-frame signal. Like the detector,
+    the frames in the ignore window after a transition are passed over. A recorded signal doesn't have the frames in
+    the ignore windows of the recording: the background model hadn't seen them, so the first averaging_frames frames
+    after such a gap can't trigger (as in the recording).
+    :param signal: the signal (see signalstore)
+    :param meta: dict describing the signal, with fps, frame_step, averaging_frames and pixels (the size of the
+    signal of a frame in which everything changes)
+    :return list with tuples of frame number and timestamp of the transitions
+    """
+    frame_step = meta['frame_step']
+    averaging_frames = meta['averaging_frames']
+    min_pixel_change_av = (minimum_total_change / trigger_ratio) * meta['pixels']
+    minimum_slide_length_in_frames = int(round(minimum_slide_length * meta['fps']))
+    ignore_frames = (minimum_slide_length * meta['fps']) - averaging_frames
+    av_array = np.zeros(averaging_frames, dtype=int)
+
+    transitions = []
+    previous_trigger_frame = 0
+    previous_frame = -1
+    resumed_frame = 0
+    average = 0.0
+    for frame_index, timestamp, whites in zip(signal['frame'].tolist(), signal['timestamp'].tolist(),
+                                              signal['signal'].tolist()):
+        if frame_index > previous_frame + 1:
+            resumed_frame = frame_index
+        previous_frame = frame_index
+        if frame_index <= (previous_trigger_frame + ignore_frames) and frame_index != 0:
+            continue
+
+        whites = int(whites)
+        if ((frame_index - previous_trigger_frame) > minimum_slide_length_in_frames and
+                frame_index >= resumed_frame + averaging_frames) or frame_index == 0:
+            proxy_average = max(average, min_pixel_change_av)
+            if (whites > trigger_ratio * proxy_average) or frame_index == 0:
+                transitions.append((frame_index * frame_step, timestamp))
+                previous_trigger_frame = frame_index
+                average = 0.0
+                av_array[:] = 0
+
+        if previous_trigger_frame != frame_index:
+            average -= av_array[frame_index % averaging_frames] / float(averaging_frames)
+            av_array[frame_index % averaging_frames] = whites
+            average += av_array[frame_index % averaging_frames] / float(averaging_frames)
+
+    return transitions
+
+
+def save_slides(filename, output_dir, options, transitions, meta):
+    """
+    Take the screenshots of transitions found without the frames at hand (e.g. on a stored signal)
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param options: the settings of the algorithm
+    :param transitions: list with tuples of frame number and timestamp
+    :param meta: dict describing the signal, with final_frame and final_timestamp
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    msec_to_delay_screenshot = options.get('msec_to_delay_screenshot')
+    slide_callback = options.get('slide_callback')
+
+    source = open_frame_source(filename, options.get('decoder'))
+    if not source.isOpened():
+        logger.error("Failed to open file %s", redact_url(filename))
+        return []
+
+    slides = []
+    for transition_frame, timestamp in transitions:
+        slidepath = os.path.join(output_dir, 'slide%05d.jpg' % (len(slides)+1))
+        if source.save_frame(timestamp + msec_to_delay_screenshot, slidepath, [cv2.IMWRITE_JPEG_QUALITY, 90]) \
+                and slide_callback:
+            slide_callback(slidepath)
+        slides.append((transition_frame, timestamp, slidepath))
+
+    slides.append((meta['final_frame'], meta['final_timestamp'], None))
+    source.release()
+
+    return slides
+
+
+def replay_slides_advanced(filename, output_dir, options, signal_store):
+    """
+    Run the trigger logic of the advanced algorithm on a stored signal instead of the video. This follows
+    find_slides_segment when it records a signal. Only the screenshots need the video. With the trigger settings of
+    the recording the slides are the same. With other settings they are a close approximation: the frames right after
+    the recorded transitions weren't analysed, so a shorter minimum_slide_length than the one of the recording can't
+    be replayed.
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param options: the settings of the algorithm (see slide_find_advanced)
+    :param signal_store: SignalStore with a stored signal
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    trigger_ratio = options.get('trigger_ratio')
+    minimum_total_change = options.get('minimum_total_change')
+
+    start_time = time.time()
+    signal, meta = signal_store.load()
+
+    if trigger_ratio < 2 or trigger_ratio > 10 or minimum_total_change < 0 or minimum_total_change > 1:
+        logger.error("Algorithm parameter error: trigger_ratio or minimum_total_change out of range")
+        return []
+    if options.get('minimum_slide_length') < meta.get('minimum_slide_length', 0):
+        logger.info("The signal was recorded with a longer minimum_slide_length (%s s)", meta['minimum_slide_length'])
+        return []
+
+    transitions = advanced_transitions(signal, meta, trigger_ratio, minimum_total_change,
+                                       options.get('minimum_slide_length'))
+    logger.info("Replayed the trigger logic on %d stored frames in %.3f s: %d transitions", len(signal),
+                time.time() - start_time, len(transitions))
+
+    return save_slides(filename, output_dir, options, transitions, meta)
+
+
+def find_slides_segment_worker(task):
+    """Process one segment in a worker of the pool (a module level function so it is pickle-able)"""
+    return find_slides_segment(*task)
+
+
+def init_segment_worker():
+    """The parallelism comes from the segments, so every worker runs OpenCV single threaded"""
+    cv2.setNumThreads(1)
+
+
+def find_slides_parallel(filename, output_dir, options):
+    """
+    Split the video in segments and run the advanced algorithm on them in parallel. Every segment is warmed up so
+    the results are the same as a sequential run, except for transitions close to the start of a segment. Those are
+    de-duplicated using the minimum slide length.
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param options: the settings of the algorithm (see slide_find_advanced)
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    workers = options.get('workers')
+    minimum_slide_length = options.get('minimum_slide_length')
+    slide_callback = options.get('slide_callback')
+    # The callbacks and the instruments can't be passed on to the workers, the screenshots are handed over after
+    # merging the segments
+    segment_options = dict([(key, value) for key, value in options.items()
+                            if key not in ['slide_callback', 'transition_callback', 'instruments']])
+
+    source = open_frame_source(filename, options.get('decoder'))
+    if not source.isOpened():
+        logger.error("Failed to open file %s", redact_url(filename))
+        return []
+    duration = source.source_num_frames / source.source_fps
+    source.release()
+
+    # Every segment is warmed up, so very short segments are not worth it
+    segments = max(min(workers, int(duration // (3 * minimum_slide_length))), 1)
+    bounds = np.linspace(0.0, duration, segments + 1)
+    tasks = []
+    for idx in range(segments):
+        stop_time = bounds[idx + 1] if idx < segments - 1 else None
+        tasks.append((filename, output_dir, segment_options, bounds[idx], stop_time, 'segment%03d-slide%%05d.jpg' % idx))
+    logger.debug("Detecting slides in %d segments with %d workers: %s", segments, min(workers, segments), bounds)
+
+    pool = multiprocessing.Pool(processes=min(workers, segments), initializer=init_segment_worker)
+    try:
+        results = pool.map(find_slides_segment_worker, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    if not all(results):
+        logger.error("Slide detection failed for (some of) the segments")
+        return []
+
+    # Merge the segments, keeping the minimum slide length between transitions
+    slides = []
+    for result in results:
+        for frame_idx, time_idx, slidepath in result[:-1]:
+            if slides and time_idx - slides[-1][1] <= minimum_slide_length * 1000:
+                logger.debug("Dropping transition at %s, too close to the previous one at %s", time_idx, slides[-1][1])
+                if os.path.exists(slidepath):
+                    os.remove(slidepath)
+                continue
+
+            finalpath = os.path.join(output_dir, 'slide%05d.jpg' % (len(slides)+1))
+            if os.path.exists(slidepath):
+                os.rename(slidepath, finalpath)
+                if slide_callback:
+                    slide_callback(finalpath)
+            slides.append((frame_idx, time_idx, finalpath))
+
+    # The terminating timestamp of the last segment
+    slides.append(results[-1][-1])
+
+    return slides
+
+
+def changed_pixels(frame, prev_frame, threshold_cutoff, frame_diff, frame_thres):
+    """
+    Count the pixels that changed more than threshold_cutoff between two grayscale frames. frame_diff and frame_thres
+    are buffers (of the size of the frames) for the intermediate images.
+    """
+    cv2.absdiff(frame, prev_frame, dst=frame_diff)
+    cv2.threshold(frame_diff, threshold_cutoff, 255, cv2.THRESH_BINARY, dst=frame_thres)
+    return cv2.countNonZero(frame_thres)
+
+
+class BasicDetector(Detector):
+    """The basic algorithm (see slide_find_basic) as a detector of the engine"""
+    name = 'basic'
+    grayscale = True
+
+    def __init__(self, options, slide_name='slide%05d.png', signal_store=None):
+        """
+        :param options: the settings of the algorithm (see slide_find_basic)
+        :param slide_name: file name template for the screenshots (None to not take screenshots)
+        :param signal_store: SignalStore to record the signal of every frame in
+        """
+        self.options = options
+        self.slide_name = slide_name
+        self.signal_store = signal_store
+        self.engine = None
+        self.results = []
+
+    def setup(self, engine):
+        self.engine = engine
+        # The fraction of changed pixels is relative to the whole frame, including the masks
+        self.analysis_pixels = engine.analysis_size[0] * engine.analysis_size[1]
+
+        # All intermediate images are preallocated, so processing a frame doesn't allocate anything
+        self.prev_frame = np.zeros(engine.cropped_size, np.uint8)
+        self.frame_diff = np.zeros(engine.cropped_size, np.uint8)
+        self.frame_thres = np.zeros(engine.cropped_size, np.uint8)
+        # The transitions are reported at the timestamp of the previous frame
+        self.previous_timestamp = 0.0
+
+        fps = int(engine.fps)  # assume it's constant and we convert to integer
+        logger.debug("FPS: %d, total frames: %d", fps, engine.num_frames)
+        if self.signal_store is not None:
+            # Leave some room as the number of frames in the container is not always exact
+            self.signal_store.create(engine.num_frames + fps + 1, {'fps': engine.fps})
+
+        return []
+
+    def copy(self):
+        return BasicDetector(self.options, slide_name=None)
+
+    def consume(self, frame, index, timestamp):
+        time_idx = self.previous_timestamp
+        self.previous_timestamp = timestamp
+
+        # Find the number of pixels that have (significantly) changed since the last frame
+        d_colors = float(changed_pixels(frame, self.prev_frame, self.options.get('threshold_cutoff'), self.frame_diff,
+                                        self.frame_thres)) / self.analysis_pixels
+        if self.signal_store is not None:
+            self.signal_store.append(index, time_idx, d_colors)
+
+        if d_colors > self.options.get('trigger'):
+            logger.debug("Found slide transition at frame %d, time: %s", index,
+                         datetime.timedelta(milliseconds=time_idx))
+            slidepath = None
+            if self.slide_name:
+                slidepath = os.path.join(self.engine.output_dir, self.slide_name % (len(self.results)+1))
+                self.engine.screenshot(timestamp, slidepath, callback=self.options.get('slide_callback'))
+
+            self.results.append((index, time_idx, slidepath))
+            if self.slide_name and self.options.get('transition_callback'):
+                self.options['transition_callback'](self.results[-1])
+
+        # The frame is shared with the other detectors and reused by the decoder, so keep a copy
+        np.copyto(self.prev_frame, frame)
+
+    def finalize(self, final_frame, final_timestamp):
+        if self.signal_store is not None:
+            self.signal_store.close(final_frame=final_frame, final_timestamp=final_timestamp)
+
+        return self.results + [(final_frame, final_timestamp, None)]
+
+
+def slide_find_basic(filename, output_dir, **kwargs):  # pylint: disable=too-many-locals
+    """
+    Find slide transitions in a video. Method:
+        - Convert to greyscale
+        - Create a diff of two consecutive frames
+        - Check how many pixels have changed 'significantly'
+        - If enough: new slide
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param masks: list of area to mask out before doing slide transition detection
+    :parm threshold_cutoff: threshold to mark a pixel change significant
+    :param trigger: fraction of pixels that need to be changed significantly to trigger new slide
+    :param analysis_width: downscale the frames to this width before the detection (0 to use the full resolution).
+    Screenshots are always taken at the full resolution.
+    :param measure_baseline: log the speedup of analysis_width (see slide_find_advanced)
+    :param decoder: the frame source used to decode the video: opencv or ffmpeg (see slide_find_advanced)
+    :param prefetch: decode this many frames ahead in a separate thread (see slide_find_advanced)
+    :param preview_outputs: extra ffmpeg outputs (e.g. previews) to write from the same decoded frames (requires
+    the ffmpeg decoder)
+    :param slide_callback: function that is called with the path of every screenshot as soon as it is written
+    :param instruments: Instruments to add the time of the stages to (see slide_find_advanced)
+    :param signal_store: directory to store the per-frame signal in. When the video is processed again with only a
+    different trigger, the stored signal is replayed instead of decoding the video.
+    :param auto_roi: detect the region in which the slides are shown (see detect_roi) and only analyse that region
+    :param roi: the region to analyse (x1..x2 and y1..y2 in pixels of the original frames), e.g. detected for an
+    earlier video of the same series. Takes precedence over auto_roi.
+    :param follow: follow a recording that is still being written (see slide_find_advanced)
+    :param transition_callback: function that is called with every transition as soon as the detection found it
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    options = dict(default_settings_basic)
+    options.update(kwargs)
+    options = follow_options(options)
+
+    signal_store = open_signal_store(filename, options, 'basic', signal_settings_basic)
+    # The extra outputs need a full decode anyway
+    if signal_store is not None and signal_store.exists() and not options.get('preview_outputs'):
+        with (options.get('instruments') or Instruments()).timer('replay'):
+            results = replay_slides_basic(filename, output_dir, options, signal_store)
+        if results:
+            return results
+        logger.warning("Replaying the stored signal failed, processing the video again")
+
+    engine = DetectionEngine(filename, output_dir, resolve_roi(filename, options))
+    if not engine.isOpened():
+        logger.error("Failed to open file %s", redact_url(filename))
+        return []
+
+    detector = BasicDetector(options, signal_store=signal_store)
+    engine.add(detector)
+    engine.prepare()
+    return engine.run()[detector.name]
+
+
+def replay_slides_basic(filename, output_dir, options, signal_store):
+    """
+    Apply the trigger of the basic algorithm to a stored signal instead of the video. Only the screenshots need the
+    video.
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param options: the settings of the algorithm (see slide_find_basic)
+    :param signal_store: SignalStore with a stored signal
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    trigger = options.get('trigger')
+    slide_callback = options.get('slide_callback')
+
+    signal, meta = signal_store.load()
+    # The timestamps are taken before reading a frame, so the screenshot of a frame is taken at the timestamp of
+    # the next one
+    shot_timestamps = signal['timestamp'][1:].tolist() + [meta['final_timestamp']]
+    triggers = np.flatnonzero(signal['signal'] > trigger)
+    logger.info("Replayed the trigger on %d stored frames: %d transitions", len(signal), len(triggers))
+
+    source = open_frame_source(filename, options.get('decoder'))
+    if not source.isOpened():
+        logger.error("Failed to open file %s", redact_url(filename))
+        return []
+
+    results = []
+    for idx in triggers.tolist():
+        slidepath = os.path.join(output_dir, 'slide%05d.png' % (len(results)+1))
+        if source.save_frame(shot_timestamps[idx], slidepath) and slide_callback:
+            slide_callback(slidepath)
+        results.append((int(signal['frame'][idx]), float(signal['timestamp'][idx]), slidepath))
+
+    results.append((meta['final_frame'], meta['final_timestamp'], None))
+    source.release()
+
+    return results
+
+
+def slide_find_packets(filename, output_dir, **kwargs):
+    """
+    Find slide transitions in a video without decoding it: the signal is the size of the packets of the video stream
+    (see packets), which goes through the trigger logic of the advanced algorithm. Only the screenshots of the slides
+    are decoded. This works best on screen captures, heavy compression or a lot of motion (e.g. a camera recording)
+    give false positives.
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param trigger_ratio: how many times larger than the average a frame has to be to trigger
+    :param minimum_total_change: minimum size of a frame to trigger, relative to the typical size of a keyframe
+    :param minimum_slide_length: minimum length of a slide (in seconds)
+    :param motion_capture_averaging_time: the time over which to average the size of the frames (in seconds)
+    :param msec_to_delay_screenshot: The amount of delay before taking a screenshot (good for animated slide
+    transitions) in milliseconds
+    :param decoder: the frame source used to take the screenshots: opencv or ffmpeg
+    :param slide_callback: function that is called with the path of every screenshot as soon as it is written
+    :param instruments: Instruments to add the time of the stages to (see slide_find_advanced)
+    :return list with tuples of frame number, timestamp and path to screenshot of slide
+    """
+    options = dict(default_settings_packets)
+    options.update(kwargs)
+
+    if options.get('preview_outputs'):
+        logger.error("Extra outputs can't be written without decoding the video")
+        return []
+
+    trigger_ratio = options.get('trigger_ratio')
+    minimum_total_change = options.get('minimum_total_change')
+    if trigger_ratio < 2 or trigger_ratio > 10 or minimum_total_change < 0 or minimum_total_change > 1:
+        logger.error("Algorithm parameter error: trigger_ratio or minimum_total_change out of range")
+        return []
+
+    start_time = time.time()
+    try:
+        timestamps, sizes, keyframes = read_packets(filename)
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.error("Failed to read the packets of %s: %s", redact_url(filename), err)
+        return []
+
+    if len(sizes) < 2:
+        logger.error("No video packets found in %s", redact_url(filename))
+        return []
+
+    signal, key_size = packet_signal(timestamps, sizes, keyframes)
+    duration = signal['timestamp'][-1] / 1000.0
+    fps = (len(signal) - 1) / duration if duration > 0 else 25.0
+    meta = {
+        'fps': fps,
+        'frame_step': 1,
+        'averaging_frames': max(int(options.get('motion_capture_averaging_time') * fps), 1),
+        'pixels': key_size,
+        'final_frame': int(signal['frame'][-1]),
+        'final_timestamp': float(signal['timestamp'][-1]),
+    }
+    transitions = advanced_transitions(signal, meta, trigger_ratio, minimum_total_change,
+                                       options.get('minimum_slide_length'))
+    analysis_time = time.time() - start_time
+    logger.info("Packet analysis of %d frames (%.0f s of video) took %.2f s (%.0fx real time): %d transitions",
+                len(signal), duration, analysis_time, duration / max(analysis_time, 1e-3), len(transitions))
+    instruments = options.get('instruments') or Instruments()
+    instruments.add_time('packets', analysis_time)
+
+    with instruments.timer('screenshots'):
+        return save_slides(filename, output_dir, options, transitions, meta)
+
+
+def slide_find_multi(filename, output_dir, algorithms, **kwargs):
+    """
+    Run several algorithms on a single decode of the video, e.g. to compare a new algorithm or new settings with the
+    ones in production. The first algorithm is the main one: its settings decide how the video is decoded (masks, roi,
+    analysis_width, decoder, sampling_fps and preview_outputs) and only it takes screenshots. The signal store isn't
+    used.
+
+    :param filename: path to the video
+    :param output_dir: directory to write the screenshots of the slides to
+    :param algorithms: list of dicts with the algorithm (advanced or basic) and its settings, e.g.
+    [{'algorithm': 'advanced'}, {'algorithm': 'basic', 'trigger': 0.02}]. An optional name tells apart two runs of
+    the same algorithm.
+    :param kwargs: settings for all algorithms (e.g. masks and slide_callback)
+    :return dict with the list of slides of every algorithm (by name), tuples of frame number, timestamp and path to
+    screenshot of slide (None for all but the main algorithm)
+    """
+    detectors = []
+    engine_options = None
+    for idx, algorithm in enumerate(algorithms):
+        name = algorithm.get('algorithm', 'advanced')
+        if name == 'basic':
+            options = dict(default_settings_basic)
+            detector_class = BasicDetector
+        elif name == 'advanced':
+            options = dict(default_settings_advanced)
+            detector_class = AdvancedDetector
+        else:
+            raise ValueError("Algorithm %s can't run on the decoded frames" % name)
+        options.update(kwargs)
+        options.update(algorithm)
+        options = follow_options(options)
+        options['signal_store'] = None
+
+        if idx == 0:
+            engine_options = resolve_roi(filename, options)
+            detector = detector_class(options)
+        else:
+            detector = detector_class(options, slide_name=None)
+        detector.name = algorithm.get('name', name)
+        if detector.name in [other.name for other in detectors]:
+            raise ValueError("Algorithm %s is used twice, give it a name" % detector.name)
+        detectors.append(detector)
+
+    if not detectors:
+        return {}
+
+    engine = DetectionEngine(filename, output_dir, engine_options)
+    if not engine.isOpened():
+        logger.error("Failed to open file %s", redact_url(filename))
+        return {}
+
+    for detector in detectors:
+        engine.add(detector)
+    errors = engine.prepare()
+    if errors:
+        for error in errors:
+            logger.error("Algorithm parameter error: %s", error)
+        engine.source.release()
+        return {}
+
+    return engine.run()
@@ -0,0 +1,178 @@
+"""Tests of listing the videos of an archive, running the jobs with a timeout and cleaning up the results"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from backfill import (DONE_FILE, KEY_VARIABLE, METADATA_FILE, find_videos, prune, read_key, read_manifest,
+                      run_pool)
+
+
+def touch(path):
+    """Create an empty file (and its directory)"""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'w').close()
+
+
+def is_running(pid):
+    """Check if a process is still running (a zombie isn't)"""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        with open('/proc/%d/stat' % pid, 'r') as statfile:
+            return statfile.read().split(')')[-1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+
+def job(name):
+    """A job that succeeds, fails or hangs with a child process (writing the pid of the child to a file)"""
+    if name == 'fails':
+        raise RuntimeError("broken video")
+    if name.endswith('.pid'):
+        child = subprocess.Popen(['sleep', '60'])
+        with open(name, 'w') as pidfile:
+            pidfile.write(str(child.pid))
+        time.sleep(60)
+
+
+class FindVideosTest(unittest.TestCase):
+    """The videos of directories, manifests and single files"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, *parts):
+        """A path in the test directory"""
+        return os.path.join(self.directory, *parts)
+
+    def test_directories(self):
+        for name in ['b/lecture2.MP4', 'b/notes.txt', 'a/lecture1.mp4', 'a/deeper/lecture0.webm', 'top.mp4']:
+            touch(self.path('archive', name))
+        touch(self.path('other', 'single.webm'))
+
+        videos = find_videos([self.path('archive'), self.path('other', 'single.webm')])
+        self.assertEqual([video['name'] for video in videos],
+                         ['top.mp4', os.path.join('a', 'lecture1.mp4'), os.path.join('a', 'deeper', 'lecture0.webm'),
+                          os.path.join('b', 'lecture2.MP4'), 'single.webm'])
+        self.assertEqual(videos[0]['path'], self.path('archive', 'top.mp4'))
+        self.assertTrue(all(video['file_id'] is None for video in videos))
+
+        self.assertEqual([video['name'] for video in find_videos([self.path('archive')], ['.webm'])],
+                         [os.path.join('a', 'deeper', 'lecture0.webm')])
+
+    def test_manifest(self):
+        manifest = self.path('lists', 'manifest.txt')
+        touch(manifest)
+        with open(manifest, 'w') as manifestfile:
+            manifestfile.write("# The lectures of 2017\n\nvideos/lecture1.mp4\tfile-1\n  videos/lecture2.mp4  \n"
+                               "%s\tfile-3\n../escaped.mp4\n" % self.path('elsewhere', 'lecture3.mp4'))
+
+        videos = read_manifest(manifest)
+        self.assertEqual(videos, [
+            {'path': self.path('lists', 'videos', 'lecture1.mp4'), 'name': os.path.join('videos', 'lecture1.mp4'),
+             'file_id': 'file-1'},
+            {'path': self.path('lists', 'videos', 'lecture2.mp4'), 'name': os.path.join('videos', 'lecture2.mp4'),
+             'file_id': None},
+            {'path': self.path('elsewhere', 'lecture3.mp4'), 'name': os.path.join('elsewhere', 'lecture3.mp4'),
+             'file_id': 'file-3'},
+            {'path': self.path('lists', '..', 'escaped.mp4'), 'name': 'escaped.mp4', 'file_id': None},
+        ])
+        # Anything that isn't a directory or a video is a manifest
+        self.assertEqual(find_videos([manifest]), videos)
+
+
+class RunPoolTest(unittest.TestCase):
+    """The outcome of every job, with a job that takes too long"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_outcomes(self):
+        ended = []
+        outcomes = run_pool([('first', 'first'), ('fails', 'fails'), ('last', 'last')], job, processes=2,
+                            listener=lambda name, outcome: ended.append((name, outcome)))
+        self.assertEqual(outcomes, {'first': 'done', 'fails': 'failed', 'last': 'done'})
+        self.assertEqual(sorted(ended), sorted(outcomes.items()))
+
+    def test_timeout(self):
+        # The job is killed together with the process it started, the other jobs go on
+        pidfile = os.path.join(self.directory, 'hangs.pid')
+        start_time = time.time()
+        outcomes = run_pool([('hangs', pidfile), ('first', 'first')], job, processes=1, timeout=1)
+        self.assertEqual(outcomes, {'hangs': 'timeout', 'first': 'done'})
+        self.assertLess(time.time() - start_time, 30)
+
+        with open(pidfile, 'r') as pidfile:
+            child = int(pidfile.read())
+        for _ in range(50):
+            if not is_running(child):
+                break
+            time.sleep(0.1)
+        self.assertFalse(is_running(child))
+
+
+class PruneTest(unittest.TestCase):
+    """Only the files of the last run are kept"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_prune(self):
+        names = [METADATA_FILE, DONE_FILE, 'slide00001.jpg', 'slide00002.jpg', 'slide00003.jpg', 'slide00001.png',
+                 'thumbnail.jpg', 'thumbnail.png', 'preview.mp4', 'preview.webm']
+        for name in names:
+            touch(os.path.join(self.directory, name))
+        os.makedirs(os.path.join(self.directory, 'work'))
+
+        prune(self.directory, {
+            'listslides': [[0, 10, 'slide00001.jpg', 10], [10, 30, 'slide00002.jpg', 20], [30, 35, None, 5]],
+            'previews': {'mp4': 'preview.mp4', 'webm': None},
+        })
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted([METADATA_FILE, DONE_FILE, 'preview.mp4', 'slide00001.jpg', 'slide00002.jpg',
+                                 'thumbnail.jpg', 'work']))
+
+
+class ReadKeyTest(unittest.TestCase):
+    """The key comes from a file or the environment, never from the command line"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = os.environ.pop(KEY_VARIABLE, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        os.environ.pop(KEY_VARIABLE, None)
+        if self.environ is not None:
+            os.environ[KEY_VARIABLE] = self.environ
+
+    def test_read_key(self):
+        self.assertIsNone(read_key())
+        os.environ[KEY_VARIABLE] = 'from-environment'
+        self.assertEqual(read_key(), 'from-environment')
+
+        key_file = os.path.join(self.directory, 'key')
+        with open(key_file, 'w') as keyfile:
+            keyfile.write('from-file\n')
+        self.assertEqual(read_key(key_file), 'from-file')
+        self.assertRaises(IOError, read_key, os.path.join(self.directory, 'missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
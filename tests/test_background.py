@@ -0,0 +1,55 @@
+"""Accuracy of the background models of the advanced algorithm on small synthetic videos with a ground truth"""
+
+import shutil
+import tempfile
+import unittest
+
+from benchmark.generator import default_spec, generate_video
+from benchmark.suite import detect
+from tuning import read_ground_truth, score_transitions
+
+MASKS = [{'location': 'bottom-right', 'size_x': '20%', 'size_y': '20%'}]
+
+# Small versions of the videos of the benchmark suite, with the minimal recall of every model. Both models find every
+# transition of a cut, the running average can miss a fade and KNN a wipe behind the presenter (depending on the
+# version of OpenCV). A model never finds a transition that isn't there.
+SPEC = dict(default_spec, width=320, height=180, fps=10, duration=150, crf=30)
+VIDEOS = [
+    (dict(SPEC, name='cut'), {'knn': 1.0, 'running_average': 1.0}),
+    (dict(SPEC, name='noisy', noise=6, seed=3), {'knn': 1.0, 'running_average': 1.0}),
+    (dict(SPEC, name='fade', transition='fade', transition_time=1.0, seed=1), {'knn': 1.0, 'running_average': 0.6}),
+    (dict(SPEC, name='wipe-presenter', transition='wipe', transition_time=0.5, presenter=True, seed=2),
+     {'knn': 0.6, 'running_average': 0.6}),
+]
+
+
+class BackgroundModelAccuracyTest(unittest.TestCase):
+    """Score both background models against the ground truth, to catch regressions of either"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def check_model(self, model):
+        """Check the precision and the recall of a model on every video"""
+        for spec, minimal_recall in VIDEOS:
+            filename, truth_path = generate_video(spec, self.directory, encoder='opencv')
+            transitions = detect('advanced', filename, {'background_model': model, 'masks': MASKS})
+            score = score_transitions(transitions, read_ground_truth(truth_path))
+            self.assertEqual(score['precision'], 1.0, "%s on %s: %s" % (model, spec['name'], transitions))
+            self.assertGreaterEqual(score['recall'], minimal_recall[model],
+                                    "%s on %s: %s" % (model, spec['name'], transitions))
+
+    def test_knn(self):
+        self.check_model('knn')
+
+    def test_running_average(self):
+        self.check_model('running_average')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Tests of the CPU budget: the cgroup CPU quota and how the CPUs are split"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cpubudget
+from cpubudget import cgroup_cpu_quota, cpu_budget
+
+
+class CgroupQuotaTest(unittest.TestCase):
+    """Parsing the CPU quota of cgroup v1 and v2, in a fake cgroup filesystem"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, content):
+        """Write a file of the fake cgroup filesystem"""
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as cgroupfile:
+            cgroupfile.write(content + '\n')
+
+    def test_no_cgroup(self):
+        self.assertIsNone(cgroup_cpu_quota(self.root))
+
+    def test_v2(self):
+        for content, quota in [('max 100000', None), ('150000 100000', 1.5), ('50000 50000', 1.0),
+                               ('200000', 2.0), ('lots 100000', None), ('100000 0', None)]:
+            self.write('cpu.max', content)
+            self.assertEqual(cgroup_cpu_quota(self.root), quota, content)
+
+    def test_v1(self):
+        for controller in ['cpu', 'cpu,cpuacct', 'cpuacct,cpu']:
+            root = os.path.join(self.root, controller.replace(',', '_'))
+            self.root, previous = root, self.root
+            try:
+                self.write(os.path.join(controller, 'cpu.cfs_period_us'), '100000')
+                for content, quota in [('-1', None), ('250000', 2.5), ('50000', 0.5), ('many', None)]:
+                    self.write(os.path.join(controller, 'cpu.cfs_quota_us'), content)
+                    self.assertEqual(cgroup_cpu_quota(self.root), quota, (controller, content))
+            finally:
+                self.root = previous
+
+    def test_v2_first(self):
+        # On a hybrid setup the cgroup v2 quota counts
+        self.write('cpu.max', 'max 100000')
+        self.write(os.path.join('cpu', 'cpu.cfs_quota_us'), '50000')
+        self.write(os.path.join('cpu', 'cpu.cfs_period_us'), '100000')
+        self.assertIsNone(cgroup_cpu_quota(self.root))
+
+
+class CpuBudgetTest(unittest.TestCase):
+    """Splitting the CPUs between the encoding and the detection"""
+
+    def setUp(self):
+        self.available_cpus = cpubudget.available_cpus
+        self.cpus = 8
+        cpubudget.available_cpus = lambda: self.cpus
+
+    def tearDown(self):
+        cpubudget.available_cpus = self.available_cpus
+
+    def test_split(self):
+        self.assertEqual(cpu_budget(), {'cpus': 8, 'encoding': 4, 'detection': 4, 'uploads': 1})
+        self.assertEqual(cpu_budget({'encoding_share': 0.25, 'uploads': 3}),
+                         {'cpus': 8, 'encoding': 2, 'detection': 6, 'uploads': 3})
+
+    def test_limits(self):
+        # The setting can only lower the number of CPUs
+        self.assertEqual(cpu_budget({'cpus': 3})['cpus'], 3)
+        self.assertEqual(cpu_budget({'cpus': 16})['cpus'], 8)
+        # Both get at least one thread
+        self.assertEqual(cpu_budget({'encoding_share': 0.0})['encoding'], 1)
+        self.assertEqual(cpu_budget({'encoding_share': 1.5})['detection'], 1)
+        self.cpus = 1
+        self.assertEqual(cpu_budget(), {'cpus': 1, 'encoding': 1, 'detection': 1, 'uploads': 1})
+
+    def test_available_cpus(self):
+        self.assertGreaterEqual(self.available_cpus(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
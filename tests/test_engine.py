@@ -0,0 +1,262 @@
+"""Tests of the screenshots and the skipped frames of the detection engine"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from engine import BASELINE_FRAMES, DetectionEngine, Detector
+from framesource import OpenCVFrameSource, PrefetchFrameSource
+from slidedetection import BasicDetector, default_settings_basic
+
+FPS = 25
+FRAMES = 100
+
+
+def write_numbered_video(path):
+    """A video in which every frame has its own brightness, so a screenshot tells which frame it is"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (160, 120))
+    for index in range(FRAMES):
+        writer.write(np.full((120, 160, 3), 20 + 2 * index, np.uint8))
+    writer.release()
+
+
+class ScreenshotDetector(Detector):
+    """Asks for screenshots at fixed times, while the frames go by"""
+    name = 'screenshots'
+
+    def __init__(self, output_dir, timestamps):
+        self.output_dir = output_dir
+        self.timestamps = timestamps
+        self.engine = None
+
+    def setup(self, engine):
+        self.engine = engine
+        return []
+
+    def consume(self, frame, index, timestamp):
+        if index == 0:
+            for timestamp in self.timestamps:
+                self.engine.screenshot(timestamp, os.path.join(self.output_dir, '%d.png' % timestamp))
+
+    def finalize(self, final_frame, final_timestamp):
+        return [(final_frame, final_timestamp, None)]
+
+
+class EngineScreenshotTest(unittest.TestCase):
+    """The prefetching decoder takes the same screenshots as the plain one, while decoding"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.end = None
+        self.video = os.path.join(self.directory, 'numbered.avi')
+        write_numbered_video(self.video)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def take_screenshots(self, timestamps, **options):
+        """Run the engine and return the brightness of every screenshot and whether the decoder had to seek"""
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        engine = DetectionEngine(self.video, output_dir, dict(options, decoder='opencv'))
+        engine.add(ScreenshotDetector(output_dir, timestamps))
+        self.assertEqual(engine.prepare(), [])
+        seeks = []
+        save_frame = engine.source.save_frame
+
+        def counting_save_frame(timestamp, path, params=None):
+            """Count the screenshots that are taken with a seek"""
+            seeks.append(timestamp)
+            return save_frame(timestamp, path, params)
+
+        engine.source.save_frame = counting_save_frame
+        self.end = engine.run()['screenshots'][-1][1]
+        brightness = [int(cv2.imread(os.path.join(output_dir, '%d.png' % timestamp))[60, 80, 0])
+                      for timestamp in timestamps]
+        return brightness, seeks
+
+    def test_prefetch_in_pass(self):
+        # The screenshots are asked for long before the decoder reaches them
+        timestamps = [1000, 2000, 3000]
+        plain, plain_seeks = self.take_screenshots(timestamps)
+        prefetched, prefetch_seeks = self.take_screenshots(timestamps, prefetch=4)
+        self.assertEqual(prefetched, plain)
+        self.assertEqual(plain_seeks, [])
+        self.assertEqual(prefetch_seeks, [])
+
+    def test_prefetch_passed(self):
+        # The decoder is already past the frame when the screenshot is asked for: it is taken at the end
+        prefetched, seeks = self.take_screenshots([0], prefetch=4)
+        self.assertEqual(prefetched, self.take_screenshots([0])[0])
+        self.assertEqual(seeks, [0])
+
+    def test_sampling(self):
+        # Every 5th frame is analysed: the screenshots of the frames in between are the exact frames all the same
+        timestamps = [1000, 1080, 1160, 2040]
+        expected = self.take_screenshots(timestamps)[0]
+        self.assertEqual(len(set(expected)), len(timestamps))
+        for options in [{}, {'prefetch': 4}]:
+            brightness, seeks = self.take_screenshots(timestamps, sampling_fps=5, **options)
+            self.assertEqual(brightness, expected, options)
+            self.assertEqual(seeks, [1080, 1160, 2040])
+            # The video ends at its last frame, not at the last frame that was analysed
+            self.assertAlmostEqual(self.end, (FRAMES - 1) * 1000.0 / FPS)
+
+
+class SkippingDetector(Detector):
+    """Skips the frames of a window after given frames, like the ignore window after a transition"""
+    name = 'skipping'
+
+    def __init__(self, windows):
+        self.windows = windows
+        self.until = 0
+        self.frames = []
+
+    def skip(self, index):
+        return index < self.until
+
+    def consume(self, frame, index, timestamp):
+        self.frames.append((index, int(frame[60, 80, 0])))
+        self.until = self.windows.get(index, 0)
+
+    def finalize(self, final_frame, final_timestamp):
+        return [(final_frame, final_timestamp, None)]
+
+
+class CountingSource(OpenCVFrameSource):
+    """Counts the frames that are converted into images and the ones that are only grabbed"""
+
+    def __init__(self, filename, fail_at=None):
+        OpenCVFrameSource.__init__(self, filename)
+        self.fail_at = fail_at
+        self.reads = 0
+        self.grabs = 0
+        self.released = False
+
+    def read(self):
+        if self.position == self.fail_at:
+            raise IOError("broken frame")
+        self.reads += 1
+        return OpenCVFrameSource.read(self)
+
+    def grab(self):
+        self.grabs += 1
+        return OpenCVFrameSource.grab(self)
+
+    def release(self):
+        self.released = True
+        OpenCVFrameSource.release(self)
+
+
+class EnginePrefetchTest(unittest.TestCase):
+    """The prefetching decoder doesn't convert the frames the detectors skip into images"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'numbered.avi')
+        write_numbered_video(self.video)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_detector(self, **options):
+        """Run the skipping detector, return the frames it got and the frame source"""
+        engine = DetectionEngine(self.video, self.directory, dict(options, decoder='opencv'))
+        engine.source = CountingSource(self.video)
+        detector = SkippingDetector({9: 40, 50: 80})
+        engine.add(detector)
+        self.assertEqual(engine.prepare(), [])
+        source = engine.source.source if options.get('prefetch') else engine.source
+        self.assertEqual(engine.run()['skipping'][-1][0], FRAMES)
+        return detector.frames, source
+
+    def test_grab_ahead(self):
+        plain, plain_source = self.run_detector()
+        self.assertEqual([index for index, _ in plain], list(range(10)) + list(range(40, 51)) + list(range(80, 100)))
+        # and the read that finds the end of the video
+        self.assertEqual(plain_source.reads, len(plain) + 1)
+
+        prefetched, source = self.run_detector(prefetch=4)
+        self.assertEqual(prefetched, plain)
+        # Only the frames decoded ahead before the detector started skipping were converted needlessly
+        self.assertLessEqual(source.reads, len(plain) + 1 + 2 * 4)
+        self.assertGreaterEqual(source.grabs, FRAMES - len(plain) - 2 * 4)
+
+    def test_read_grabbed(self):
+        plain = OpenCVFrameSource(self.video)
+        expected = [np.copy(plain.read()) for _ in range(4)][3]
+        plain.release()
+
+        # The frames before the position can only be grabbed
+        source = PrefetchFrameSource(CountingSource(self.video), 4)
+        source.grab_until(3)
+        self.assertTrue(source.grab())
+        self.assertRaises(ValueError, source.read)
+        self.assertTrue(source.grab())
+        self.assertTrue(np.array_equal(source.read(), expected))
+        self.assertEqual(source.source.grabs, 3)
+        source.release()
+
+    def test_decoder_fails(self):
+        # The decoder thread closes the video when it fails, the caller gets the error
+        wrapped = CountingSource(self.video, fail_at=5)
+        source = PrefetchFrameSource(wrapped, 4)
+        for _ in range(5):
+            self.assertIsNotNone(source.read())
+        self.assertRaises(IOError, source.read)
+        self.assertTrue(wrapped.released)
+        self.assertIsNone(source.read())
+        source.release()
+
+
+class EngineBaselineTest(unittest.TestCase):
+    """The detectors are timed at the original resolution to report the speedup of the analysis resolution"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'numbered.avi')
+        write_numbered_video(self.video)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_baseline(self):
+        engine = DetectionEngine(self.video, self.directory, {'decoder': 'opencv', 'analysis_width': 80,
+                                                              'measure_baseline': True})
+        engine.add(BasicDetector(dict(default_settings_basic), slide_name=None))
+        engine.add(ScreenshotDetector(self.directory, []))
+        self.assertEqual(engine.prepare(), [])
+        measured = []
+        measure_baseline = engine._measure_baseline  # pylint: disable=protected-access
+
+        def recording_measure_baseline():
+            """Keep the measurement"""
+            measured.append(measure_baseline())
+            return measured[-1]
+
+        engine._measure_baseline = recording_measure_baseline  # pylint: disable=protected-access
+        slides = engine.run()
+        # Only the detector that can be copied is timed, the copy doesn't change the results
+        self.assertEqual(len(measured), 1)
+        resize_time, baseline = measured[0]
+        self.assertGreater(resize_time, 0.0)
+        self.assertEqual(list(baseline.keys()), ['basic'])
+        self.assertGreater(baseline['basic'], 0.0)
+        self.assertEqual(slides['basic'][-1][0], FRAMES)
+        self.assertGreater(FRAMES, BASELINE_FRAMES)
+
+    def test_no_baseline(self):
+        # At the original resolution there is nothing to compare with, and the measurement is only done on request
+        for options in [{'measure_baseline': True}, {'analysis_width': 80}]:
+            engine = DetectionEngine(self.video, self.directory, dict(options, decoder='opencv'))
+            engine.add(BasicDetector(dict(default_settings_basic), slide_name=None))
+            self.assertEqual(engine.prepare(), [])
+            engine._measure_baseline = None  # pylint: disable=protected-access
+            engine.run()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Tests of reading the settings of the extractor for the tools next to it"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from extractorsettings import algorithm_settings, read_settings_file
+from slidedetection import default_settings_advanced, default_settings_basic
+
+
+class ExtractorSettingsTest(unittest.TestCase):
+    """The masks and the algorithm settings are the ones of the extractor"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_file = os.path.join(self.directory, 'settings.yml')
+        with open(self.settings_file, 'w') as settingsfile:
+            settingsfile.write("masks:\n  - location: top-left\n    size_x: 100\n    size_y: 50\n"
+                               "slides:\n  - algorithm: advanced\n    analysis_width: 640\n    threshold_cutoff: 90\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read(self):
+        settings = read_settings_file(self.settings_file)
+        self.assertEqual(settings['masks'], [{'location': 'top-left', 'size_x': 100, 'size_y': 50}])
+        self.assertIn('masks', read_settings_file())
+        self.assertRaises(IOError, read_settings_file, os.path.join(self.directory, 'missing.yml'))
+
+    def test_algorithm_settings(self):
+        settings = read_settings_file(self.settings_file)
+        advanced = algorithm_settings(settings, 'advanced', default_settings_advanced)
+        self.assertEqual(advanced, dict(default_settings_advanced, analysis_width=640))
+        # The extractor runs another algorithm
+        self.assertEqual(algorithm_settings(settings, 'basic', default_settings_basic), default_settings_basic)
+        self.assertEqual(algorithm_settings({}, 'advanced', default_settings_advanced), default_settings_advanced)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+"""Tests of the timers and counters of a job, their sinks and the progress of a small detection run"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from instrumentation import Instruments, JsonLinesSink, PrometheusSink, compact_summary, open_sink
+from slidedetection import slide_find_basic
+
+FPS = 10
+DURATION = 30
+SLIDE_STARTS = [0, 12, 21]
+
+
+def write_cut_video(path):
+    """A short video of slides with a bar of text, with hard cuts between the slides"""
+    width, height = 160, 120
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (width, height))
+    for index in range(FPS * DURATION):
+        seconds = float(index) / FPS
+        slide = max(idx for idx, start in enumerate(SLIDE_STARTS) if start <= seconds)
+        image = np.full((height, width, 3), 230, np.uint8)
+        cv2.rectangle(image, (16, 20 + 25 * slide), (144, 40 + 25 * slide), (40, 40, 40), -1)
+        writer.write(image)
+    writer.release()
+
+
+class InstrumentsTest(unittest.TestCase):
+    """The timers, counters and the progress reports"""
+
+    def test_timers_and_counters(self):
+        instruments = Instruments()
+        instruments.add_time('decode', 1.5, 10)
+        instruments.add_time('decode', 0.25)
+        with instruments.timer('upload'):
+            time.sleep(0.01)
+        with instruments.timer('upload'):
+            pass
+        instruments.count('retries')
+        instruments.count('frames', 40)
+        instruments.count('frames', 2)
+
+        summary = instruments.summary()
+        self.assertEqual(summary['stages']['decode'], {'seconds': 1.75, 'calls': 11})
+        self.assertEqual(summary['stages']['upload']['calls'], 2)
+        self.assertGreaterEqual(summary['stages']['upload']['seconds'], 0.01)
+        self.assertEqual(summary['counters'], {'retries': 1, 'frames': 42})
+        self.assertGreaterEqual(summary['wall_time'], 0.01)
+        # The summary is JSON serializable
+        self.assertEqual(json.loads(json.dumps(summary)), summary)
+
+        self.assertEqual(compact_summary(summary), {
+            'wall_time': summary['wall_time'],
+            'stages': {'decode': 1.75, 'upload': summary['stages']['upload']['seconds']},
+            'counters': {'retries': 1, 'frames': 42},
+        })
+        self.assertNotIn('counters', compact_summary(Instruments().summary()))
+
+    def test_threads(self):
+        instruments = Instruments()
+
+        def work():
+            """Count and time from a thread"""
+            for _ in range(1000):
+                instruments.count('frames')
+                instruments.add_time('detector', 0.001)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        summary = instruments.summary()
+        self.assertEqual(summary['counters']['frames'], 4000)
+        self.assertEqual(summary['stages']['detector']['calls'], 4000)
+        self.assertAlmostEqual(summary['stages']['detector']['seconds'], 4.0, places=2)
+
+    def test_progress(self):
+        reports = []
+        instruments = Instruments(lambda *report: reports.append(report), progress_interval=3600)
+        # The first call starts the clock, then the listener hears at most once per interval, and at the end
+        instruments.progress(0, 100)
+        time.sleep(0.01)
+        instruments.progress(10, 100)
+        instruments.progress(50, 100)
+        instruments.progress(100, 100)
+        self.assertEqual([fraction for fraction, _, _ in reports], [0.1, 1.0])
+        fraction, fps, remaining = reports[0]
+        self.assertGreater(fps, 0)
+        self.assertAlmostEqual(remaining, 90 / fps)
+        self.assertEqual(reports[1][2], 0)
+
+        # Without a length nothing is reported, nor without a listener
+        reports = []
+        instruments = Instruments(lambda *report: reports.append(report), progress_interval=0)
+        instruments.progress(0, 0)
+        instruments.progress(10, 0)
+        self.assertEqual(reports, [])
+        Instruments().progress(0, 100)
+        Instruments().progress(10, 100)
+
+
+class SinkTest(unittest.TestCase):
+    """The summary of a job in the JSON-lines file and the Prometheus textfile"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.summary = {
+            'wall_time': 12.5,
+            'stages': {'decode': {'seconds': 8.25, 'calls': 300}, 'upload': {'seconds': 1.0, 'calls': 3}},
+            'counters': {'screenshots': 3},
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_jsonl(self):
+        path = os.path.join(self.directory, 'jobs.jsonl')
+        sink = JsonLinesSink(path)
+        sink.write({'file_id': 'file-1'}, self.summary)
+        sink.write({'file_id': 'file-2'}, dict(self.summary, wall_time=1.0))
+
+        with open(path, 'r') as sinkfile:
+            records = [json.loads(line) for line in sinkfile]
+        self.assertEqual([record['file_id'] for record in records], ['file-1', 'file-2'])
+        self.assertEqual(records[0]['stages'], self.summary['stages'])
+        self.assertEqual(records[0]['counters'], self.summary['counters'])
+        self.assertEqual([record['wall_time'] for record in records], [12.5, 1.0])
+        self.assertLessEqual(records[0]['time'], time.time())
+
+    def test_prometheus(self):
+        path = os.path.join(self.directory, 'video_presentation.prom')
+        sink = PrometheusSink(path)
+        sink.write({'file_id': 'file-1'}, dict(self.summary, wall_time=99.0))
+        # Only the last job is kept, the file is replaced
+        sink.write({'file_id': 'file-"2"'}, self.summary)
+        self.assertEqual(os.listdir(self.directory), ['video_presentation.prom'])
+
+        with open(path, 'r') as sinkfile:
+            lines = sinkfile.read().splitlines()
+        metrics = dict([line.rsplit(' ', 1) for line in lines if not line.startswith('#')])
+        labels = 'file_id="file-\\"2\\""'
+        self.assertEqual(metrics['video_presentation_job_seconds{%s}' % labels], '12.5')
+        self.assertEqual(metrics['video_presentation_stage_seconds{%s,stage="decode"}' % labels], '8.25')
+        self.assertEqual(metrics['video_presentation_stage_calls{%s,stage="decode"}' % labels], '300.0')
+        self.assertEqual(metrics['video_presentation_stage_seconds{%s,stage="upload"}' % labels], '1.0')
+        self.assertEqual(metrics['video_presentation_count{%s,name="screenshots"}' % labels], '3.0')
+        self.assertIn('video_presentation_job_timestamp_seconds{%s}' % labels, metrics)
+        self.assertEqual(len(metrics), 7)
+        # Every metric has a single declaration of its type
+        types = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+        self.assertEqual(len(types), len(set(types)))
+        for line in lines:
+            if not line.startswith('#'):
+                self.assertIn(re.match(r'\w+', line).group(0), types)
+
+    def test_open_sink(self):
+        path = os.path.join(self.directory, 'jobs.jsonl')
+        self.assertIsInstance(open_sink({'sink': 'jsonl', 'path': path}), JsonLinesSink)
+        self.assertIsInstance(open_sink({'sink': 'prometheus', 'path': path}), PrometheusSink)
+        self.assertIsNone(open_sink({}))
+        self.assertIsNone(open_sink({'sink': 'statsd', 'path': path}))
+        self.assertIsNone(open_sink({'sink': 'jsonl'}))
+
+
+class DetectionProgressTest(unittest.TestCase):
+    """The stages, counters and progress of a detection run"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'cut.avi')
+        write_cut_video(self.video)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_detection(self):
+        reports = []
+        instruments = Instruments(lambda *report: reports.append(report), progress_interval=0)
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        slides = slide_find_basic(self.video, output_dir, instruments=instruments)
+        self.assertEqual([frame for frame, _, _ in slides], [0, 120, 210, FPS * DURATION])
+
+        # The progress is reported every percent, up to the end
+        fractions = [fraction for fraction, _, _ in reports]
+        self.assertEqual(len(fractions), 100)
+        self.assertEqual(fractions, sorted(fractions))
+        self.assertEqual(fractions[-1], 1.0)
+        self.assertTrue(all(fps > 0 for _, fps, _ in reports))
+        self.assertEqual(reports[-1][2], 0)
+
+        summary = instruments.summary()
+        self.assertEqual(summary['counters']['frames_decoded'] + summary['counters']['frames_skipped'],
+                         FPS * DURATION)
+        self.assertEqual(summary['stages']['detector:basic']['calls'], summary['counters']['frames_decoded'])
+        self.assertEqual(summary['stages']['screenshots']['calls'], 3)
+        for stage in ['decode', 'detector:basic', 'screenshots']:
+            self.assertGreater(summary['stages'][stage]['seconds'], 0)
+
+        # The summary of the run ends up in the sink
+        path = os.path.join(self.directory, 'jobs.jsonl')
+        open_sink({'sink': 'jsonl', 'path': path}).write({'file_id': 'cut'}, summary)
+        with open(path, 'r') as sinkfile:
+            self.assertEqual(json.loads(sinkfile.read())['counters'], summary['counters'])
+
+
+if __name__ == '__main__':
+    unittest.main()
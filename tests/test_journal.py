@@ -0,0 +1,91 @@
+"""Tests of the journal that lets a retried job resume"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from journal import JOURNAL_FILE, JobJournal
+
+SETTINGS = {'slides': {'algorithm': 'advanced'}, 'previews': ['mp4']}
+
+
+class JobJournalTest(unittest.TestCase):
+    """Resuming, finishing and cleaning up jobs"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        journal = JobJournal('file-id', SETTINGS, self.directory)
+        self.assertFalse(journal.done('encode'))
+        journal.record('encode')
+        journal.record('detection', [[0, 0.0, 'slide00001.jpg'], [250, 10000.0, None]])
+        journal.record_upload('slide00001.jpg', 'preview-id')
+        self.assertEqual(os.listdir(journal.work_dir), [JOURNAL_FILE])
+
+        # The job is retried
+        resumed = JobJournal('file-id', dict(SETTINGS), self.directory)
+        self.assertEqual(resumed.work_dir, journal.work_dir)
+        self.assertTrue(resumed.done('encode'))
+        self.assertEqual(resumed.get('detection'), [[0, 0.0, 'slide00001.jpg'], [250, 10000.0, None]])
+        self.assertEqual(resumed.upload_id('slide00001.jpg'), 'preview-id')
+        self.assertIsNone(resumed.upload_id('slide00002.jpg'))
+        self.assertFalse(resumed.done('shadow'))
+        self.assertEqual(resumed.get('shadow', []), [])
+
+    def test_other_job(self):
+        journal = JobJournal('file-id', SETTINGS, self.directory)
+        journal.record('encode')
+        for resource_id, settings in [('other-id', SETTINGS), ('file-id', dict(SETTINGS, previews=[]))]:
+            other = JobJournal(resource_id, settings, self.directory)
+            self.assertNotEqual(other.work_dir, journal.work_dir)
+            self.assertFalse(other.done('encode'))
+
+    def test_broken_journal(self):
+        journal = JobJournal('file-id', SETTINGS, self.directory)
+        with open(os.path.join(journal.work_dir, JOURNAL_FILE), 'w') as journalfile:
+            journalfile.write('{"encode": tr')
+        resumed = JobJournal('file-id', SETTINGS, self.directory)
+        self.assertFalse(resumed.done('encode'))
+        resumed.record('encode')
+        self.assertTrue(JobJournal('file-id', SETTINGS, self.directory).done('encode'))
+
+    def test_finish(self):
+        journal = JobJournal('file-id', SETTINGS, self.directory)
+        journal.record('encode')
+        journal.finish()
+        self.assertFalse(os.path.exists(journal.work_dir))
+        self.assertFalse(JobJournal('file-id', SETTINGS, self.directory).done('encode'))
+
+    def test_cleanup(self):
+        old = JobJournal('old-id', SETTINGS, self.directory)
+        recent = JobJournal('recent-id', SETTINGS, self.directory)
+        eight_days_ago = time.time() - 8 * 86400
+        os.utime(old.work_dir, (eight_days_ago, eight_days_ago))
+
+        # Starting a job cleans up the work directories of jobs that weren't retried
+        JobJournal('file-id', SETTINGS, self.directory, keep_days=7)
+        self.assertFalse(os.path.exists(old.work_dir))
+        self.assertTrue(os.path.exists(recent.work_dir))
+
+    def test_temporary(self):
+        journal = JobJournal('file-id', SETTINGS)
+        self.assertFalse(journal.persistent)
+        self.assertTrue(os.path.isdir(journal.work_dir))
+        journal.record('encode')
+        journal.record_upload('slide00001.jpg', 'preview-id')
+        self.assertTrue(journal.done('encode'))
+        self.assertEqual(journal.upload_id('slide00001.jpg'), 'preview-id')
+        self.assertEqual(os.listdir(journal.work_dir), [])
+
+        journal.finish()
+        self.assertFalse(os.path.exists(journal.work_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
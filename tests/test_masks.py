@@ -0,0 +1,93 @@
+"""Tests of the masks: the compiled masks must give the same frames as masking every rectangle of every frame"""
+
+import unittest
+
+import numpy as np
+
+from masks import apply_masks, compile_masks, masked_area, prepare_masks, roi_masks, scale_masks
+
+
+def mask_frame(frame, masks):
+    """Masking as it was done before the masks were compiled: zero every mask in the whole frame"""
+    frame = frame.copy()
+    for mask in masks:
+        frame[mask['y1']:mask['y2'], mask['x1']:mask['x2']] = 0
+    return frame
+
+
+def random_masks(rng, frame_size, count):
+    """Random rectangles, some of them spanning the frame at a border"""
+    height, width = frame_size
+    masks = []
+    for _ in range(count):
+        x1, x2 = sorted(rng.randint(0, width + 1, 2))
+        y1, y2 = sorted(rng.randint(0, height + 1, 2))
+        span = rng.randint(4)
+        if span == 0:
+            x1, x2 = 0, width
+            y1, y2 = (0, y2) if rng.randint(2) else (y1, height)
+        elif span == 1:
+            y1, y2 = 0, height
+            x1, x2 = (0, x2) if rng.randint(2) else (x1, width)
+        masks.append({'x1': int(x1), 'x2': int(x2), 'y1': int(y1), 'y2': int(y2)})
+    return masks
+
+
+class CompiledMasksTest(unittest.TestCase):
+    """compile_masks and apply_masks against masking every rectangle"""
+
+    def check_masks(self, frame, masks):
+        """The compiled masks keep exactly the pixels that the old masking kept"""
+        expected = mask_frame(frame, masks)
+        crop, regions = compile_masks(masks, frame.shape[:2])
+        masked = apply_masks(frame.copy(), crop, regions)
+
+        np.testing.assert_array_equal(masked, expected[crop])
+        # Everything that is cropped away was masked
+        outside = np.ones(frame.shape[:2], dtype=bool)
+        outside[crop] = False
+        self.assertEqual(np.count_nonzero(expected[outside]), 0)
+        # The number of pixels that aren't masked
+        self.assertEqual(frame.shape[0] * frame.shape[1] - masked_area(masks, frame.shape[:2]),
+                         np.count_nonzero(mask_frame(np.ones(frame.shape[:2], np.uint8), masks)))
+
+    def test_random_masks(self):
+        rng = np.random.RandomState(0)
+        for _ in range(300):
+            frame_size = (int(rng.randint(1, 40)), int(rng.randint(1, 40)))
+            shape = frame_size + (3,) if rng.randint(2) else frame_size
+            frame = rng.randint(1, 256, shape).astype(np.uint8)
+            self.check_masks(frame, random_masks(rng, frame_size, rng.randint(0, 5)))
+
+    def test_settings(self):
+        # The default mask of the settings and a region of interest
+        frame_size = (360, 640)
+        masks = prepare_masks([{'location': 'bottom-right', 'size_x': '20%', 'size_y': '20%'}], frame_size)
+        self.assertEqual(masks, [{'x1': 512, 'x2': 640, 'y1': 288, 'y2': 360}])
+        masks += roi_masks({'x1': 40, 'x2': 600, 'y1': 20, 'y2': 340}, frame_size)
+        frame = np.random.RandomState(1).randint(1, 256, frame_size + (3,)).astype(np.uint8)
+        self.check_masks(frame, masks)
+        self.assertEqual(compile_masks(masks, frame_size)[0], (slice(20, 340), slice(40, 600)))
+
+    def test_everything_masked(self):
+        # The frame isn't cropped to nothing
+        masks = [{'x1': 0, 'x2': 30, 'y1': 0, 'y2': 20}]
+        crop, regions = compile_masks(masks, (20, 30))
+        self.assertEqual(crop, (slice(0, 20), slice(0, 30)))
+        self.assertEqual(regions, [(slice(0, 20), slice(0, 30))])
+        self.check_masks(np.full((20, 30), 9, np.uint8), masks)
+
+    def test_scaled_masks_cover(self):
+        # A scaled mask covers at least the area of the original mask
+        rng = np.random.RandomState(2)
+        masks = random_masks(rng, (720, 1280), 20)
+        for scale in [0.5, 0.25, 0.3333]:
+            for mask, scaled in zip(masks, scale_masks(masks, scale)):
+                self.assertLessEqual(scaled['x1'], mask['x1'] * scale)
+                self.assertLessEqual(scaled['y1'], mask['y1'] * scale)
+                self.assertGreaterEqual(scaled['x2'], mask['x2'] * scale)
+                self.assertGreaterEqual(scaled['y2'], mask['y2'] * scale)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Tests of running several algorithms on a single decode, on a synthetic video with hard cuts between the slides"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from slidedetection import slide_find_advanced, slide_find_basic, slide_find_multi
+
+FPS = 10
+DURATION = 120
+SLIDE_STARTS = [0, 22, 50, 76, 100]
+
+
+def write_cut_video(path):
+    """A video of slides with bars of text and a moving presenter in a corner, with hard cuts between the slides"""
+    width, height = 320, 240
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (width, height))
+    for index in range(FPS * DURATION):
+        seconds = float(index) / FPS
+        slide = max(idx for idx, start in enumerate(SLIDE_STARTS) if start <= seconds)
+        image = np.full((height, width, 3), 230, np.uint8)
+        lengths = np.random.RandomState(slide)
+        for line in range(10):
+            top = int(height * (0.1 + line * 0.07))
+            right = int(width * (0.3 + 0.6 * lengths.rand()))
+            cv2.rectangle(image, (int(width * 0.1), top), (right, top + int(height * 0.035)), (40, 40, 40), -1)
+        center = (int(width * 0.85 + 12 * np.sin(seconds * 3)), int(height * 0.85))
+        cv2.circle(image, center, int(height * 0.06), (0, 0, 200), -1)
+        writer.write(image)
+    writer.release()
+
+
+def transitions(slides):
+    """The frame numbers and timestamps of the slides"""
+    return [(frame, timestamp) for frame, timestamp, _ in slides]
+
+
+class SlideFindMultiTest(unittest.TestCase):
+    """Every algorithm finds the same slides as when it runs on its own, only the main one takes screenshots"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.directory, 'cut.avi')
+        write_cut_video(cls.video)
+        cls.advanced = transitions(slide_find_advanced(cls.video, tempfile.mkdtemp(dir=cls.directory)))
+        cls.basic = transitions(slide_find_basic(cls.video, tempfile.mkdtemp(dir=cls.directory)))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_advanced_and_basic(self):
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        results = slide_find_multi(self.video, output_dir, [{'algorithm': 'advanced'}, {'algorithm': 'basic'}])
+        self.assertEqual(sorted(results), ['advanced', 'basic'])
+        self.assertEqual(transitions(results['advanced']), self.advanced)
+        self.assertEqual(transitions(results['basic']), self.basic)
+        # The algorithms find different slides, so their results can't be mixed up
+        self.assertNotEqual(self.advanced, self.basic)
+
+        # Only the main algorithm takes screenshots
+        self.assertTrue(all(os.path.exists(slidepath) for _, _, slidepath in results['advanced'][:-1]))
+        self.assertTrue(all(slidepath is None for _, _, slidepath in results['basic']))
+        self.assertEqual(len(os.listdir(output_dir)), len(self.advanced) - 1)
+
+    def test_basic_first(self):
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        results = slide_find_multi(self.video, output_dir, [{'algorithm': 'basic'}, {'algorithm': 'advanced'}])
+        self.assertEqual(transitions(results['advanced']), self.advanced)
+        self.assertEqual(transitions(results['basic']), self.basic)
+        self.assertEqual(len(os.listdir(output_dir)), len(self.basic) - 1)
+
+    def test_other_settings(self):
+        # Two runs of the same algorithm, the settings of one don't leak into the other
+        results = slide_find_multi(self.video, tempfile.mkdtemp(dir=self.directory), [
+            {'algorithm': 'advanced'},
+            {'algorithm': 'advanced', 'name': 'short', 'minimum_slide_length': 10},
+            {'algorithm': 'basic', 'trigger': 0.2},
+        ])
+        self.assertEqual(transitions(results['advanced']), self.advanced)
+        self.assertEqual(transitions(results['short']),
+                         transitions(slide_find_advanced(self.video, tempfile.mkdtemp(dir=self.directory),
+                                                         minimum_slide_length=10)))
+        self.assertEqual(transitions(results['basic']),
+                         transitions(slide_find_basic(self.video, tempfile.mkdtemp(dir=self.directory), trigger=0.2)))
+
+        self.assertRaises(ValueError, slide_find_multi, self.video, self.directory,
+                          [{'algorithm': 'advanced'}, {'algorithm': 'advanced'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests of the per-frame signal of the packets algorithm, on synthetic packets"""
+
+import unittest
+
+import numpy as np
+
+from packets import packet_signal
+
+FPS = 25.0
+
+
+def synthetic_packets(count, keyframes, sizes=None, start=2.0):
+    """Packets of 100 bytes at FPS, with keyframes of 5000 bytes at the given frames (or the given sizes)"""
+    timestamps = start + np.arange(count) / FPS
+    packet_sizes = np.full(count, 100, dtype=int)
+    flags = np.zeros(count, dtype=bool)
+    for frame in keyframes:
+        flags[frame] = True
+        packet_sizes[frame] = 5000
+    for frame, size in (sizes or {}).items():
+        packet_sizes[frame] = size
+    return timestamps, packet_sizes, flags
+
+
+class PacketSignalTest(unittest.TestCase):
+    """The size of the packets, with the keyframes at the regular interval as the change in size"""
+
+    def test_regular_keyframes(self):
+        signal, key_size = packet_signal(*synthetic_packets(100, [0, 25, 50, 75], {40: 3000}))
+        self.assertEqual(signal['frame'].tolist(), list(range(100)))
+        # The timestamps start at 0 (in msec)
+        self.assertAlmostEqual(signal['timestamp'][0], 0.0)
+        self.assertAlmostEqual(signal['timestamp'][50], 2000.0)
+        # Only the first keyframe counts with its size, the regular ones with the change in size
+        self.assertEqual(signal['signal'][0], 5000)
+        self.assertEqual(signal['signal'][[25, 50, 75]].tolist(), [0, 0, 0])
+        # A large frame in between (a slide change) counts with its size
+        self.assertEqual(signal['signal'][40], 3000)
+        self.assertEqual(signal['signal'][41], 100)
+        self.assertEqual(key_size, 5000.0)
+
+    def test_keyframe_only_spike(self):
+        # The slide changes at a regular keyframe: only its growth in size shows, and the shrink of the next one
+        signal, key_size = packet_signal(*synthetic_packets(100, [0, 25, 50, 75], {25: 9000}))
+        self.assertEqual(signal['signal'][[25, 50, 75]].tolist(), [4000, 4000, 0])
+        self.assertEqual(key_size, 5000.0)
+
+    def test_inserted_keyframe(self):
+        # The encoder inserts a keyframe at a scene cut (and starts counting the interval again): it counts with its
+        # full size
+        signal, _ = packet_signal(*synthetic_packets(120, [0, 25, 50, 60, 85, 110], {60: 6000}))
+        self.assertEqual(signal['signal'][60], 6000)
+        self.assertEqual(signal['signal'][[25, 50, 85, 110]].tolist(), [0, 0, 1000, 0])
+
+    def test_single_keyframe(self):
+        # Without a keyframe interval all sizes are kept, the largest packet is the keyframe size
+        signal, key_size = packet_signal(*synthetic_packets(50, [0], {30: 7000}))
+        self.assertEqual(signal['signal'].tolist(), [5000] + [100] * 29 + [7000] + [100] * 19)
+        self.assertEqual(key_size, 7000.0)
+
+    def test_empty(self):
+        signal, key_size = packet_signal(np.array([], dtype=float), np.array([], dtype=int),
+                                         np.array([], dtype=bool))
+        self.assertEqual(len(signal), 0)
+        self.assertEqual(key_size, 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
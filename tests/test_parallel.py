@@ -0,0 +1,90 @@
+"""Tests of merging the segments of a parallel run, on a synthetic video with cuts just after the segment bounds"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from slidedetection import default_settings_advanced, find_slides_segment, slide_find_advanced
+
+FPS = 10
+DURATION = 120
+# With 4 workers the bounds of the segments are at 30, 60 and 90 s. The cuts at 64 and 95 s follow the ones at 55 and
+# 85 s within the minimum slide length: a sequential run doesn't look for them, but the segments starting at 60 and
+# 90 s don't know about the earlier cuts.
+SLIDE_STARTS = [0, 25, 33, 55, 64, 85, 95]
+SETTINGS = {'minimum_slide_length': 10, 'motion_capture_averaging_time': 2}
+
+
+def write_cut_video(path):
+    """A video of slides with bars of text and a moving presenter in a corner, with hard cuts between the slides"""
+    width, height = 320, 240
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (width, height))
+    for index in range(FPS * DURATION):
+        seconds = float(index) / FPS
+        slide = max(idx for idx, start in enumerate(SLIDE_STARTS) if start <= seconds)
+        image = np.full((height, width, 3), 230, np.uint8)
+        lengths = np.random.RandomState(slide)
+        for line in range(10):
+            top = int(height * (0.1 + line * 0.07))
+            right = int(width * (0.3 + 0.6 * lengths.rand()))
+            cv2.rectangle(image, (int(width * 0.1), top), (right, top + int(height * 0.035)), (40, 40, 40), -1)
+        center = (int(width * 0.85 + 12 * np.sin(seconds * 3)), int(height * 0.85))
+        cv2.circle(image, center, int(height * 0.06), (0, 0, 200), -1)
+        writer.write(image)
+    writer.release()
+
+
+def transitions(slides):
+    """The frame numbers and timestamps of the slides"""
+    return [(frame, timestamp) for frame, timestamp, _ in slides]
+
+
+class FindSlidesParallelTest(unittest.TestCase):
+    """The merged segments find the same slides as a sequential run"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.directory, 'cut.avi')
+        write_cut_video(cls.video)
+        cls.sequential = transitions(slide_find_advanced(cls.video, tempfile.mkdtemp(dir=cls.directory), **SETTINGS))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_segments(self):
+        # The segments do find the cuts just after their start
+        options = dict(default_settings_advanced, **SETTINGS)
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        self.assertEqual(transitions(find_slides_segment(self.video, output_dir, options, 60.0, 90.0))[0],
+                         (640, 64000.0))
+        self.assertEqual(transitions(find_slides_segment(self.video, output_dir, options, 90.0))[0],
+                         (950, 95000.0))
+
+    def test_merge(self):
+        self.assertEqual(self.sequential, [(0, 0.0), (250, 25000.0), (550, 55000.0), (850, 85000.0), (1200, 119900.0)])
+
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        handed_over = []
+        slides = slide_find_advanced(self.video, output_dir, workers=4, slide_callback=handed_over.append, **SETTINGS)
+        self.assertEqual(transitions(slides), self.sequential)
+
+        # The screenshots are numbered over all segments, those of the dropped transitions are removed
+        paths = [os.path.join(output_dir, 'slide%05d.jpg' % (idx + 1)) for idx in range(len(slides) - 1)]
+        self.assertEqual([slidepath for _, _, slidepath in slides], paths + [None])
+        self.assertEqual(handed_over, paths)
+        self.assertEqual(sorted(os.listdir(output_dir)), [os.path.basename(path) for path in paths])
+
+    def test_fewer_segments(self):
+        # A segment is at least 3 minimum slide lengths long
+        slides = slide_find_advanced(self.video, tempfile.mkdtemp(dir=self.directory), workers=8, **SETTINGS)
+        self.assertEqual(transitions(slides), self.sequential)
+
+
+if __name__ == '__main__':
+    unittest.main()
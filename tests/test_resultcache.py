@@ -0,0 +1,143 @@
+"""Tests of the local cache of the results"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from resultcache import RESULTS_FILE, ResultCache, fast_checksum, parse_size
+
+
+class FastChecksumTest(unittest.TestCase):
+    """The checksum of the size and a few blocks of a file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        """Write a file and return its path"""
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as outfile:
+            outfile.write(content)
+        return path
+
+    def test_small_file(self):
+        # A file of at most blocks * blocksize bytes is hashed completely
+        content = bytearray(range(256)) * 4
+        original = fast_checksum(self.write('a', bytes(content)), blocks=4, blocksize=256)
+        self.assertEqual(fast_checksum(self.write('b', bytes(content)), blocks=4, blocksize=256), original)
+        content[500] ^= 1
+        self.assertNotEqual(fast_checksum(self.write('c', bytes(content)), blocks=4, blocksize=256), original)
+
+    def test_sampled_blocks(self):
+        # 4 blocks of 16 bytes of a file of 1000 bytes: at 0, 328, 656 and 984
+        content = bytearray(1000)
+        original = fast_checksum(self.write('a', bytes(content)), blocks=4, blocksize=16)
+        for changed, position in [(True, 5), (True, 330), (True, 999), (False, 100), (False, 700)]:
+            modified = bytearray(content)
+            modified[position] = 1
+            checksum = fast_checksum(self.write('b', bytes(modified)), blocks=4, blocksize=16)
+            self.assertEqual(checksum != original, changed, position)
+
+    def test_size(self):
+        # Files that only differ in their size (in a part that isn't sampled) have a different checksum
+        self.assertNotEqual(fast_checksum(self.write('a', b'\0' * 1000), blocks=4, blocksize=16),
+                            fast_checksum(self.write('b', b'\0' * 1001), blocks=4, blocksize=16))
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('500M'), 500 << 20)
+        self.assertEqual(parse_size(' 1.5g'), 3 << 29)
+        self.assertEqual(parse_size(1024), 1024)
+        self.assertEqual(parse_size('2048'), 2048)
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Storing, looking up and evicting results"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.video = os.path.join(self.directory, 'video.mp4')
+        with open(self.video, 'wb') as videofile:
+            videofile.write(b'not really a video')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def results(self, name, size=1000):
+        """Results with two slides (with screenshots of the given size) and the end of the video"""
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        slides = []
+        for idx in range(2):
+            path = os.path.join(output_dir, '%s-slide%d.jpg' % (name, idx))
+            with open(path, 'wb') as slidefile:
+                slidefile.write(b'x' * size)
+            slides.append((idx * 100, idx * 4000.0, path))
+        return slides + [(200, 8000.0, None)]
+
+    def test_key(self):
+        cache = ResultCache(self.cache_dir)
+        key = cache.key(self.video, {'algorithm': 'advanced', 'trigger_ratio': 5})
+        self.assertEqual(cache.key(self.video, {'trigger_ratio': 5, 'algorithm': 'advanced'}), key)
+        self.assertNotEqual(cache.key(self.video, {'algorithm': 'advanced', 'trigger_ratio': 4}), key)
+
+    def test_put_get(self):
+        cache = ResultCache(self.cache_dir)
+        results = self.results('a')
+        preview = os.path.join(self.directory, 'video.mp4.preview')
+        shutil.copy(self.video, preview)
+        cache.put('key', results, [preview])
+
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        cached = cache.get('key', output_dir)
+        expected = [(frame, timestamp, os.path.join(output_dir, os.path.basename(slide)) if slide else None)
+                    for frame, timestamp, slide in results]
+        self.assertEqual(cached, expected)
+        self.assertEqual(sorted(os.listdir(output_dir)), ['a-slide0.jpg', 'a-slide1.jpg', 'video.mp4.preview'])
+        self.assertIsNone(cache.get('other', output_dir))
+
+        # An existing entry is kept as it is
+        cache.put('key', self.results('b'), [])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.cache_dir, 'key'))),
+                         sorted(['a-slide0.jpg', 'a-slide1.jpg', 'video.mp4.preview', RESULTS_FILE]))
+
+    def test_info(self):
+        cache = ResultCache(self.cache_dir)
+        roi = {'x1': 10, 'x2': 630, 'y1': 20, 'y2': 340}
+        cache.put('key', self.results('a'), [], {'roi': roi})
+        cache.put('other', self.results('b'), [])
+        self.assertEqual(cache.info('key'), {'roi': roi})
+        self.assertEqual(cache.info('other'), {})
+        self.assertEqual(cache.info('missing'), {})
+        # The information isn't copied with the files
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        self.assertIsNotNone(cache.get('key', output_dir))
+        self.assertEqual(sorted(os.listdir(output_dir)), ['a-slide0.jpg', 'a-slide1.jpg'])
+
+    def test_incomplete_entry(self):
+        cache = ResultCache(self.cache_dir)
+        os.makedirs(os.path.join(self.cache_dir, 'key'))
+        self.assertIsNone(cache.get('key', self.directory))
+
+    def test_lru_eviction(self):
+        # Every entry takes a bit more than 2000 bytes, 3 of them fit
+        cache = ResultCache(self.cache_dir, max_size=7000)
+        now = time.time()
+        for age, key in enumerate(['c', 'b', 'a']):
+            cache.put(key, self.results(key), [])
+            entry = os.path.join(self.cache_dir, key)
+            os.utime(entry, (now - 100 * (age + 1), now - 100 * (age + 1)))
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['a', 'b', 'c'])
+
+        # Using the oldest entry makes it the most recent one, the least recently used entry goes
+        self.assertIsNotNone(cache.get('a', tempfile.mkdtemp(dir=self.directory)))
+        cache.put('d', self.results('d'), [])
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['a', 'c', 'd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Tests of the retry policy for the calls to Clowder"""
+
+import unittest
+
+import requests
+
+from retry import RetryPolicy, UrllibHTTPError, is_retryable
+
+
+def http_error(status):
+    """A requests.HTTPError with a response with the given status code"""
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError("%d error" % status, response=response)
+
+
+class FlakyCall(object):
+    """A call that raises the given errors before it succeeds"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, value):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return value
+
+
+class IsRetryableTest(unittest.TestCase):
+    """The classification of the errors"""
+
+    def test_status_codes(self):
+        for status in [500, 502, 503, 504, 408, 429]:
+            self.assertTrue(is_retryable(http_error(status)), status)
+        for status in [400, 401, 403, 404, 409]:
+            self.assertFalse(is_retryable(http_error(status)), status)
+
+    def test_urllib(self):
+        self.assertTrue(is_retryable(UrllibHTTPError('http://clowder/api', 503, 'unavailable', {}, None)))
+        self.assertFalse(is_retryable(UrllibHTTPError('http://clowder/api', 404, 'not found', {}, None)))
+
+    def test_without_status(self):
+        self.assertTrue(is_retryable(requests.ConnectionError("refused")))
+        self.assertTrue(is_retryable(requests.Timeout("timed out")))
+        self.assertTrue(is_retryable(requests.HTTPError("no response")))
+        self.assertFalse(is_retryable(IOError("no such file")))
+        self.assertFalse(is_retryable(ValueError("bug")))
+
+
+class RetryPolicyTest(unittest.TestCase):
+    """The backoff, the limits and the counters of the policy"""
+
+    def test_backoff(self):
+        policy = RetryPolicy(initial_delay=1.0, multiplier=2.0, max_delay=10.0, jitter=0.0)
+        self.assertEqual([policy.delay(attempt) for attempt in range(6)], [1.0, 2.0, 4.0, 8.0, 10.0, 10.0])
+
+    def test_jitter(self):
+        policy = RetryPolicy(initial_delay=4.0, multiplier=1.0, jitter=0.5)
+        delays = [policy.delay(0) for _ in range(200)]
+        self.assertTrue(all(2.0 <= delay <= 4.0 for delay in delays))
+        self.assertGreater(max(delays) - min(delays), 1.0)
+        # The jitter is a fraction of the delay
+        self.assertEqual(RetryPolicy(initial_delay=4.0, jitter=3.0).jitter, 1.0)
+
+    def test_retry_until_success(self):
+        policy = RetryPolicy(initial_delay=0.001, jitter=0.0)
+        call = FlakyCall(http_error(503), requests.ConnectionError("refused"))
+        self.assertEqual(policy.call(call, 'result'), 'result')
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(policy.counters['calls'], 1)
+        self.assertEqual(policy.counters['attempts'], 3)
+        self.assertEqual(policy.counters['retries'], 2)
+        self.assertEqual(policy.counters['failures'], 0)
+        self.assertAlmostEqual(policy.counters['waited'], 0.003)
+
+    def test_fatal(self):
+        policy = RetryPolicy(initial_delay=0.001)
+        call = FlakyCall(http_error(404), 'never reached')
+        self.assertRaises(requests.HTTPError, policy.call, call, 'result')
+        self.assertEqual(call.calls, 1)
+        self.assertEqual(policy.counters['retries'], 0)
+        self.assertEqual(policy.counters['failures'], 1)
+
+    def test_max_attempts(self):
+        policy = RetryPolicy(initial_delay=0.001, max_attempts=3)
+        call = FlakyCall(*[http_error(502)] * 5)
+        self.assertRaises(requests.HTTPError, policy.call, call, 'result')
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(policy.counters['retries'], 2)
+        self.assertEqual(policy.counters['failures'], 1)
+
+    def test_deadline(self):
+        # The second delay (0.2 s) doesn't fit in what is left of the deadline after the first one (0.1 s)
+        policy = RetryPolicy(initial_delay=0.1, multiplier=2.0, jitter=0.0, deadline=0.25)
+        call = FlakyCall(*[requests.Timeout("timed out")] * 5)
+        self.assertRaises(requests.Timeout, policy.call, call, 'result')
+        self.assertEqual(call.calls, 2)
+        self.assertEqual(policy.counters['retries'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Tests of detecting the slide region, on a synthetic video with the slides inside a static border"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from benchmark.generator import slide_image
+from slidedetection import detect_roi, resolve_roi, slide_find_advanced
+
+FPS = 10
+DURATION = 150
+SLIDE_STARTS = [0, 30, 62, 95, 125]
+WIDTH, HEIGHT = 320, 240
+# The part of the frame that shows the slides
+SLIDES = {'x1': 64, 'x2': 288, 'y1': 36, 'y2': 204}
+# The region that is detected: the text of the slides (their background and title bar never change), grown by 2%
+EXPECTED_ROI = {'x1': 75, 'x2': 240, 'y1': 40, 'y2': 166}
+
+
+def write_border_video(path):
+    """A video of slides inside a static border with a logo, and a presenter moving over the border"""
+    slide_width, slide_height = SLIDES['x2'] - SLIDES['x1'], SLIDES['y2'] - SLIDES['y1']
+    slides = [slide_image(slide_width, slide_height, index, 5) for index in range(len(SLIDE_STARTS))]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (WIDTH, HEIGHT))
+    for index in range(FPS * DURATION):
+        seconds = float(index) / FPS
+        slide = max(idx for idx, start in enumerate(SLIDE_STARTS) if start <= seconds)
+        image = np.full((HEIGHT, WIDTH, 3), 60, np.uint8)
+        cv2.putText(image, 'LOGO', (4, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (200, 200, 200), 2)
+        image[SLIDES['y1']:SLIDES['y2'], SLIDES['x1']:SLIDES['x2']] = slides[slide]
+        center = (int(300 + 8 * np.sin(seconds * 3)), int(220 + 6 * np.cos(seconds * 2)))
+        cv2.circle(image, center, 14, (0, 0, 200), -1)
+        writer.write(image)
+    writer.release()
+
+
+class DetectRoiTest(unittest.TestCase):
+    """The region holds the slides without the border, the logo and the presenter"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.directory, 'border.avi')
+        write_border_video(cls.video)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def find_slides(self, **options):
+        """The frame numbers and timestamps of the slides"""
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        return [(frame, timestamp) for frame, timestamp, _ in slide_find_advanced(self.video, output_dir, **options)]
+
+    def test_detect_roi(self):
+        roi = detect_roi(self.video, 'opencv')
+        for key, value in EXPECTED_ROI.items():
+            self.assertAlmostEqual(roi[key], value, delta=3, msg="%s: %s" % (key, roi))
+        # Inside the slides (with the margin), away from the logo and the presenter
+        self.assertGreaterEqual(roi['x1'], SLIDES['x1'] - 7)
+        self.assertLessEqual(roi['x2'], SLIDES['x2'] + 7)
+        self.assertGreaterEqual(roi['y1'], SLIDES['y1'] - 5)
+        self.assertLessEqual(roi['y2'], SLIDES['y2'] + 5)
+
+    def test_resolve_roi(self):
+        options = {'auto_roi': True, 'decoder': 'opencv'}
+        self.assertEqual(resolve_roi(self.video, options)['roi'], detect_roi(self.video, 'opencv'))
+        # A given region takes precedence, without auto_roi nothing is detected
+        self.assertEqual(resolve_roi(self.video, dict(options, roi=SLIDES))['roi'], SLIDES)
+        self.assertNotIn('roi', resolve_roi(self.video, {'auto_roi': False}))
+
+    def test_transitions(self):
+        expected = [(start * FPS, start * 1000.0) for start in SLIDE_STARTS]
+        slides = self.find_slides(auto_roi=True)
+        self.assertEqual(slides[:-1], expected)
+        self.assertEqual(slides[-1][0], FPS * DURATION)
+        # The same as with the region given
+        self.assertEqual(self.find_slides(roi=detect_roi(self.video, 'opencv')), slides)
+
+
+if __name__ == '__main__':
+    unittest.main()
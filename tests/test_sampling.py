@@ -0,0 +1,84 @@
+"""Tests of sampling the video at a lower frame rate, on a synthetic video with hard cuts between the slides"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from benchmark.generator import slide_image
+from instrumentation import Instruments
+from slidedetection import slide_find_advanced
+
+FPS = 10
+DURATION = 120
+SLIDE_STARTS = [0, 22, 50, 76, 100]
+
+
+def write_cut_video(path):
+    """A video of slides and a moving presenter in a corner, with hard cuts between the slides"""
+    width, height = 320, 240
+    slides = [slide_image(width, height, index, 5) for index in range(len(SLIDE_STARTS))]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (width, height))
+    for index in range(FPS * DURATION):
+        seconds = float(index) / FPS
+        slide = max(idx for idx, start in enumerate(SLIDE_STARTS) if start <= seconds)
+        image = slides[slide].copy()
+        center = (int(width * 0.85 + 12 * np.sin(seconds * 3)), int(height * 0.85))
+        cv2.circle(image, center, int(height * 0.06), (0, 0, 200), -1)
+        writer.write(image)
+    writer.release()
+
+
+class SamplingTest(unittest.TestCase):
+    """A sampled video gives the same transitions as the video at the full frame rate"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.directory, 'cut.avi')
+        write_cut_video(cls.video)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def find_slides(self, **options):
+        """The frame numbers and timestamps of the slides"""
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        return [(frame, timestamp) for frame, timestamp, _ in slide_find_advanced(self.video, output_dir, **options)]
+
+    def check_sampling(self, background_model):
+        """Compare the transitions with and without sampling for a background model"""
+        instruments = Instruments()
+        full_rate = self.find_slides(background_model=background_model, instruments=instruments)
+        full_rate_frames = instruments.summary()['counters']['frames_decoded']
+        # The transitions are at the cuts (not every model finds them all)
+        self.assertLessEqual(set(full_rate[:-1]), set((start * FPS, start * 1000.0) for start in SLIDE_STARTS))
+
+        for sampling_fps in [2, 1]:
+            instruments = Instruments()
+            sampled = self.find_slides(background_model=background_model, sampling_fps=sampling_fps,
+                                       instruments=instruments)
+            self.assertEqual(sampled[:-1], full_rate[:-1], sampling_fps)
+            self.assertEqual(sampled[-1][0], full_rate[-1][0])
+            self.assertAlmostEqual(sampled[-1][1], full_rate[-1][1])
+
+            # Only the frames before the samples around the cuts (and while the model learns them) are analysed
+            summary = instruments.summary()
+            windows = summary['stages']['full_rate']['calls']
+            analysed = summary['counters']['frames_decoded'] + windows * FPS / sampling_fps
+            self.assertLess(analysed, 0.8 * full_rate_frames)
+
+    def test_knn(self):
+        self.check_sampling('knn')
+        self.assertEqual(len(self.find_slides()), len(SLIDE_STARTS) + 1)
+
+    def test_running_average(self):
+        self.check_sampling('running_average')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Tests of recording and replaying the per-frame signal, on a synthetic video with hard cuts between the slides"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from slidedetection import slide_find_advanced
+
+FPS = 10
+DURATION = 120
+SLIDE_STARTS = [0, 22, 50, 76, 100]
+
+
+def write_cut_video(path):
+    """A video of slides with bars of text and a moving presenter in a corner, with hard cuts between the slides"""
+    width, height = 320, 240
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (width, height))
+    for index in range(FPS * DURATION):
+        seconds = float(index) / FPS
+        slide = max(idx for idx, start in enumerate(SLIDE_STARTS) if start <= seconds)
+        image = np.full((height, width, 3), 230, np.uint8)
+        lengths = np.random.RandomState(slide)
+        for line in range(10):
+            top = int(height * (0.1 + line * 0.07))
+            right = int(width * (0.3 + 0.6 * lengths.rand()))
+            cv2.rectangle(image, (int(width * 0.1), top), (right, top + int(height * 0.035)), (40, 40, 40), -1)
+        center = (int(width * 0.85 + 12 * np.sin(seconds * 3)), int(height * 0.85))
+        cv2.circle(image, center, int(height * 0.06), (0, 0, 200), -1)
+        writer.write(image)
+    writer.release()
+
+
+class SignalStoreTest(unittest.TestCase):
+    """Recording the signal must not change the slides, and replaying it must find the same slides"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.directory, 'cut.avi')
+        write_cut_video(cls.video)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def find_slides(self, **options):
+        """The frame numbers and timestamps of the slides"""
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        slides = slide_find_advanced(self.video, output_dir, **options)
+        for _, _, slidepath in slides[:-1]:
+            self.assertTrue(os.path.exists(slidepath))
+        return [(frame, timestamp) for frame, timestamp, _ in slides]
+
+    def test_record_and_replay(self):
+        store = tempfile.mkdtemp(dir=self.directory)
+        live = self.find_slides()
+        self.assertEqual([frame for frame, _ in live[:-1]], [0, 220, 760])
+
+        recorded = self.find_slides(signal_store=store)
+        self.assertEqual(recorded, live)
+        self.assertTrue(any(name.endswith('.json') for name in os.listdir(store)))
+
+        replayed = self.find_slides(signal_store=store)
+        self.assertEqual(replayed, live)
+
+    def test_replay_other_settings(self):
+        store = tempfile.mkdtemp(dir=self.directory)
+        self.find_slides(signal_store=store)
+
+        # A longer minimum slide length is replayed
+        self.assertEqual(self.find_slides(signal_store=store, minimum_slide_length=30),
+                         self.find_slides(minimum_slide_length=30))
+        # A shorter one needs the frames that weren't analysed, the video is processed again
+        self.assertEqual(self.find_slides(signal_store=store, minimum_slide_length=15),
+                         self.find_slides(minimum_slide_length=15))
+
+
+if __name__ == '__main__':
+    unittest.main()
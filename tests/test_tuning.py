@@ -0,0 +1,153 @@
+"""Tests of the evaluation of a grid of trigger settings on a per-frame signal"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from signalstore import SIGNAL_DTYPE, SignalStore
+from slidedetection import AdvancedDetector, advanced_transitions, default_settings_advanced
+from tuning import evaluate_advanced, read_ground_truth, score_transitions
+
+FPS = 10
+SIZE = (100, 100)
+AVERAGING_TIME = 5
+
+TRIGGER_RATIOS = [3, 5, 8]
+MINIMUM_TOTAL_CHANGES = [0.02, 0.06]
+MINIMUM_SLIDE_LENGTHS = [10, 15, 20]
+
+
+def synthetic_signal(frames=3000, seed=0):
+    """The number of changed pixels of every frame: noise with spikes and short bursts of changes"""
+    rng = np.random.RandomState(seed)
+    whites = rng.randint(0, 150, frames)
+    for position in rng.randint(1, frames - 10, 60):
+        whites[position:position + rng.randint(1, 6)] += rng.randint(300, 9000)
+    return np.minimum(whites, SIZE[0] * SIZE[1])
+
+
+class FixedSignalModel(object):
+    """A background model that changes the number of pixels it is handed as the frame"""
+
+    def apply(self, frame, fgmask):  # pylint: disable=no-self-use
+        """Mark the first pixels as changed"""
+        fgmask[...] = 0
+        fgmask.reshape(-1)[:frame] = 255
+        return fgmask
+
+
+class FakeEngine(object):  # pylint: disable=too-many-instance-attributes
+    """What the detector needs of the engine for analysis frames at the original resolution without masks"""
+
+    def __init__(self, frames):
+        self.filename = 'synthetic'
+        self.output_dir = None
+        self.live = False
+        self.frame_size = self.analysis_size = self.cropped_size = SIZE
+        self.source_fps = self.fps = FPS
+        self.source_num_frames = self.num_frames = frames
+        self.frame_step = 1
+        self.source_masks = self.masks = []
+        self.pixels = SIZE[0] * SIZE[1]
+
+
+def run_detector(whites, trigger_ratio, minimum_total_change, minimum_slide_length, signal_store=None):
+    """Run the live trigger logic (with the skipped frames) and return the timestamps of the transitions"""
+    options = dict(default_settings_advanced, trigger_ratio=trigger_ratio, minimum_total_change=minimum_total_change,
+                   minimum_slide_length=minimum_slide_length, motion_capture_averaging_time=AVERAGING_TIME)
+    detector = AdvancedDetector(options, slide_name=None, signal_store=signal_store)
+    engine = FakeEngine(len(whites))
+    assert detector.setup(engine) == []
+    detector.fgbg = FixedSignalModel()
+    for index, value in enumerate(whites.tolist()):
+        if not detector.skip(index):
+            detector.consume(value, index, index * 1000.0 / FPS)
+    detector.finalize(len(whites), (len(whites) - 1) * 1000.0 / FPS)
+    return [timestamp for _, timestamp, _ in detector.slides]
+
+
+class EvaluateAdvancedTest(unittest.TestCase):
+    """The grid evaluation gives the transitions of the live trigger logic for every combination"""
+
+    def setUp(self):
+        self.whites = synthetic_signal()
+        self.grid = [(trigger_ratio, minimum_total_change, minimum_slide_length)
+                     for trigger_ratio in TRIGGER_RATIOS for minimum_total_change in MINIMUM_TOTAL_CHANGES
+                     for minimum_slide_length in MINIMUM_SLIDE_LENGTHS]
+
+    def evaluate(self, signal, meta):
+        """Evaluate the grid, by combination"""
+        return dict([((parameters['trigger_ratio'], parameters['minimum_total_change'],
+                       parameters['minimum_slide_length']), transitions)
+                     for parameters, transitions in evaluate_advanced(signal, meta, TRIGGER_RATIOS,
+                                                                      MINIMUM_TOTAL_CHANGES, MINIMUM_SLIDE_LENGTHS)])
+
+    def test_every_frame(self):
+        # The signal of every frame, as the model doesn't depend on the frames that were skipped
+        signal = np.zeros(len(self.whites), dtype=SIGNAL_DTYPE)
+        signal['frame'] = np.arange(len(self.whites))
+        signal['timestamp'] = signal['frame'] * 1000.0 / FPS
+        signal['signal'] = self.whites
+        meta = {'fps': FPS, 'frame_step': 1, 'pixels': SIZE[0] * SIZE[1], 'averaging_frames': AVERAGING_TIME * FPS}
+
+        results = self.evaluate(signal, meta)
+        counts = set()
+        for combination in self.grid:
+            live = run_detector(self.whites, *combination)
+            self.assertEqual(results[combination], live, combination)
+            self.assertEqual([timestamp for _, timestamp in advanced_transitions(signal, meta, *combination)], live)
+            counts.add(len(live))
+        # The grid is not trivial: the combinations find different numbers of transitions
+        self.assertGreater(len(counts), 3)
+
+    def test_recorded_signal(self):
+        directory = tempfile.mkdtemp()
+        try:
+            video = os.path.join(directory, 'video')
+            with open(video, 'wb') as videofile:
+                videofile.write(b'synthetic')
+            store = SignalStore(directory, video, 'advanced', {})
+            recording = (5, 0.06, 15)
+            live = run_detector(self.whites, *recording, signal_store=store)
+            signal, meta = store.load()
+            # Only the analysed frames are stored
+            self.assertLess(len(signal), len(self.whites))
+
+            results = self.evaluate(signal, meta)
+            self.assertEqual(results[recording], live)
+            for combination in self.grid:
+                replayed = [timestamp for _, timestamp in advanced_transitions(signal, meta, *combination)]
+                self.assertEqual(results[combination], replayed, combination)
+        finally:
+            shutil.rmtree(directory)
+
+
+class ScoreTest(unittest.TestCase):
+    """Reading the ground truth and scoring transitions"""
+
+    def test_read_ground_truth(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'truth.txt')
+            with open(path, 'w') as truthfile:
+                truthfile.write("# lecture\n1:02:03.5\n\n95  # second slide\n00:30\n")
+            self.assertEqual(read_ground_truth(path), [30000.0, 95000.0, 3723500.0])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_score(self):
+        score = score_transitions([10000.0, 31000.0, 50000.0, 90000.0], [10500.0, 30000.0, 70000.0], tolerance=2000.0)
+        self.assertEqual(score['precision'], 0.5)
+        self.assertAlmostEqual(score['recall'], 2 / 3.0)
+        self.assertAlmostEqual(score['f1'], 4 / 7.0)
+        self.assertEqual(score['timing_error'], 750.0)
+        # Every transition is matched only once, with the closest one
+        score = score_transitions([29000.0, 30500.0], [30000.0], tolerance=2000.0)
+        self.assertEqual((score['precision'], score['recall'], score['timing_error']), (0.5, 1.0, 500.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""Tests of the concurrent uploads, against a local HTTP stand-in for Clowder"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+
+import pyclowder.files
+from pyclowder.connectors import Connector
+
+from uploads import SessionConnector, UploadPool
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """Accepts uploads and remembers the requests and the connections they came in on"""
+    daemon_threads = True
+
+    def __init__(self):
+        self.requests = []
+        self.connections = set()
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def host(self):
+        """The Clowder host, as pyclowder expects it"""
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def stop(self):
+        """Stop serving"""
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answer every upload with a new id, keeping the connection alive"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Read the upload and answer with its id"""
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append(self.path.split('?')[0])
+        self.server.connections.add(self.client_address)
+        content = json.dumps({'id': 'id%d' % len(self.server.requests)}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class SessionConnectorTest(unittest.TestCase):
+    """The upload functions of pyclowder do their requests through the connector, so they share the session"""
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.directory = tempfile.mkdtemp()
+        self.slide = os.path.join(self.directory, 'slide00001.jpg')
+        with open(self.slide, 'wb') as slidefile:
+            slidefile.write(b'\xff\xd8 not really a jpeg')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def upload(self, connector):
+        """Upload a slide, a thumbnail and metadata like the extractor does"""
+        host = self.server.host()
+        self.assertEqual(pyclowder.files.upload_preview(connector, host, 'key', 'file-id', self.slide, {}), 'id1')
+        self.assertEqual(pyclowder.files.upload_thumbnail(connector, host, 'key', 'file-id', self.slide), 'id4')
+        pyclowder.files.upload_metadata(connector, host, 'key', 'file-id', {'nrslides': 1})
+        self.assertEqual(self.server.requests, ['/api/previews', '/api/files/file-id/previews/id1',
+                                                '/api/previews/id1/metadata', '/api/fileThumbnail',
+                                                '/api/files/file-id/thumbnails/id4',
+                                                '/api/files/file-id/metadata.jsonld'])
+
+    def test_keep_alive(self):
+        connector = SessionConnector(Connector({'name': 'test'}))
+        self.upload(connector)
+        connector.close()
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_without_session(self):
+        # The connector of pyclowder opens a connection for every request
+        self.upload(Connector({'name': 'test'}))
+        self.assertEqual(len(self.server.connections), len(self.server.requests))
+
+
+class UploadPoolTest(unittest.TestCase):
+    """The order of the uploads, their errors and closing the pool"""
+
+    def test_order(self):
+        # A single thread uploads in the order the uploads came in
+        done = []
+
+        def upload(name, delay):
+            """An upload that takes a while"""
+            time.sleep(delay)
+            done.append(name)
+            return name.upper()
+
+        pool = UploadPool(Connector({'name': 'test'}), workers=1)
+        results = [pool.submit(upload, name, delay) for name, delay in [('a', 0.05), ('b', 0.0), ('c', 0.02)]]
+        self.assertEqual([result.get() for result in results], ['A', 'B', 'C'])
+        self.assertEqual(done, ['a', 'b', 'c'])
+        pool.close()
+
+        # With more threads they finish in any order, but every result belongs to its own upload
+        pool = UploadPool(Connector({'name': 'test'}), workers=3)
+        results = [pool.submit(upload, name, delay=0.01 * (5 - idx)) for idx, name in enumerate('defgh')]
+        self.assertEqual([result.get() for result in results], ['D', 'E', 'F', 'G', 'H'])
+        pool.close()
+
+    def test_errors(self):
+        def upload(name):
+            """An upload that fails for one file"""
+            if name == 'broken':
+                raise IOError("Failed to upload %s" % name)
+            return name
+
+        pool = UploadPool(Connector({'name': 'test'}), workers=2)
+        results = [pool.submit(upload, name) for name in ['first', 'broken', 'last']]
+        self.assertEqual(results[0].get(), 'first')
+        self.assertRaises(IOError, results[1].get)
+        # A failed upload doesn't stop the others
+        self.assertEqual(results[2].get(), 'last')
+        pool.close()
+
+    def test_close(self):
+        # Closing waits for the uploads that are still running, then closes the session
+        done = []
+        closed = []
+        pool = UploadPool(Connector({'name': 'test'}), workers=2)
+        pool.connector.session.close = lambda: closed.append(len(done))
+        for name in ['a', 'b', 'c']:
+            pool.submit(lambda name: time.sleep(0.05) or done.append(name), name)
+        pool.close()
+        self.assertEqual(sorted(done), ['a', 'b', 'c'])
+        self.assertEqual(closed, [3])
+        self.assertRaises(ValueError, pool.submit, done.append, 'd')
+
+
+if __name__ == '__main__':
+    unittest.main()
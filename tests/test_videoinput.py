@@ -0,0 +1,197 @@
+"""Tests of reading a video without downloading it, against a local HTTP stand-in for Clowder"""
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+
+from resultcache import fast_checksum
+from videoinput import (KEY_HEADER, HTTPRangeFile, StreamProxy, open_video_file, redact_url, resolve_video,
+                        supports_ranges)
+
+KEY = 'the-secret-key'
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """Serves a single file, with or without support for range requests, and remembers the requests"""
+    daemon_threads = True
+
+    def __init__(self, content, ranges):
+        self.content = content
+        self.ranges = ranges
+        self.requests = []
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path='api/files/video-id'):
+        """The URL of a path on the server"""
+        return 'http://127.0.0.1:%d/%s' % (self.server_address[1], path)
+
+    def stop(self):
+        """Stop serving"""
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serve the content of the server"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve (a range of) the content"""
+        self.server.requests.append((self.path, self.headers.get(KEY_HEADER)))
+        content = self.server.content
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if self.server.ranges and match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(content) - 1, len(content) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(content)))
+            content = content[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class RecordingHandler(logging.Handler):
+    """Keep every log record"""
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class VideoInputTest(unittest.TestCase):
+    """Stream a video from a stand-in server with and without range requests"""
+
+    def setUp(self):
+        self.content = os.urandom(3 * 1024 * 1024 + 123)
+        self.tempdir = tempfile.mkdtemp()
+        self.video = os.path.join(self.tempdir, 'video.mp4')
+        with open(self.video, 'wb') as videofile:
+            videofile.write(self.content)
+        self.servers = []
+        self.logs = RecordingHandler()
+        self.root_level = logging.getLogger().level
+        logging.getLogger().addHandler(self.logs)
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.logs)
+        logging.getLogger().setLevel(self.root_level)
+        for server in self.servers:
+            server.stop()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def start_server(self, ranges):
+        """Start a stand-in server"""
+        server = StandInServer(self.content, ranges)
+        self.servers.append(server)
+        return server
+
+    def assert_key_kept_secret(self, server):
+        """The key was only sent as a header: not in a URL, not in a log record"""
+        for path, key in server.requests:
+            self.assertNotIn(KEY, path)
+            self.assertEqual(key, KEY)
+        for message in self.logs.messages:
+            self.assertNotIn(KEY, message)
+
+    def test_supports_ranges(self):
+        self.assertTrue(supports_ranges(self.start_server(True).url()))
+        self.assertFalse(supports_ranges(self.start_server(False).url()))
+
+    def test_range_file(self):
+        server = self.start_server(True)
+        with HTTPRangeFile(server.url(), headers={KEY_HEADER: KEY}) as rangefile:
+            self.assertEqual(rangefile.size, len(self.content))
+            self.assertEqual(rangefile.read(100), self.content[:100])
+            rangefile.seek(1 << 20)
+            self.assertEqual(rangefile.read(5000), self.content[1 << 20:(1 << 20) + 5000])
+            self.assertEqual(rangefile.tell(), (1 << 20) + 5000)
+            rangefile.seek(-10, os.SEEK_END)
+            self.assertEqual(rangefile.read(), self.content[-10:])
+            self.assertEqual(rangefile.read(10), b'')
+            rangefile.seek(-20, os.SEEK_CUR)
+            self.assertEqual(rangefile.read(50), self.content[-20:])
+        self.assert_key_kept_secret(server)
+
+    def test_range_file_without_ranges(self):
+        self.assertRaises(IOError, HTTPRangeFile, self.start_server(False).url())
+
+    def test_fast_checksum(self):
+        self.assertEqual(fast_checksum(self.start_server(True).url()), fast_checksum(self.video))
+
+    def test_proxy(self):
+        server = self.start_server(True)
+        with StreamProxy(server.url(), {KEY_HEADER: KEY}) as proxy:
+            self.assertNotIn(KEY, proxy.url)
+            with open_video_file(proxy.url) as rangefile:
+                rangefile.seek(12345)
+                self.assertEqual(rangefile.read(100000), self.content[12345:112345])
+            # Only the URL with the token is served
+            self.assertFalse(supports_ranges(re.sub(r'/[0-9a-f]{32}/', '/%s/' % ('0' * 32), proxy.url)))
+        self.assert_key_kept_secret(server)
+
+    def test_resolve_mounted(self):
+        downloads = []
+        video, release = resolve_video('/clowder/uploads/video.mp4', {'/clowder/uploads': self.tempdir},
+                                       self.start_server(True).url(), {KEY_HEADER: KEY}, downloads.append)
+        self.assertEqual(video, self.video)
+        self.assertIsNone(release)
+        self.assertEqual(downloads, [])
+
+    def test_resolve_stream(self):
+        server = self.start_server(True)
+        downloads = []
+        video, release = resolve_video('/not/mounted.mp4', {}, server.url(), {KEY_HEADER: KEY}, downloads.append)
+        try:
+            with open_video_file(video) as rangefile:
+                self.assertEqual(rangefile.read(), self.content)
+        finally:
+            release()
+        self.assertEqual(downloads, [])
+        self.assert_key_kept_secret(server)
+
+    def test_resolve_download(self):
+        server = self.start_server(False)
+        download = os.path.join(self.tempdir, 'download.mp4')
+
+        def download_video():
+            """Stand-in for the download of pyclowder"""
+            shutil.copyfile(self.video, download)
+            return download
+
+        video, release = resolve_video(None, {}, server.url(), {KEY_HEADER: KEY}, download_video)
+        self.assertEqual(video, download)
+        release()
+        self.assertFalse(os.path.exists(download))
+        self.assert_key_kept_secret(server)
+
+    def test_redact_url(self):
+        self.assertEqual(redact_url('http://host/api/files/1?key=%s&a=b' % KEY), 'http://host/api/files/1?key=...&a=b')
+        self.assertEqual(redact_url('/videos/lecture.mp4'), '/videos/lecture.mp4')
+        self.assertIsNone(redact_url(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
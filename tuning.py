@@ -0,0 +1,154 @@
+"""
+Evaluate many trigger settings at once on a stored per-frame signal (see signalstore)
+
+The trigger logic of the algorithms runs over a grid of parameter combinations in one pass over the signal: the state
+of all combinations is kept in NumPy arrays, so the cost per frame hardly depends on the size of the grid. With a
+ground truth, every combination is scored with precision, recall and timing error.
+
+Ground truth files contain the time of every slide transition, one per line, in seconds or as [HH:]MM:SS[.mmm]. Empty
+lines and everything after a # are ignored. The start of the video is not a transition.
+"""
+
+import itertools
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def read_ground_truth(filename):
+    """
+    Read a ground truth file
+    :return sorted list of the times of the transitions (in msec)
+    """
+    transitions = []
+    with open(filename, 'r') as truthfile:
+        for line in truthfile:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+
+            seconds = 0.0
+            for part in line.split(':'):
+                seconds = seconds * 60 + float(part)
+            transitions.append(seconds * 1000.0)
+
+    return sorted(transitions)
+
+
+def score_transitions(detected, truth, tolerance=2000.0):
+    """
+    Match detected transitions with the ground truth: every transition can be matched once, to the closest one
+    within the tolerance.
+    :param detected: sorted list of detected transitions (in msec)
+    :param truth: sorted list of true transitions (in msec)
+    :param tolerance: maximal time difference (in msec) for a match
+    :return dict with precision, recall, f1 and the mean absolute timing error (in msec) of the matches
+    """
+    pairs = sorted((abs(det - true), det_idx, true_idx)
+                   for det_idx, det in enumerate(detected) for true_idx, true in enumerate(truth)
+                   if abs(det - true) <= tolerance)
+    used_detected = set()
+    used_truth = set()
+    errors = []
+    for error, det_idx, true_idx in pairs:
+        if det_idx in used_detected or true_idx in used_truth:
+            continue
+        used_detected.add(det_idx)
+        used_truth.add(true_idx)
+        errors.append(error)
+
+    precision = len(errors) / float(len(detected)) if detected else 1.0
+    recall = len(errors) / float(len(truth)) if truth else 1.0
+    return {
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        'timing_error': float(np.mean(errors)) if errors else None,
+    }
+
+
+def evaluate_advanced(signal, meta, trigger_ratios, minimum_total_changes, minimum_slide_lengths):
+    """
+    Run the trigger logic of the advanced algorithm (see advanced_transitions in slidedetection) for every
+    combination of the parameters, each with its own ignore window after a transition. The recorded signal doesn't
+    have the frames in the ignore windows of the recording, so the results of other trigger settings than the ones
+    of the recording are an approximation, and a shorter minimum slide length can miss transitions right after the
+    recorded ones.
+
+    :param signal: the stored signal
+    :param meta: the description of the stored signal
+    :param trigger_ratios: list of values for trigger_ratio
+    :param minimum_total_changes: list of values for minimum_total_change
+    :param minimum_slide_lengths: list of values for minimum_slide_length (in seconds)
+    :return list with a tuple per combination: dict with the parameters and the list of transition times (in msec)
+    """
+    grid = list(itertools.product(trigger_ratios, minimum_total_changes, minimum_slide_lengths))
+    trigger_ratio = np.array([combination[0] for combination in grid], dtype=float)
+    minimum_total_change = np.array([combination[1] for combination in grid], dtype=float)
+    minimum_slide_length_in_frames = np.array([int(round(combination[2] * meta['fps'])) for combination in grid])
+
+    averaging_frames = meta['averaging_frames']
+    ignore_frames = np.array([combination[2] * meta['fps'] for combination in grid]) - averaging_frames
+    min_pixel_change_av = (minimum_total_change / trigger_ratio) * meta['pixels']
+    av_array = np.zeros((len(grid), averaging_frames), dtype=int)
+    average = np.zeros(len(grid))
+    previous_trigger_frame = np.zeros(len(grid), dtype=int)
+
+    start_time = time.time()
+    transitions = [[] for _ in grid]
+    previous_frame = -1
+    resumed_frame = 0
+    for frame_index, timestamp, whites in zip(signal['frame'].tolist(), signal['timestamp'].tolist(),
+                                              signal['signal'].tolist()):
+        whites = int(whites)
+        # After a gap in the recording the background model has to catch up first
+        if frame_index > previous_frame + 1:
+            resumed_frame = frame_index
+        previous_frame = frame_index
+        if frame_index == 0:
+            analysed = np.ones(len(grid), dtype=bool)
+            triggered = np.ones(len(grid), dtype=bool)
+        else:
+            analysed = frame_index > (previous_trigger_frame + ignore_frames)
+            triggered = analysed & ((frame_index - previous_trigger_frame) > minimum_slide_length_in_frames) & \
+                        (whites > trigger_ratio * np.maximum(average, min_pixel_change_av)) & \
+                        (frame_index >= resumed_frame + averaging_frames)
+
+        if triggered.any():
+            for idx in np.flatnonzero(triggered).tolist():
+                transitions[idx].append(timestamp)
+            previous_trigger_frame[triggered] = frame_index
+            average[triggered] = 0.0
+            av_array[triggered] = 0
+
+        # Same operations (in the same order) as the sequential algorithm, so the rounding is identical
+        update = analysed & (previous_trigger_frame != frame_index)
+        slot = frame_index % averaging_frames
+        updated = average - av_array[:, slot] / float(averaging_frames)
+        updated += whites / float(averaging_frames)
+        average = np.where(update, updated, average)
+        av_array[:, slot] = np.where(update, whites, av_array[:, slot])
+
+    logger.info("Evaluated %d combinations on %d frames in %.2f s", len(grid), len(signal), time.time() - start_time)
+
+    return [({'trigger_ratio': combination[0], 'minimum_total_change': combination[1],
+              'minimum_slide_length': combination[2]}, transitions[idx])
+            for idx, combination in enumerate(grid)]
+
+
+def evaluate_basic(signal, triggers):
+    """
+    Apply the trigger of the basic algorithm for every value at once
+    :param signal: the stored signal
+    :param triggers: list of values for trigger
+    :return list with a tuple per value: dict with the parameters and the list of transition times (in msec)
+    """
+    triggers = np.asarray(triggers, dtype=float)
+    triggered = signal['signal'][:, np.newaxis] > triggers[np.newaxis, :]
+    timestamps = np.asarray(signal['timestamp'])
+
+    return [({'trigger': float(trigger)}, timestamps[triggered[:, idx]].tolist())
+            for idx, trigger in enumerate(triggers)]
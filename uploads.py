@@ -0,0 +1,86 @@
+"""
+Concurrent uploads to Clowder
+
+The pyclowder upload functions do every request through connector.post & co, which open a new connection for every
+request. SessionConnector wraps the connector so all requests go through a single requests.Session which keeps the
+connections alive. UploadPool runs the uploads in a bounded pool of threads sharing that session, so the slides can be
+uploaded while the detection and the encoding of the previews are still running.
+"""
+
+import logging
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class SessionConnector(object):
+    """
+    Proxy for a pyclowder connector that sends the HTTP requests through a shared keep-alive session. Everything
+    else (status updates, ssl settings, ...) is handled by the wrapped connector.
+    """
+
+    def __init__(self, connector, pool_size=1):
+        self.connector = connector
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __getattr__(self, name):
+        return getattr(self.connector, name)
+
+    def _request(self, method, url, raise_status=True, **kwargs):
+        """Do a request with the session, like the request wrappers of pyclowder"""
+        response = self.session.request(method, url, **kwargs)
+        if raise_status:
+            response.raise_for_status()
+
+        return response
+
+    def get(self, url, params=None, raise_status=True, **kwargs):
+        """GET request using the shared session"""
+        return self._request('GET', url, raise_status=raise_status, params=params, **kwargs)
+
+    def post(self, url, data=None, json_data=None, raise_status=True, **kwargs):
+        """POST request using the shared session"""
+        return self._request('POST', url, raise_status=raise_status, data=data, json=json_data, **kwargs)
+
+    def put(self, url, data=None, raise_status=True, **kwargs):
+        """PUT request using the shared session"""
+        return self._request('PUT', url, raise_status=raise_status, data=data, **kwargs)
+
+    def delete(self, url, raise_status=True, **kwargs):
+        """DELETE request using the shared session"""
+        return self._request('DELETE', url, raise_status=raise_status, **kwargs)
+
+    def close(self):
+        """Close the connections of the session"""
+        self.session.close()
+
+
+class UploadPool(object):
+    """
+    Bounded pool of threads to upload files. Use the connector attribute of the pool in the upload functions so they
+    share the keep-alive session.
+    """
+
+    def __init__(self, connector, workers=1):
+        self.connector = SessionConnector(connector, workers)
+        self.pool = ThreadPool(processes=max(workers, 1))
+        logger.debug("Started upload pool with %d threads", max(workers, 1))
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the pool
+        :return AsyncResult: get() returns the result of the upload or raises its exception
+        """
+        return self.pool.apply_async(func, args, kwargs)
+
+    def close(self):
+        """Wait for all uploads to finish and close the session"""
+        self.pool.close()
+        self.pool.join()
+        self.connector.close()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Process a whole archive of videos offline, without RabbitMQ and Clowder: the slides, the previews, the thumbnail and
+the metadata of every video are written to a directory of the output tree. The videos are processed in parallel
+processes with a timeout per video. Videos that were processed before with the same settings are skipped, so an
+interrupted run can simply be started again (unfinished videos resume from their last completed stage). With --push
+the results are uploaded to Clowder afterwards, for the videos with a file id in the manifest.
+
+Input: directories (searched for videos), videos and manifests (a video per line, optionally followed by a tab and
+the id of its file in Clowder).
+
+Usage: video-backfill.py INPUT [INPUT ...] --output DIR [--processes 2] [--timeout 7200] [--settings settings.yml]
+[--parameters '{"slides": {"algorithm": "basic"}}'] [--force] [--push https://clowder.example.org/ [--key-file FILE]]
+
+The key for Clowder is read from the key file, or else from the CLOWDER_KEY environment variable.
+"""
+
+import argparse
+import datetime
+import imp
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+from pyclowder.connectors import Connector
+from pyclowder.extractors import Extractor
+import pyclowder.files
+
+from backfill import (DONE_FILE, KEY_VARIABLE, METADATA_FILE, THUMBNAIL_NAME, default_extensions, find_videos, is_done,
+                      prune, read_done, read_key, run_pool, settings_fingerprint, write_json)
+from cpubudget import available_cpus
+from retry import RetryPolicy
+
+video_presentation = imp.load_source(  # pylint: disable=invalid-name
+    'video_presentation', os.path.join(os.path.dirname(os.path.realpath(__file__)), 'video-presentation.py'))
+
+
+class BackfillVideoMetaData(video_presentation.VideoMetaData):
+    """The extractor, with the results stored in a directory instead of uploaded to Clowder"""
+
+    def __init__(self, output, settings_file=None, parameters=None, processes=1):
+        """
+        :param output: the root of the output tree
+        :param settings_file: the settings of the extractor (None for the settings.yml of the extractor)
+        :param parameters: the parameters of the jobs, like the parameters of a manual submission
+        :param processes: the number of videos processed at the same time, which share the CPUs
+        """
+        self.output = output
+        self.settings_file = settings_file
+        self.parameters = dict(parameters or {})
+        self.processes = processes
+        self.output_dir = None
+        video_presentation.VideoMetaData.__init__(self, command_line=False)
+
+    def read_settings(self, filename=None):
+        """Read the settings, the work directories of the jobs are kept in the output tree so they can resume"""
+        video_presentation.VideoMetaData.read_settings(self, filename or self.settings_file)
+        self.jobsettings = dict(self.jobsettings or {}, directory=os.path.join(self.output, '.work'))
+        self.resourcesettings = dict(self.resourcesettings or {})
+        if not self.resourcesettings.get('cpus'):
+            self.resourcesettings['cpus'] = max(available_cpus() // self.processes, 1)
+
+    def fingerprint(self):
+        """The fingerprint of all settings that change the results"""
+        self.read_settings()
+        self.apply_parameters(self.parameters)
+        return settings_fingerprint(dict(self.job_settings(), shadow=self.shadowsettings))
+
+    def get_metadata(self, content, resource_type, resource_id, server=None):
+        """The metadata is stored as it is"""
+        return content
+
+    def try_upload_preview_file(self, upload_func, connector, host, secret_key, resource_id, preview_file,  # pylint: disable=too-many-arguments
+                                parameters=None):
+        """Store a file in the output directory instead, its name in the output directory is its id"""
+        if upload_func is pyclowder.files.upload_metadata:
+            write_json(os.path.join(self.output_dir, METADATA_FILE), preview_file)
+            return None
+
+        if upload_func is pyclowder.files.upload_thumbnail:
+            name = THUMBNAIL_NAME + os.path.splitext(preview_file)[1]
+        else:
+            name = os.path.basename(preview_file)
+            if name.endswith('.preview'):
+                name = name[:-len('.preview')]
+        shutil.copyfile(preview_file, os.path.join(self.output_dir, name))
+        return name
+
+    def process_video(self, video):
+        """Process a video (runs in its own process)"""
+        fingerprint = self.fingerprint()
+        self.output_dir = os.path.join(self.output, video['name'])
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        connector = Connector(self.extractor_info['name'], self.extractor_info)
+        resource = {'type': 'file', 'id': video['name'], 'name': os.path.basename(video['path']),
+                    'file_ext': os.path.splitext(video['path'])[1], 'local_paths': [video['path']]}
+        start_time = time.time()
+        self.process_message(connector, '', '', resource, {'parameters': self.parameters})
+
+        metadata_path = os.path.join(self.output_dir, METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            raise RuntimeError("No results for %s" % video['path'])
+        with open(metadata_path, 'r') as metadatafile:
+            prune(self.output_dir, json.load(metadatafile))
+        write_json(os.path.join(self.output_dir, DONE_FILE), {
+            'video': os.path.abspath(video['path']),
+            'file_id': video['file_id'],
+            'settings': fingerprint,
+            'seconds': round(time.time() - start_time, 1),
+            'time': datetime.datetime.utcnow().isoformat() + 'Z',
+        })
+
+    def push(self, video, host, key):
+        """Upload the results of a video to its file in Clowder"""
+        output_dir = os.path.join(self.output, video['name'])
+        with open(os.path.join(output_dir, METADATA_FILE), 'r') as metadatafile:
+            slidesmeta = json.load(metadatafile)
+
+        self.read_settings()
+        self.retry_policy = RetryPolicy(**self.retrysettings)
+        connector = Connector(self.extractor_info['name'], self.extractor_info)
+        file_id = video['file_id']
+
+        def upload(upload_func, name, *args):
+            """Upload a file of the output directory"""
+            return self.retry_policy.call(upload_func, connector, host, key, file_id, os.path.join(output_dir, name),
+                                          *args)
+
+        # The ids of the uploads replace the names of the files in the metadata
+        ids = {}
+        slides = [slide[2] for slide in slidesmeta['listslides'] if slide[2]]
+        for name in sorted(set(slides + list(slidesmeta['previews'].values()))):
+            ids[name] = upload(pyclowder.files.upload_preview, name, {})
+        if slides:
+            upload(pyclowder.files.upload_thumbnail, THUMBNAIL_NAME + os.path.splitext(slides[0])[1])
+        slidesmeta['previews'] = dict([(preview, ids[name]) for preview, name in slidesmeta['previews'].items()])
+        slidesmeta['listslides'] = [[start, end, ids.get(slide), seconds]
+                                    for start, end, slide, seconds in slidesmeta['listslides']]
+
+        self.retry_policy.call(pyclowder.files.upload_metadata, connector, host, key, file_id,
+                               Extractor.get_metadata(self, slidesmeta, 'file', file_id, host))
+
+        done = read_done(output_dir)
+        done['pushed'] = {'host': host, 'file_id': file_id, 'time': datetime.datetime.utcnow().isoformat() + 'Z'}
+        write_json(os.path.join(output_dir, DONE_FILE), done)
+
+
+def main():
+    """Parse the command line, process the videos and push the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='+', help="directories, videos and manifests")
+    parser.add_argument('--output', required=True, help="the root of the output tree")
+    parser.add_argument('--processes', type=int, default=1, help="number of videos to process at the same time")
+    parser.add_argument('--timeout', type=float, default=0, help="maximum time (s) per video, 0 for no limit")
+    parser.add_argument('--settings', help="settings file (default: config/settings.yml of the extractor)")
+    parser.add_argument('--parameters', default='{}',
+                        help="parameters for every video (JSON), like the parameters of a manual submission")
+    parser.add_argument('--extensions', nargs='+', default=default_extensions,
+                        help="extensions of the videos in the directories")
+    parser.add_argument('--force', action='store_true', help="also process videos that are done")
+    parser.add_argument('--push', metavar='HOST', help="upload the results to this Clowder instance afterwards")
+    parser.add_argument('--key-file', help="file with the key for Clowder (default: the %s environment variable)"
+                        % KEY_VARIABLE)
+    parser.add_argument('--debug', action='store_true', help="show the debug output")
+    args = parser.parse_args()
+    key = None
+    if args.push:
+        try:
+            key = read_key(args.key_file)
+        except (IOError, OSError) as err:
+            parser.error("Failed to read the key file: %s" % err)
+        if not key:
+            parser.error("--push needs a key in a --key-file or the %s environment variable" % KEY_VARIABLE)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(process)d %(name)s %(levelname)s: %(message)s')
+    extractor = BackfillVideoMetaData(os.path.abspath(args.output), args.settings, json.loads(args.parameters),
+                                      args.processes)
+    fingerprint = extractor.fingerprint()
+
+    videos = find_videos(args.input, args.extensions)
+    todo = [video for video in videos
+            if args.force or not is_done(os.path.join(extractor.output, video['name']), fingerprint)]
+    logging.info("%d videos, %d are done, processing %d with %d processes", len(videos), len(videos) - len(todo),
+                 len(todo), args.processes)
+
+    progress = {'ended': 0}
+
+    def report(name, outcome):
+        """Log the outcome of a video"""
+        progress['ended'] += 1
+        logging.info("[%d/%d] %s: %s", progress['ended'], len(todo), name, outcome)
+
+    outcomes = run_pool([(video['name'], video) for video in todo], extractor.process_video, args.processes,
+                        args.timeout, report)
+    failed = sorted([name for name, outcome in outcomes.items() if outcome != 'done'])
+    if failed:
+        logging.error("Failed to process %d videos: %s", len(failed), ', '.join(failed))
+
+    if args.push:
+        host = args.push if args.push.endswith('/') else args.push + '/'
+        for video in videos:
+            done = read_done(os.path.join(extractor.output, video['name']))
+            if not video['file_id'] or done is None or done.get('settings') != fingerprint or \
+                    (done.get('pushed') or {}).get('file_id') == video['file_id']:
+                continue
+            try:
+                logging.info("Pushing the results of %s to file %s", video['name'], video['file_id'])
+                extractor.push(video, host, key)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to push the results of %s", video['name'])
+                failed.append(video['name'])
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
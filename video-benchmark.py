@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Benchmark the parallel slide transition detection: run the advanced algorithm with an increasing number of
+segments/workers on a video and report the speedup compared to a single worker.
+
+Usage: video-benchmark.py video [workers ...] [--settings '{"analysis_width": 640}']
+"""
+
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+import time
+
+from slidedetection import slide_find_advanced
+
+
+def run_detection(video, workers, settings):
+    """Run the detection once and return the wall time and the transitions (in seconds)"""
+    output_dir = tempfile.mkdtemp(prefix='video-benchmark')
+    try:
+        start_time = time.time()
+        slides = slide_find_advanced(video, output_dir, workers=workers, **settings)
+        wall_time = time.time() - start_time
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return wall_time, [round(slide[1] / 1000.0, 1) for slide in slides[:-1]]
+
+
+def main():
+    """Parse the command line and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help="path to the video")
+    parser.add_argument('workers', nargs='*', type=int, default=[1, 2, 4, 8], help="worker counts to benchmark")
+    parser.add_argument('--settings', default='{}', help="extra settings for the algorithm (JSON)")
+    parser.add_argument('--debug', action='store_true', help="show the debug output of the detection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    settings = json.loads(args.settings)
+    settings.setdefault('masks', [{'location': 'bottom-right', 'size_x': '20%', 'size_y': '20%'}])
+
+    reference_time = None
+    reference_slides = None
+    print("%8s %10s %8s  %s" % ('workers', 'time (s)', 'speedup', 'transitions'))
+    for workers in args.workers:
+        wall_time, slides = run_detection(args.video, workers, settings)
+        if reference_time is None:
+            reference_time = wall_time
+            reference_slides = slides
+
+        same = 'same as first run' if slides == reference_slides else 'differs: %s' % slides
+        print("%8d %10.2f %8.2f  %d (%s)" % (workers, wall_time, reference_time / wall_time, len(slides), same))
+
+
+if __name__ == "__main__":
+    main()
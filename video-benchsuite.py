@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Benchmark the slide detection algorithms for throughput, memory and accuracy on synthetic lecture videos with known
+slide transitions (generated once into --directory) and any other videos with a ground truth file next to them (same
+name with .txt). Writes a JSON report, and with --baseline fails when the algorithms got slower or less accurate
+than in an earlier report.
+
+Usage: video-benchsuite.py [video ...] [--algorithm advanced basic 'fast:{"algorithm": "advanced", "analysis_width":
+320}'] [--videos cut-720p25 ...] [--output report.json] [--baseline previous.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+import yaml
+
+from benchmark import algorithms, compare_reports, default_specs, generate_video, run_suite
+from extractorsettings import read_settings_file
+
+
+def parse_configuration(value, settings):
+    """Parse NAME or NAME:JSON, the JSON holds the settings and optionally the algorithm (which defaults to NAME)"""
+    name, _, extra = value.partition(':')
+    configuration_settings = dict(settings)
+    configuration_settings.update(json.loads(extra) if extra else {})
+    algorithm = configuration_settings.pop('algorithm', name)
+    if algorithm not in algorithms:
+        raise ValueError("Unknown algorithm %s, possible choices: %s" % (algorithm, ', '.join(sorted(algorithms))))
+
+    return {'name': name, 'algorithm': algorithm, 'settings': configuration_settings}
+
+
+def main():
+    """Parse the command line and run the suite"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', nargs='*', help="extra videos, with the ground truth in a .txt file next to them")
+    parser.add_argument('--algorithm', nargs='+', default=['advanced', 'basic'],
+                        help="the configurations to run: NAME or NAME:JSON with settings")
+    parser.add_argument('--config', help="settings file of the extractor, for the masks (default: config/settings.yml)")
+    parser.add_argument('--settings', default='{}', help="settings for all configurations (JSON)")
+    parser.add_argument('--videos', nargs='*', default=[spec['name'] for spec in default_specs],
+                        help="the synthetic videos to use")
+    parser.add_argument('--directory', default=os.path.join('/tmp', 'video-benchsuite'),
+                        help="where to keep the synthetic videos")
+    parser.add_argument('--encoder', choices=['ffmpeg', 'opencv'], default='ffmpeg',
+                        help="how to encode the synthetic videos")
+    parser.add_argument('--tolerance', type=float, default=2.0, help="tolerance (s) to match a transition")
+    parser.add_argument('--output', help="file to write the JSON report to (default: standard output)")
+    parser.add_argument('--baseline', help="earlier report to compare with")
+    parser.add_argument('--max-slowdown', type=float, default=0.2,
+                        help="fraction the time per video hour may grow compared to the baseline")
+    parser.add_argument('--max-f1-drop', type=float, default=0.05,
+                        help="how much the f1 score may drop compared to the baseline")
+    parser.add_argument('--debug', action='store_true', help="show the debug output")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    settings = json.loads(args.settings)
+    if 'masks' not in settings:
+        # The masks the extractor uses
+        try:
+            settings['masks'] = read_settings_file(args.config).get('masks', [])
+        except (IOError, yaml.YAMLError) as err:
+            parser.error("Failed to read the settings file: %s" % err)
+    configurations = [parse_configuration(value, settings) for value in args.algorithm]
+
+    specs = dict([(spec['name'], spec) for spec in default_specs])
+    videos = []
+    for name in args.videos:
+        if name not in specs:
+            parser.error("Unknown synthetic video %s, possible choices: %s" % (name, ', '.join(sorted(specs))))
+        videos.append(generate_video(specs[name], args.directory, args.encoder))
+    for video in args.video:
+        truth = os.path.splitext(video)[0] + '.txt'
+        videos.append((video, truth if os.path.exists(truth) else None))
+
+    report = run_suite(videos, configurations, args.tolerance)
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output)
+    else:
+        print(output)
+
+    for name, summary in sorted(report['summary'].items()):
+        logging.info("%s: %s per video hour, f1 %s, peak RSS growth %s", name,
+                     '%.1f s' % summary['seconds_per_video_hour']
+                     if summary['seconds_per_video_hour'] is not None else 'n/a',
+                     '%.2f' % summary['f1'] if summary['f1'] is not None else 'n/a',
+                     '%.0f MB' % (summary['peak_rss'] / 1e6) if summary['peak_rss'] else 'n/a')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baselinefile:
+            regressions = compare_reports(report, json.load(baselinefile), args.max_slowdown, args.max_f1_drop)
+        for regression in regressions:
+            logging.error("Regression: %s", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
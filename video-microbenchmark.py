@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the per-frame work of the slide detection: the masking and change detection of a frame (without
+decoding) as it was done before, with a Python loop over the masks and new arrays for every intermediate image, and
+as it is done now, with compiled masks and preallocated buffers. With --algorithm background, the background models
+of the advanced algorithm (knn and running_average) are compared instead. Reports the frames/s, the bytes allocated
+per frame (only with Python 3, which can trace the allocations of NumPy) and how much the peak RSS grows while
+processing the frames (the model and its buffers, measured in a separate process).
+
+Usage: video-microbenchmark.py video [--frames 500] [--algorithm both] [--settings '{"analysis_width": 640}']
+"""
+
+import argparse
+import json
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from background import create_background_model
+from benchmark.measure import run_measured
+from framesource import open_frame_source
+from masks import analysis_resolution, apply_masks, compile_masks, prepare_masks, scale_masks
+from slidedetection import changed_pixels, default_settings_advanced, default_settings_basic
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # pylint: disable=invalid-name
+
+
+def read_frames(video, count, analysis_width, grayscale):
+    """Decode the first frames of the video at the analysis resolution"""
+    source = open_frame_source(video)
+    fps = source.fps
+    frame_size = source.frame_size
+    analysis_size, scale = analysis_resolution(frame_size, analysis_width)
+    source.set_output(analysis_size, grayscale=grayscale)
+    frames = []
+    while len(frames) < count:
+        frame = source.read()
+        if frame is None:
+            break
+        frames.append(np.copy(frame))
+    source.release()
+
+    return frames, fps, frame_size, scale
+
+
+def basic_before(masks, analysis_size, threshold_cutoff):
+    """The frame differencing of the basic algorithm as it was"""
+    prev_frame = np.zeros(analysis_size, np.uint8)
+
+    def kernel(frame_gray):
+        """Process one frame"""
+        for mask in masks:
+            frame_gray[mask['y1']:mask['y2'], mask['x1']:mask['x2']] = 0
+        frame_diff = cv2.absdiff(frame_gray, prev_frame)
+        _, frame_thres = cv2.threshold(frame_diff, threshold_cutoff, 255, cv2.THRESH_BINARY)
+        d_colors = float(np.count_nonzero(frame_thres)) / frame_gray.size
+        np.copyto(prev_frame, frame_gray)
+        return d_colors
+
+    return kernel
+
+
+def basic_after(masks, analysis_size, threshold_cutoff):
+    """The frame differencing of the basic algorithm with compiled masks and preallocated buffers"""
+    crop, regions = compile_masks(masks, analysis_size)
+    analysis_pixels = analysis_size[0] * analysis_size[1]
+    cropped_size = (crop[0].stop - crop[0].start, crop[1].stop - crop[1].start)
+    prev_frame = np.zeros(cropped_size, np.uint8)
+    frame_diff = np.zeros(cropped_size, np.uint8)
+    frame_thres = np.zeros(cropped_size, np.uint8)
+
+    def kernel(frame_gray):
+        """Process one frame"""
+        frame_gray = apply_masks(frame_gray, crop, regions)
+        d_colors = float(changed_pixels(frame_gray, prev_frame, threshold_cutoff, frame_diff, frame_thres)) / \
+            analysis_pixels
+        np.copyto(prev_frame, frame_gray)
+        return d_colors
+
+    return kernel
+
+
+def advanced_before(masks, analysis_size, averaging_frames):
+    """The background subtraction of the advanced algorithm as it was"""
+    fgbg = cv2.createBackgroundSubtractorKNN(history=averaging_frames, detectShadows=False)
+
+    def kernel(frame):
+        """Process one frame"""
+        for mask in masks:
+            frame[mask['y1']:mask['y2'], mask['x1']:mask['x2']] = 0
+        fgmask = fgbg.apply(frame)
+        return int(cv2.countNonZero(fgmask))
+
+    return kernel
+
+
+def advanced_after(masks, analysis_size, averaging_frames, background_model='knn'):
+    """The background subtraction of the advanced algorithm with compiled masks and a preallocated output"""
+    fgbg = create_background_model(background_model, averaging_frames)
+    crop, regions = compile_masks(masks, analysis_size)
+    fgmask = np.zeros((crop[0].stop - crop[0].start, crop[1].stop - crop[1].start), np.uint8)
+
+    def kernel(frame):
+        """Process one frame"""
+        frame = apply_masks(frame, crop, regions)
+        fgbg.apply(frame, fgmask)
+        return int(cv2.countNonZero(fgmask))
+
+    return kernel
+
+
+def running_average(masks, analysis_size, averaging_frames):
+    """The advanced algorithm with the running average as background model"""
+    return advanced_after(masks, analysis_size, averaging_frames, 'running_average')
+
+
+def peak_rss(factory, args, frames):
+    """
+    Create a kernel and run it on all frames in a separate process
+    :return how much the peak RSS of the process grew (in bytes, None if unknown)
+    """
+    def process_frames():
+        """Runs in the child process"""
+        kernel = factory(*args)
+        buf = np.empty_like(frames[0])
+        for frame in frames:
+            np.copyto(buf, frame)
+            kernel(buf)
+
+    return run_measured(process_frames)[2]
+
+
+def run_kernel(kernel, frames):
+    """
+    Run a kernel on all frames. Every frame is first copied into the same buffer, like the decoders do.
+    :return the frames/s, the bytes allocated per frame (None if unknown) and the results
+    """
+    buf = np.empty_like(frames[0])
+    results = []
+    start_time = time.time()
+    for frame in frames:
+        np.copyto(buf, frame)
+        results.append(kernel(buf))
+    elapsed = time.time() - start_time
+
+    allocated = None
+    if tracemalloc is not None and hasattr(tracemalloc, 'reset_peak'):
+        # Separate run, tracing slows the kernel down. Allocations that are freed within the frame still count as
+        # they raise the peak. The measurement itself allocates a little, which is measured with an empty kernel.
+        totals = []
+        tracemalloc.start()
+        for function in [lambda frame: None, kernel]:
+            total = 0
+            for frame in frames:
+                np.copyto(buf, frame)
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                function(buf)
+                total += tracemalloc.get_traced_memory()[1] - current
+            totals.append(total)
+        tracemalloc.stop()
+        allocated = max(totals[1] - totals[0], 0) / float(len(frames))
+
+    return len(frames) / elapsed, allocated, results
+
+
+def main():
+    """Parse the command line and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help="path to the video")
+    parser.add_argument('--frames', type=int, default=500, help="number of frames to process")
+    parser.add_argument('--algorithm', choices=['advanced', 'basic', 'both', 'background'], default='both')
+    parser.add_argument('--settings', default='{}', help="settings of the algorithms (JSON)")
+    parser.add_argument('--debug', action='store_true', help="show the debug output")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    settings = dict(default_settings_basic)
+    settings.update(default_settings_advanced)
+    settings['masks'] = [{'location': 'bottom-right', 'size_x': '20%', 'size_y': '20%'}]
+    settings.update(json.loads(args.settings))
+
+    benchmarks = []
+    if args.algorithm in ['basic', 'both']:
+        benchmarks.append(('basic', True, [('before', basic_before), ('after', basic_after)]))
+    if args.algorithm in ['advanced', 'both']:
+        benchmarks.append(('advanced', settings['analysis_grayscale'], [('before', advanced_before),
+                                                                        ('after', advanced_after)]))
+    if args.algorithm == 'background':
+        benchmarks.append(('advanced', settings['analysis_grayscale'], [('knn', advanced_after),
+                                                                        ('running_average', running_average)]))
+
+    print("%-10s %-16s %10s %16s %16s" % ('algorithm', 'version', 'frames/s', 'bytes/frame', 'peak RSS growth'))
+    for name, grayscale, versions in benchmarks:
+        frames, fps, frame_size, scale = read_frames(args.video, args.frames, settings['analysis_width'], grayscale)
+        analysis_size = frames[0].shape[:2]
+        masks = scale_masks(prepare_masks(settings['masks'], frame_size), scale)
+        if name == 'basic':
+            parameter = settings['threshold_cutoff']
+        else:
+            parameter = int(settings['motion_capture_averaging_time'] * fps)
+
+        results = {}
+        for version, factory in versions:
+            # The background model samples at random, start both versions from the same state
+            cv2.setRNGSeed(0)
+            speed, allocated, results[version] = run_kernel(factory(masks, analysis_size, parameter), frames)
+            growth = peak_rss(factory, (masks, analysis_size, parameter), frames)
+            print("%-10s %-16s %10.1f %16s %16s" % (name, version, speed,
+                                                    '%.0f' % allocated if allocated is not None else 'n/a',
+                                                    '%d' % growth if growth is not None else 'n/a'))
+
+        if 'before' in results and results['before'] != results['after']:
+            print("%-10s results differ between the versions" % name)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,17 +7,15 @@ Author Alan O'Cais <a.ocais@fz-juelich.de>
 """
 
 import datetime
+import glob
 import json
 import logging
 import multiprocessing
 import os
-import shutil
 import subprocess
-import tempfile
 import time
 
 import cv2  # OpenCV
-import numpy as np
 import yaml
 
 from urllib2 import HTTPError
@@ -26,6 +24,17 @@ import pyclowder
 from pyclowder.extractors import Extractor
 from pyclowder.sections import upload as sections_upload
 
+from cpubudget import cpu_budget
+from extractorsettings import DEFAULT_SETTINGS_FILE, read_settings_file
+from instrumentation import Instruments, compact_summary, open_sink
+from journal import JobJournal
+from resultcache import ResultCache
+from retry import RetryPolicy
+from slidedetection import (default_settings_advanced, default_settings_basic, default_settings_packets, detect_roi,
+                            slide_find_advanced, slide_find_basic, slide_find_multi, slide_find_packets)
+from uploads import UploadPool
+from videoinput import KEY_HEADER, is_url, resolve_video
+
 # For the mask settings, for example:
 #
 # {
@@ -76,31 +85,50 @@ from pyclowder.sections import upload as sections_upload
 # - https://blog.streamroot.io/encode-multi-bitrate-videos-mpeg-dash-mse-based-media-players/
 # - https://trac.ffmpeg.org/wiki/Encode/H.264
 
-default_settings_advanced = {
-    'trigger_ratio' : 5,
-    'minimum_total_change' : 0.06,
-    'minimum_slide_length' : 20,
-    'motion_capture_averaging_time' : 10,
-    'msec_to_delay_screenshot' : 1000,
-}
 
-default_settings_basic = {
-    'threshold_cutoff' : 115,
-    'trigger' : 0.01,
-}
+def single_pass_preview_outputs(output_dir, mp4_filename, webm_filename, webm, encoding_threads):  # pylint: disable=too-many-arguments
+    """
+    The ffmpeg output options to create the previews in a single pass. As every output of an ffmpeg command shares
+    the decoded input, this allows to decode the video only once for all previews (and the slide detection).
+    :return list with the command line arguments for every output
+    """
+    # Constrained quality instead of a target bitrate, which needs 2 passes. Still very heavy compression.
+    mp4_settings = "-vcodec libx264 -preset medium -crf 30 -qmax 42 -maxrate 250k -bufsize 1000k"
+    webm_settings = "-vcodec libvpx -quality good -b:v 250k -crf 10 -qmin 0 -qmax 42 -bufsize 1000k"
+    mp4_audio = "-strict -2 -acodec aac -ac 1 -b:a 64k"
+    webm_audio = "-acodec libopus -ac 1 -b:a 64k"
+
+    threads = ['-threads', str(encoding_threads)]
+    outputs = [threads + mp4_settings.split() + mp4_audio.split() + ['-f', 'mp4', '-y',
+                                                                     os.path.join(output_dir, mp4_filename)]]
+    if webm:
+        outputs.append(threads + webm_settings.split() + webm_audio.split() + ['-f', 'webm', '-y',
+                                                                               os.path.join(output_dir, webm_filename)])
 
+    return outputs
 
-# Add function to do compression that is pickle-able
-def create_video_previews(filename, output_dir, mp4_filename, webm_filename, webm):
-    """Create mp4 and webm heavily compressed previews of the presentation to use in the previewer"""
 
-    # Let's not be greedy, use half available cores since we are probably in a docker container
-    # This could be done less crudely, we could leave this control to the container
-    encoding_threads = multiprocessing.cpu_count()
-    if encoding_threads > 1:
-        encoding_threads = int(np.ceil(encoding_threads / 2))
-
-    ffmpeg_stub = "ffmpeg -loglevel error -y -i \"" + os.path.abspath(filename) + "\" -threads " + \
+# Add function to do compression that is pickle-able
+def create_video_previews(filename, output_dir, mp4_filename, webm_filename, webm, encoding_threads=1,  # pylint: disable=too-many-arguments
+                          single_pass=False):
+    """
+    Create mp4 and webm heavily compressed previews of the presentation to use in the previewer
+    :param encoding_threads: the number of threads for the encoder (see cpubudget)
+    :param single_pass: encode all previews in a single pass instead of two passes per preview
+    """
+
+    # The video can also be streamed from a URL
+    if not is_url(filename):
+        filename = os.path.abspath(filename)
+
+    if single_pass:
+        ffmpeg_command = ['ffmpeg', '-loglevel', 'error', '-nostdin', '-i', filename]
+        for output in single_pass_preview_outputs(output_dir, mp4_filename, webm_filename, webm, encoding_threads):
+            ffmpeg_command += output
+        subprocess.check_output(ffmpeg_command, stderr=subprocess.STDOUT)
+        return
+
+    ffmpeg_stub = "ffmpeg -loglevel error -y -i \"" + filename + "\" -threads " + \
                   str(encoding_threads)
     # We use the same audio settings for both videos
     no_audio = " -an "
@@ -132,13 +160,46 @@ def create_video_previews(filename, output_dir, mp4_filename, webm_filename, web
 
     return
 
+
+def list_slides(results):
+    """
+    The slides for the metadata: the begin and end time, the id of the preview and the begin time in seconds
+    :param results: list with tuples of frame number, timestamp (in msec) and preview id of every slide, the last
+    one holds the end of the last slide
+    """
+    listslides = []
+
+    # first chapter starts at.
+    # Big assumption: the length of the movie is less then 24 hours
+    prev_time = datetime.datetime.utcfromtimestamp(0) + datetime.timedelta(milliseconds=results[0][1])
+    prev_time_msec = results[0][1]
+    previewid = results[0][2]
+
+    # the WebVTT time format needs to be 00:00:00.000
+    format_str = "%H:%M:%S.%f"
+
+    for _, time_idx, new_previewid in results[1:]:
+        begin_delta = datetime.datetime.utcfromtimestamp(0) + datetime.timedelta(milliseconds=time_idx)
+        # microseconds always get printed as 6 digits passed with zeros, so we delete the last 3 digits
+        listslides.append((str(prev_time.strftime(format_str)[:-3]), str(begin_delta.strftime(format_str)[:-3]), str(previewid), str(prev_time_msec / 1000)))
+        previewid = new_previewid
+        prev_time = begin_delta
+        prev_time_msec = time_idx
+
+    return listslides
+
+
 class VideoMetaData(Extractor):
     """Extract slide transitions in a video"""
-    def __init__(self):
+    def __init__(self, command_line=True):
+        """
+        :param command_line: parse the command line of the extractor (not when another script uses the extractor)
+        """
         Extractor.__init__(self)
 
         # parse command line and load default logging configuration
-        self.setup()
+        if command_line:
+            self.setup()
 
         # setup logging for the exctractor
         logging.getLogger('pyclowder').setLevel(logging.DEBUG)
@@ -149,6 +210,19 @@ class VideoMetaData(Extractor):
         self.tempdir = None
         self.masksettings = None
         self.algorithmsettings = None
+        self.shadowsettings = None
+        self.previewsettings = None
+        self.resourcesettings = None
+        self.retrysettings = None
+        self.cachesettings = None
+        self.jobsettings = None
+        self.instrumentationsettings = None
+        self.followsettings = None
+        self.inputsettings = {}
+        self.recording = None
+        self.journal = None
+        self.instruments = Instruments()
+        self.retry_policy = RetryPolicy()
         self.read_settings()
 
     def read_settings(self, filename=None):
@@ -157,22 +231,33 @@ class VideoMetaData(Extractor):
         :param filename: optional path to settings file (defaults to 'settings.yml' in the current directory)
         """
         if filename is None:
-            filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config", "settings.yml")
+            filename = DEFAULT_SETTINGS_FILE
 
         if not os.path.isfile(filename):
             self.logger.warning("No config file found at %s", filename)
             return
 
         try:
-            with open(filename, 'r') as settingsfile:
-                settings = yaml.safe_load(settingsfile) or {}
-                self.masksettings = settings.get('masks', [])
-                algorithmsettings = settings.get('slides')
-                self.algorithmsettings = algorithmsettings[0] if algorithmsettings else {}
+            settings = read_settings_file(filename)
+            self.masksettings = settings.get('masks', [])
+            algorithmsettings = settings.get('slides')
+            self.algorithmsettings = algorithmsettings[0] if algorithmsettings else {}
+            self.shadowsettings = settings.get('shadow') or []
+            self.previewsettings = settings.get('previews') or {}
+            self.resourcesettings = settings.get('resources') or {}
+            self.retrysettings = settings.get('retries') or {}
+            self.cachesettings = settings.get('cache') or {}
+            self.jobsettings = settings.get('jobs') or {}
+            self.instrumentationsettings = settings.get('instrumentation') or {}
+            self.followsettings = settings.get('follow') or {}
+            self.inputsettings = settings.get('input') or {}
         except (IOError, yaml.YAMLError) as err:
             self.logger.error("Failed to read or parse %s as settings file: %s", filename, err)
 
-        self.logger.debug("Read settings from %s: %s + %s", filename, self.masksettings, self.algorithmsettings)
+        self.logger.debug("Read settings from %s: %s + %s + %s + %s + %s + %s + %s + %s + %s + %s + %s", filename,
+                          self.masksettings, self.algorithmsettings, self.shadowsettings, self.previewsettings,
+                          self.resourcesettings, self.retrysettings, self.cachesettings, self.jobsettings,
+                          self.instrumentationsettings, self.followsettings, self.inputsettings)
 
     def check_message(self, connector, host, secret_key, resource, parameters):  # pylint: disable=unused-argument,too-many-arguments
         """Check if the extractor should download the file or ignore it."""
@@ -183,7 +268,11 @@ class VideoMetaData(Extractor):
             else:
                 self.logger.debug("Unknown filetype, but scanning by manual request")
 
-        return pyclowder.utils.CheckMessage.download  # or bypass
+        # Without the download the video is read from a mounted storage path or streamed from Clowder (input_video)
+        if self.inputsettings.get('mode') == 'stream':
+            return pyclowder.utils.CheckMessage.bypass
+
+        return pyclowder.utils.CheckMessage.download
 
     def process_message(self, connector, host, secret_key, resource, parameters):  # pylint: disable=unused-argument,too-many-arguments
         """The actual extractor: we process the video and upload the results"""
@@ -196,7 +285,39 @@ class VideoMetaData(Extractor):
 
         # Used to return a json string but now directly returns a dict
         # usersettings = json.loads(parameters.get('parameters', '{}'))
-        usersettings = parameters.get('parameters', {})
+        self.apply_parameters(parameters.get('parameters', {}))
+
+        # The work directory is kept when the job fails, so a retry can resume from the last completed stage
+        self.journal = JobJournal(resource['id'], self.job_settings(), self.jobsettings.get('directory'),
+                                  self.jobsettings.get('keep_days', 7))
+        self.tempdir = self.journal.work_dir
+        self.retry_policy = RetryPolicy(**self.retrysettings)
+
+        def report_progress(fraction, fps, remaining):
+            """Let Clowder know how far the detection is"""
+            connector.status_update(pyclowder.utils.StatusMessage.processing, resource,
+                                    "Detecting slides: %d%% done at %.0f frames/s, %s left" %
+                                    (fraction * 100, fps, datetime.timedelta(seconds=int(remaining))))
+
+        # The time of every stage of the job, with the progress of the detection pushed as status updates
+        self.instruments = Instruments(report_progress, self.instrumentationsettings.get('progress_interval', 30))
+        release_video = None
+        try:
+            if not resource.get('local_paths'):
+                video, release_video = self.input_video(connector, host, secret_key, resource)
+                resource['local_paths'] = [video]
+            self.find_slides_transitions(connector, host, secret_key, resource, masks=self.masksettings, webm=False)
+        finally:
+            if release_video is not None:
+                release_video()
+            self.report_instruments(resource)
+
+        self.logger.info("Clowder calls: %(calls)d, attempts: %(attempts)d, retries: %(retries)d, "
+                         "failures: %(failures)d, waited %(waited).1f s", self.retry_policy.counters)
+        self.journal.finish()
+
+    def apply_parameters(self, usersettings):
+        """Override the settings with the parameters of a manually submitted file"""
         usermask = usersettings.get('masks')
         if isinstance(usermask, (dict, list)):
             self.masksettings = usermask
@@ -205,11 +326,60 @@ class VideoMetaData(Extractor):
         if isinstance(userslides, dict):
             self.algorithmsettings.update(userslides)
 
-        self.tempdir = tempfile.mkdtemp(prefix='clowder-video-presentation')
+        userpreviews = usersettings.get('previews')
+        if isinstance(userpreviews, dict):
+            self.previewsettings.update(userpreviews)
 
-        self.find_slides_transitions(connector, host, secret_key, resource, masks=self.masksettings, webm=False)
+        # A recording that is still being written (a growing file or a glob pattern of its segments), on storage the
+        # extractor can read
+        self.recording = usersettings.get('recording')
 
-        shutil.rmtree(self.tempdir, ignore_errors=True)
+    def job_settings(self):
+        """The settings that change the results of a job"""
+        return {'masks': self.masksettings, 'slides': self.algorithmsettings, 'previews': self.previewsettings,
+                'recording': self.recording}
+
+    def input_video(self, connector, host, secret_key, resource):
+        """
+        Find the video of a file that wasn't downloaded (stream input mode): on a mounted storage path, or else
+        streamed from Clowder with range requests, so the detection and the encoding start while the bytes arrive.
+        The video is only downloaded if Clowder doesn't support range requests. The key is sent as a header, so it
+        never ends up in a URL, a log or the command line of the decoders (see videoinput).
+        :return tuple with the path or URL of the video and a function to call when the job is done with it (None if
+        there is nothing to clean up)
+        """
+        def download():
+            """Download the video (the last resort)"""
+            return self.retry_policy.call(pyclowder.files.download, connector, host, secret_key, resource['id'],
+                                          resource.get('intermediate_id'), resource['file_ext'])
+
+        with self.instruments.timer('input'):
+            info = self.retry_policy.call(pyclowder.files.download_info, connector, host, secret_key, resource['id'])
+            return resolve_video(info.get('filepath'), getattr(connector, 'mounted_paths', {}),
+                                 '%sapi/files/%s' % (host, resource['id']), {KEY_HEADER: secret_key}, download)
+
+    def instruments_summary(self):
+        """The timers and counters of the job, including the calls to Clowder"""
+        summary = self.instruments.summary()
+        for name, value in self.retry_policy.counters.items():
+            summary['counters']['clowder_' + name] = round(value, 3)
+        return summary
+
+    def report_instruments(self, resource):
+        """Log the timers and counters of the job and write them to the sink"""
+        summary = self.instruments_summary()
+        self.logger.info("Job took %.1f s: %s", summary['wall_time'],
+                         ', '.join(['%s %.1f s' % (stage, timer['seconds'])
+                                    for stage, timer in sorted(summary['stages'].items())]))
+        sink = open_sink(self.instrumentationsettings)
+        if sink is None:
+            return
+        try:
+            sink.write({'file': resource['id'], 'algorithm': self.algorithmsettings.get('algorithm', 'advanced')},
+                       summary)
+        except (IOError, OSError) as err:
+            self.logger.error("Failed to write the instrumentation to %s: %s", self.instrumentationsettings['path'],
+                              err)
 
     def generate_vtt_chapters(self):
         """Generate a WebVTT that defines the chapters"""
@@ -234,453 +404,358 @@ class VideoMetaData(Extractor):
 
         return vttfile
 
-    def prepare_masks(self, masks, frame):
+    def try_upload_preview_file(self, upload_func, connector, host, secret_key, resource_id, preview_file,
+                                parameters=None):
         """
-        Convert masks to 'proper' masks: x1..x2 and y1..y2
-        :param masks: the list of areas to mask out
-        :param frame: tuple contain the resolution of the video
+        Upload to Clowder, retrying transient errors according to the retry policy (compressing is very expensive,
+        so we don't want to lose the result to a hiccup of Clowder)
         """
-        locations_hori = ['right', 'left']
-        locations_vert = ['top', 'bottom']
-
-        def parsevalue(size, max_size):
-            """handle % values"""
-            if str(size).endswith('%'):
-                return int(max_size * float(size.strip('%'))/100.0)
-
-            return int(size)
-
-        parsed_masks = []
-        for mask in masks:
-            where = mask.get('location', '').split('-')
-            if len(where) != 2 or where[0] not in locations_vert or where[1] not in locations_hori:
-                self.logger.error("Invalid location setting: %s. Possible choices: %s", mask.get('location'),
-                                  ', '.join(["%s-%s" % (y, x) for x in locations_hori for y in locations_vert]))
-                continue
-
-            if where[0] == "bottom":
-                y2 = frame[0]
-                y1 = frame[0] - parsevalue(mask.get('size_y', 0), frame[0])
-            else:
-                y1 = 0
-                y2 = parsevalue(mask.get('size_y', 0), frame[0])
+        self.logger.info("Trying to upload preview file %s", preview_file)
+        if parameters is None:
+            return self.retry_policy.call(upload_func, connector, host, secret_key, resource_id, preview_file)
 
-            if where[1] == "right":
-                x2 = frame[1]
-                x1 = frame[1] - parsevalue(mask.get('size_x', 0), frame[1])
-            else:
-                x1 = 0
-                x2 = parsevalue(mask.get('size_x', 0), frame[1])
-
-            parsed_masks.append({
-                'x1': x1,
-                'x2': x2,
-                'y1': y1,
-                'y2': y2,
-            })
-
-        self.logger.debug("Masks after preparing: %s", parsed_masks)
-        return parsed_masks
-
-    def try_upload_preview_file(self, upload_func, connector, host, secret_key, resource_id, preview_file,
-                                parameters=None, allowed_failures=20, wait_between_failures=15):
-        # Compressing is very expensive, let's try to upload repeatedly for 5 minutes before failing
-        for attempt in range(allowed_failures):
-            try:
-                if attempt != 0:
-                    time.sleep(wait_between_failures)
-                self.logger.info("Trying to upload preview file %s (Attempt %s)", preview_file, attempt)
-                if parameters is None:
-                    previewid = upload_func(connector, host, secret_key, resource_id, preview_file)
-                else:
-                    previewid = upload_func(connector, host, secret_key, resource_id, preview_file, parameters)
-            except Exception as ex:
-                template = "An exception of type {0} occurred. Arguments:\n{1!r}"
-                message = template.format(type(ex).__name__, ex.args)
-                self.logger.warning("Caught exception (attempt %s) for %s, trying up to %s times: %s", attempt,
-                                    preview_file, allowed_failures, message)
-            else:
-                break
-        else:
-            # Raise the last HTTPError
-            raise ex
-
-        return previewid
+        return self.retry_policy.call(upload_func, connector, host, secret_key, resource_id, preview_file, parameters)
 
     def find_slides_transitions(self, connector, host, secret_key, resource, masks=None, webm=True):  # pylint: disable=unused-argument,too-many-arguments
         """find slides"""
 
-        # First let's set the encoders off in the background to create our previews (uses only half available
-        # processors so should be safe to leave in the background)
         mp4_preview = "preview.mp4.preview"
         webm_preview = "preview.webm.preview"
-        encode_job = multiprocessing.Process(
-            target=create_video_previews,
-            args=(resource['local_paths'][0], self.tempdir, mp4_preview, webm_preview, webm)
-        )
-        encode_job.start()
 
         if self.algorithmsettings.get('algorithm', '') == "basic":
             settings = dict(default_settings_basic)  # make sure it's a copy
             settings.update(dict([(a, b) for a, b in self.algorithmsettings.iteritems()
                                   if a in default_settings_basic.keys()]))
-            self.logger.debug("Using basic algorithm for finding slides. settings: %s", settings)
-            results = self.slide_find_basic(resource['local_paths'][0], masks=masks, **settings)
+            find_slides = slide_find_basic
+        elif self.algorithmsettings.get('algorithm', '') == "packets":
+            settings = dict(default_settings_packets)  # make sure it's a copy
+            settings.update(dict([(a, b) for a, b in self.algorithmsettings.iteritems()
+                                  if a in default_settings_packets.keys()]))
+            find_slides = slide_find_packets
         else:
             settings = dict(default_settings_advanced)  # make sure it's a copy
             settings.update(dict([(a, b) for a, b in self.algorithmsettings.iteritems()
                                   if a in default_settings_advanced.keys()]))
-            self.logger.debug("Using advanced algorithm for finding slides. settings: %s", settings)
-            results = self.slide_find_advanced(resource['local_paths'][0], masks=masks, **settings)
-
-        # Wait for encoder job to finish and upload the compressed previews
-        encode_job.join()
-        # Check the output files exist, if so upload them
+            find_slides = slide_find_advanced
+
+        # A recording is followed while it is being written: the slides are uploaded and the metadata is updated as
+        # the recording goes on. The previews are encoded once it has ended, from the recording if it is a single file.
+        video = preview_video = resource['local_paths'][0]
+        recording = self.recording
+        if recording and find_slides is slide_find_packets:
+            self.logger.error("Following a recording needs a pixel based algorithm, processing the file instead")
+            recording = None
+        if find_slides is not slide_find_packets:
+            settings['follow'] = self.followsettings.get('idle_timeout', 60) if recording else 0
+        if recording:
+            video = recording
+            if not glob.has_magic(recording):
+                preview_video = recording
+            self.logger.info("Following the recording %s, the previews are encoded from %s", recording,
+                             preview_video)
+
+        # An earlier attempt of this job may have finished the encoding and/or the detection already
         mp4_preview_file = os.path.join(self.tempdir, mp4_preview)
         webm_preview_file = os.path.join(self.tempdir, webm_preview)
-        if os.path.exists(mp4_preview_file):
-            mp4_preview_id = self.try_upload_preview_file(pyclowder.files.upload_preview, connector, host, secret_key,
-                                                          resource['id'], mp4_preview_file, parameters={})
-            if webm and os.path.exists(webm_preview_file):
-                webm_preview_id = self.try_upload_preview_file(pyclowder.files.upload_preview, connector, host,
-                                                               secret_key, resource['id'], webm_preview_file,
-                                                               parameters={})
-        else:
-            self.logger.error("Video preview files were not created correctly!")
-            return []
-
-        if webm:
-            previews = {'mp4': mp4_preview_id, 'webm': webm_preview_id}
-        else:
-            previews = {'mp4': mp4_preview_id}
-
-        self.results = []
-
-        slidesmeta = {
-            'nrslides': 0,
-            'listslides': [],
-            'algorithm': self.algorithmsettings.get('algorithm', 'advanced'),
-            'settings': settings,
-            'previews': previews,
-        }
-        self.logger.debug("tmp results: %s", results)
-
-        for idx, (frame_idx, time_idx, slidepath) in enumerate(results):
-            # last second/frame always gets added for WebVTT but hasn't got a slidepath set
-            if not slidepath:
-                self.results.append((frame_idx, time_idx, None))
-                continue
-
-            # Create section for file (currently not used)
-            #sectionid = sections_upload(connector, host, secret_key, {'file_id': resource['id']})
-            #slidemeta = {
-            #    'section_id': sectionid,
-            #}
-            #description = "Slide %2d at %s" % (idx + 1, datetime.timedelta(milliseconds=time_idx))
-            # upload preview & associated it with the section
-            if idx == 0:
-                self.try_upload_preview_file(pyclowder.files.upload_thumbnail, connector, host, secret_key,
-                                             resource['id'], slidepath)
-            
-            previewid = self.try_upload_preview_file(pyclowder.files.upload_preview, connector, host, secret_key,
-                                                     resource['id'], slidepath, parameters={})
-
-            # add a description to every preview
-            #pyclowder.sections.upload_description(connector, host, secret_key, sectionid, {'description': description})
-
-            self.results.append((frame_idx, time_idx, previewid))
-
-        self.logger.debug("final results: %s", self.results)
-
-        # first and last frame will always be in self.results
-        if self.results and len(self.results) > 1:
-            slidesmeta['nrslides'] = len(self.results) - 1,  # the last frame always gets added too
-
-            # first chapter starts at.
-            # Big assumption: the length of the movie is less then 24 hours
-            prev_time = datetime.datetime.utcfromtimestamp(0) + datetime.timedelta(milliseconds=self.results[0][1])
-            prev_time_msec = self.results[0][1]
-            previewid = self.results[0][2]
-
-            # the WebVTT time format needs to be 00:00:00.000
-            format_str = "%H:%M:%S.%f"
-
-            for _, time_idx, new_previewid in self.results[1:]:
-                begin_delta = datetime.datetime.utcfromtimestamp(0) + datetime.timedelta(milliseconds=time_idx)
-                # microseconds always get printed as 6 digits passed with zeros, so we delete the last 3 digits
-                slidesmeta['listslides'].append((str(prev_time.strftime(format_str)[:-3]), str(begin_delta.strftime(format_str)[:-3]), str(previewid), str(prev_time_msec / 1000)))
-                previewid = new_previewid
-                prev_time = begin_delta
-                prev_time_msec = time_idx
-
-        metadata = self.get_metadata(slidesmeta, 'file', resource['id'], host)
-        self.logger.debug("New metadata: %s", metadata)
-
-        # upload metadata
-        self.try_upload_preview_file(pyclowder.files.upload_metadata, connector, host, secret_key, resource['id'],
-                                     metadata)
-
-    def slide_find_advanced(self, filename, **kwargs):
-        """
-        Gather a list of transitions from an input video.
-        The algorithm leverages motion tracking techniques and works well with unprocessed screen capture (heavy compression
-        can introduce false positives). A portion of the image can be masked out for cases where you may have live video
-        superimposed on the frame.
-
-        :param filename: path to the video
-        :param masks: list of area to mask out before doing slide transition detection
-        :param trigger_ratio: the relative ratio of changed pixels that causes a trigger
-        :param minimum_total_change: minimum number of pixels that must change to register a trigger (on a scale between 0
-        to 1, with a default of 6%)
-        :param minimum_slide_length: minimum length of a slide (in seconds)
-        :param motion_capture_averaging_time: the time over which to build up our average of the background (in seconds)
-        :param msec_to_delay_screenshot: The amount of delay before taking a screenshot (good for animated slide
-        transitions) in milliseconds
-        :return list with tuples of frame number, timestamp and path to screenshot of slide
-        """
-        options = dict(default_settings_advanced)
-        options.update(kwargs)
-
-        masks = options.get('masks', [])
-        if not isinstance(masks, list):
-            masks = [masks]
-
-        trigger_ratio = options.get('trigger_ratio')
-        minimum_total_change = options.get('minimum_total_change')
-        minimum_slide_length = options.get('minimum_slide_length')
-        motion_capture_averaging_time = options.get('motion_capture_averaging_time')
-        msec_to_delay_screenshot = options.get('msec_to_delay_screenshot')
-
-        cap = cv2.VideoCapture(filename)
-        if not cap.isOpened():
-            self.logger.error("Failed to open file %s", filename)
-            return []
-
-        # Grab some basic information about the video
-        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        # I would like to change the sampling FPS to something like 5fps since this would mean processing a lot less frames
-        # but using cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index) is actually very slow and not worth the change
-        fps = cap.get(cv2.CAP_PROP_FPS)  # Assuming non-variable FPS
-        num_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-
-        slides = []
-        errors = []
-
-        cur_masks = self.prepare_masks(masks, (int(height), int(width)))
-
-        # Verify the algorithm parameters make sense:
-        #
-        # Verify the mask is set for a sensible region
-        for mask in cur_masks:
-            if (mask['x2'] > width) or (mask['y2'] > height):
-                errors += ["Mask is outside bounds of image!"]
-        # Give some reasonable bounds for the trigger ratio
-        if trigger_ratio < 2 or trigger_ratio > 10:
-            errors += ["Expected a trigger ratio in range from 2 to 10!"]
-        # Give some reasonable bounds for the minimum total change
-        if minimum_total_change < 0 or minimum_total_change > 1:
-            errors += ["Expected a minimum_total_change on a scale from 0.0 to 1.0!"]
-        # Check minimum slide length is less than the length of the video
-        if minimum_slide_length > fps * num_frames:
-            errors += ["The video length is less than the minimum slide length!"]
-        # Check the motion_capture_averaging_time makes sense
-        if motion_capture_averaging_time > minimum_slide_length:
-            errors += ["motion_capture_averaging_time cannot be longer than minimum_slide_length!"]
-
-        if errors:
-            for error in errors:
-                self.logger.error("Algorithm parameter error: %s", error)
-            return []
-
-        # Set lower bound on our pixel change average
-        mask_area = 0
-        for mask in cur_masks:
-            mask_area += (mask['x2'] - mask['x1']) * (mask['y2'] - mask['y1'])
-
-        min_pixel_change_av = (minimum_total_change / trigger_ratio) * \
-                              ((width * height) - mask_area)
-
-        # Set the number of frames for the minimum length of a slide
-        minimum_slide_length_in_frames = int(round(minimum_slide_length * fps))
-
-        #  Allocate space for our average of the changes of the frames in the last averaging_time seconds
-        averaging_frames = int(motion_capture_averaging_time * fps)
-        av_array = np.zeros(averaging_frames, dtype=int)
-
-        # Set up the motion capture algorithm to learn over our set averaging time and output B/W images
-        fgbg = cv2.createBackgroundSubtractorKNN(history=averaging_frames, detectShadows=False)
-
-        # Set the number of frames we can safely ignore after we have a trigger,which is the minimum slide length adjusted
-        # for our averaging_frames frames so that we have the correct average and bg memory
-        ignore_frames = (minimum_slide_length * fps) - averaging_frames
-
-        frame_index = 0
-        previous_trigger_frame = 0
-        average = 0.0
-        percent_processed = 0
-        while frame_index < num_frames:
-            ret, frame = cap.read()
-
-            if not ret:
-                break
-
-            orig_frame = np.copy(frame)
-
-            # Apply our mask
-            try:
-                for mask in cur_masks:
-                    frame[mask['y1']:mask['y2'], mask['x1']:mask['x2'], 0:3] = 0
-            except (KeyError, ValueError) as err:
-                self.logger.error("Failed to apply mask %s: %s", mask, err)
-
-            # Check to we are in the region where a slide will never be extracted (due to min_slide_length). If so, don't do
-            # any of the hard work.
-
-            if frame_index > (previous_trigger_frame + ignore_frames) or frame_index == 0:
-                # Apply the mask and count the white pixels
-                fgmask = fgbg.apply(frame)
-                # If you want to see what the algorithm is looking at, uncomment the below
-                # cv2.imshow('frame', fgmask)
-                # if cv2.waitKey(1) & 0xFF == ord('q'):
-                # break
-
-                # Count the changed pixels (based on the learned background)
-                whites = int(cv2.countNonZero(fgmask))
-
-                # Check if we have a trigger
-                if (frame_index - previous_trigger_frame) > minimum_slide_length_in_frames or frame_index == 0:
-                    if average > min_pixel_change_av:
-                        proxy_average = average
-                    else:
-                        proxy_average = min_pixel_change_av
-
-                    if (whites > trigger_ratio * proxy_average) or frame_index == 0:
-                        # Grab the slide
-                        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)
-                        self.logger.debug("Found slide transition at %s", timestamp)
-
-                        # Set the path now, but write the image later
-                        slidepath = os.path.join(self.tempdir, 'slide%05d.jpg' % (len(slides)+1))
-
-                        slides.append((frame_index, timestamp, slidepath))
-
-                        previous_trigger_frame = frame_index
-                        # Restart the averaging process
-                        average = 0.0
-                        av_array[:] = 0
-
-                # Update our average and the associated array. Since we know that the average is restarted after every
-                # trigger things are sequential and it is safe to use modulo here.
-                if previous_trigger_frame != frame_index:
-                    # First remove the value of the previous entry from the average
-                    average -= av_array[frame_index % averaging_frames] / float(averaging_frames)
-                    # Add the new value to the array
-                    av_array[frame_index % averaging_frames] = whites
-                    # Update the average
-                    average += av_array[frame_index % averaging_frames] / float(averaging_frames)
-
-            # Let people know how far along we are
-            frame_index += 1
-            if (frame_index % round(num_frames/100.0)) == 0:
-                percent_processed += 1
-                self.logger.debug("Processed at %3d %%", percent_processed)
-
-        # Now that we know all the transitions, grab the slide image with a configurable offset
-        final_timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)
-        for slide in slides:
-            # Set the time position of the slide for the grab
-            cap.set(cv2.CAP_PROP_POS_MSEC, slide[1] + msec_to_delay_screenshot)
-            # Grab the image
-            _, frame = cap.read()
-            # Save the image
-            cv2.imwrite(slide[2], frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-        # Add am empty slide to hold the terminating timestamp
-        slides.append((frame_index, final_timestamp, None))
-        cap.release()
-
-        return slides
-
-    def slide_find_basic(self, filename, **kwargs):  # pylint: disable=too-many-locals
-        """
-        Find slide transitions in a video. Method:
-            - Convert to greyscale
-            - Create a diff of two consecutive frames
-            - Check how many pixels have changed 'significantly'
-            - If enough: new slide
-
-        :param masks: list of area to mask out before doing slide transition detection
-        :parm threshold_cutoff: threshold to mark a pixel change significant
-        :param trigger: fraction of pixels that need to be changed significantly to trigger new slide
-        :return list with tuples of frame number, timestamp and path to screenshot of slide
-        """
-        options = dict(default_settings_basic)
-        options.update(kwargs)
-
-        masks = options.get('masks', [])
-        if not isinstance(masks, list):
-            masks = [masks]
-
-        threshold_cutoff = options.get('threshold_cutoff')
-        trigger = options.get('trigger')
-
-        cap = cv2.VideoCapture(filename)
-        if not cap.isOpened():
-            self.logger.error("Failed to open file %s", filename)
-            return []
-
-        fps = int(cap.get(cv2.CAP_PROP_FPS))  # assume it's constant and we convert to integer
-        nFrames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.logger.debug("FPS: %d, total frames: %d", fps, nFrames)
-
-        frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
-        self.logger.debug("Resolution: %s", frame_size)
-        prev_frame = np.zeros(frame_size, np.uint8)
-
-        cur_masks = self.prepare_masks(masks, frame_size)
-
-        results = []
-
-        # Start processing from the first frame
-        while True:
-            frame_idx = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-            time_idx = float(cap.get(cv2.CAP_PROP_POS_MSEC))
-            time_real = datetime.timedelta(milliseconds=time_idx)
-
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-            try:
-                for mask in cur_masks:
-                    frame_gray[mask['y1']:mask['y2'], mask['x1']:mask['x2']] = 0
-            except (KeyError, ValueError) as err:
-                self.logger.error("Failed to apply mask %s: %s", mask, err)
-
-            # Find the number of pixels that have (significantly) changed since the last frame
-            frame_diff = cv2.absdiff(frame_gray, prev_frame)
-            _, frame_thres = cv2.threshold(frame_diff, threshold_cutoff, 255, cv2.THRESH_BINARY)
-            d_colors = float(np.count_nonzero(frame_thres)) / frame_gray.size
-
-            if d_colors > trigger:
-                self.logger.debug("Found slide transition at frame %d, time: %s", frame_idx, time_real)
-                slidepath = os.path.join(self.tempdir, 'slide%05d.png' % (len(results)+1))
-                cv2.imwrite(slidepath, frame)
-
-                results.append((frame_idx, time_idx, slidepath))
-
-            prev_frame = frame_gray
-
-            if frame_idx % (10*fps) == 0:
-                self.logger.debug("Slide transition detection %.2f%% done\t%s", float(frame_idx)/nFrames*100, time_real)
-
-
-        results.append((frame_idx, time_idx, None))
-        cap.release()
+        encoded = self.journal.done('encode')
+        results = self.journal.get('detection')
+        shadow_results = self.journal.get('shadow')
+        if results is not None:
+            results = [(frame_idx, time_idx, os.path.join(self.tempdir, slide) if slide else None)
+                       for frame_idx, time_idx, slide in results]
+
+        # Identical videos with the same settings give the same results, there is no need to process them again. The
+        # key holds the settings of the job, without the number of workers (it depends on the CPUs of the host and
+        # doesn't change the results) and the region of auto_roi (it is detected from the video, and cached with the
+        # results).
+        cache = None
+        if self.cachesettings.get('directory') and not recording:
+            cache = ResultCache(self.cachesettings['directory'], self.cachesettings.get('max_size', '10G'))
+            cache_key = cache.key(resource['local_paths'][0], {
+                'algorithm': self.algorithmsettings.get('algorithm', 'advanced'),
+                'settings': dict([(name, value) for name, value in settings.items() if name != 'workers']),
+                'masks': masks,
+                'previews': self.previewsettings,
+                'webm': webm,
+            })
+            if results is None or not encoded:
+                with self.instruments.timer('cache'):
+                    cached = cache.get(cache_key, self.tempdir)
+                if cached is not None:
+                    results = cached
+                    encoded = True
+                    cached_info = cache.info(cache_key)
+                    if 'roi' in cached_info:
+                        self.journal.record('roi', cached_info['roi'])
+                    self.journal.record('encode')
+                    self.journal.record('detection', [(frame_idx, time_idx, os.path.basename(slide) if slide else None)
+                                                      for frame_idx, time_idx, slide in results])
+
+        # Split the CPUs of the container between the preview encoder and the detection
+        budget = cpu_budget(self.resourcesettings)
+        cv2.setNumThreads(budget['detection'])
+        if settings.get('workers', 1) > budget['detection']:
+            self.logger.info("Limiting the number of workers from %d to %d", settings['workers'], budget['detection'])
+            settings['workers'] = budget['detection']
+
+        # The previews can be encoded by the same ffmpeg process that decodes the video for the slide detection.
+        # That only works with the ffmpeg decoder and without splitting the video in segments (and the packets
+        # algorithm doesn't decode the video at all).
+        preview_mode = self.previewsettings.get('mode', 'two-pass')
+        if preview_mode == 'shared' and (settings.get('decoder') != 'ffmpeg' or settings.get('workers', 1) > 1 or
+                                         find_slides is slide_find_packets or recording):
+            self.logger.warning("Shared preview encoding needs a pixel based algorithm with the ffmpeg decoder and a "
+                                "single worker on a finished video, falling back to single-pass encoding")
+            preview_mode = 'single-pass'
+
+        # The slide region is detected once, the settings (and so the metadata) hold it so it can be reused for the
+        # other videos of a series. With the results at hand it isn't needed anymore.
+        if settings.get('auto_roi') and not settings.get('roi') and not recording:
+            if self.journal.done('roi'):
+                settings['roi'] = self.journal.get('roi')
+            elif results is None or not encoded:
+                with self.instruments.timer('roi'):
+                    settings['roi'] = detect_roi(resource['local_paths'][0], settings.get('decoder'))
+                self.journal.record('roi', settings['roi'])
+
+        # Other algorithms (or settings) can run next to the main one on the same decode of the video. Their
+        # transitions only end up in the metadata, to compare them with the main algorithm.
+        shadows = [dict(shadow) for shadow in self.shadowsettings if isinstance(shadow, dict)]
+        if shadows and (find_slides is slide_find_packets or settings.get('workers', 1) > 1):
+            self.logger.warning("Shadow algorithms need a pixel based main algorithm and a single worker, skipping "
+                                "them")
+            shadows = []
+
+        # The slides are uploaded in the background as soon as the detection has written them. All uploads share
+        # the keep-alive session of the pool, its threads and session are closed however the job ends.
+        uploads = UploadPool(connector, budget['uploads'])
+        try:
+            connector = uploads.connector
+            journal = self.journal
+            instruments = self.instruments
+            slide_uploads = {}
+            thumbnail_uploads = []
+
+            def upload_once(name, upload_func, path, parameters=None):
+                """Upload a file, unless an earlier attempt of this job already did"""
+                uploadid = journal.upload_id(name)
+                if uploadid is None:
+                    with instruments.timer('upload'):
+                        uploadid = self.try_upload_preview_file(upload_func, connector, host, secret_key,
+                                                                resource['id'], path, parameters)
+                    journal.record_upload(name, uploadid)
+                return uploadid
+
+            def upload_slide(slidepath):
+                """Start uploading a slide (the first one is also the thumbnail)"""
+                if not slide_uploads:
+                    thumbnail_uploads.append(uploads.submit(upload_once, 'thumbnail', pyclowder.files.upload_thumbnail,
+                                                            slidepath))
+                slide_uploads[slidepath] = uploads.submit(upload_once, os.path.basename(slidepath),
+                                                          pyclowder.files.upload_preview, slidepath, {})
+
+            live_slides = []
+
+            def upload_live_metadata(slides):
+                """Upload the metadata with the slides of the recording that have ended so far"""
+                try:
+                    ended = [(frame_idx, time_idx,
+                              slide_uploads[slidepath].get() if slidepath in slide_uploads else None)
+                             for frame_idx, time_idx, slidepath in slides[:-1]]
+                    livemeta = {
+                        'nrslides': len(ended),
+                        'listslides': list_slides(ended + [slides[-1]]),
+                        'algorithm': self.algorithmsettings.get('algorithm', 'advanced'),
+                        'settings': settings,
+                        'recording': recording,
+                        'live': True,
+                    }
+                    self.try_upload_preview_file(pyclowder.files.upload_metadata, connector, host, secret_key,
+                                                 resource['id'],
+                                                 self.get_metadata(livemeta, 'file', resource['id'], host))
+                except Exception as err:  # pylint: disable=broad-except
+                    # The metadata is uploaded again at the end
+                    self.logger.warning("Failed to update the metadata of the recording: %s", err)
+
+            def follow_transition(slide):
+                """A new slide started in the recording: the previous one has ended"""
+                live_slides.append(slide)
+                connector.status_update(pyclowder.utils.StatusMessage.processing, resource,
+                                        "Following the recording: slide %d at %s" %
+                                        (len(live_slides), datetime.timedelta(seconds=int(slide[1] / 1000))))
+                if len(live_slides) > 1:
+                    uploads.submit(upload_live_metadata, list(live_slides))
+
+            live_transition = follow_transition if recording else None
+
+            if results is not None and encoded:
+                self.logger.info("Using the results of the cache or an earlier attempt, skipping the detection and the "
+                                 "encoding of the previews")
+            else:
+                # Only the encoding is left to do
+                if results is not None and preview_mode == 'shared':
+                    preview_mode = 'single-pass'
+
+                encode_job = None
+                preview_outputs = None
+                if encoded:
+                    self.logger.info("The previews were already encoded by an earlier attempt")
+                elif preview_mode == 'shared':
+                    preview_outputs = single_pass_preview_outputs(self.tempdir, mp4_preview, webm_preview, webm,
+                                                                  budget['encoding'])
+                else:
+                    # First let's set the encoders off in the background to create our previews (uses only its share of
+                    # the CPU budget so should be safe to leave in the background). A recording can only be encoded once
+                    # it has ended.
+                    encode_job = multiprocessing.Process(
+                        target=create_video_previews,
+                        args=(preview_video, self.tempdir, mp4_preview, webm_preview, webm,
+                              budget['encoding'], preview_mode == 'single-pass')
+                    )
+                    if not recording:
+                        encode_start = time.time()
+                        encode_job.start()
+
+                if results is not None:
+                    self.logger.info("The slides were already detected by an earlier attempt")
+                else:
+                    self.logger.debug("Using %s algorithm for finding slides. settings: %s, previews: %s",
+                                      find_slides.__name__, settings, preview_mode)
+                    if shadows:
+                        algorithm = self.algorithmsettings.get('algorithm', 'advanced')
+                        try:
+                            with instruments.timer('detection'):
+                                shadow_results = slide_find_multi(video, self.tempdir,
+                                                                  [dict(settings, algorithm=algorithm)] + shadows,
+                                                                  masks=masks, preview_outputs=preview_outputs,
+                                                                  slide_callback=upload_slide, instruments=instruments,
+                                                                  transition_callback=live_transition)
+                            results = shadow_results.pop(algorithm, [])
+                        except ValueError as err:
+                            self.logger.error("Failed to run the shadow algorithms: %s", err)
+                            shadow_results = None
+                    if not shadows or shadow_results is None:
+                        with instruments.timer('detection'):
+                            results = find_slides(video, self.tempdir, masks=masks, preview_outputs=preview_outputs,
+                                                  slide_callback=upload_slide, transition_callback=live_transition,
+                                                  instruments=instruments, **settings)
+                    if shadow_results:
+                        # Only the transitions are kept (in seconds), without the end of the video
+                        shadow_results = dict([(name, [round(time_idx / 1000.0, 3) for _, time_idx, _ in slides[:-1]])
+                                               for name, slides in shadow_results.items()])
+                        journal.record('shadow', shadow_results)
+                    if results:
+                        journal.record('detection', [(frame_idx, time_idx, os.path.basename(slide) if slide else None)
+                                                     for frame_idx, time_idx, slide in results])
+
+                if encode_job is not None and recording:
+                    # The recording has ended
+                    encode_start = time.time()
+                    encode_job.start()
+
+                # Wait for encoder job to finish
+                if encode_job is not None:
+                    with instruments.timer('encode_wait'):
+                        encode_job.join()
+                    instruments.add_time('encode', time.time() - encode_start)
+                # A failed encoder leaves truncated previews behind, they are neither recorded nor uploaded
+                if encode_job is not None and encode_job.exitcode != 0:
+                    self.logger.error("Encoding the previews failed (exit code %s)", encode_job.exitcode)
+                    for path in [mp4_preview_file, webm_preview_file]:
+                        if os.path.exists(path):
+                            os.remove(path)
+                previews_complete = ((encode_job is None or encode_job.exitcode == 0) and
+                                     os.path.exists(mp4_preview_file) and
+                                     (not webm or os.path.exists(webm_preview_file)))
+                if not encoded and previews_complete:
+                    journal.record('encode')
+
+                if cache is not None and results and previews_complete:
+                    with instruments.timer('cache'):
+                        cache.put(cache_key, results,
+                                  [mp4_preview_file, webm_preview_file] if webm else [mp4_preview_file],
+                                  {'roi': settings['roi']} if settings.get('auto_roi') and settings.get('roi')
+                                  else None)
+
+            # Check the output files exist, if so upload them
+            if os.path.exists(mp4_preview_file):
+                mp4_upload = uploads.submit(upload_once, 'mp4', pyclowder.files.upload_preview, mp4_preview_file, {})
+                if webm and os.path.exists(webm_preview_file):
+                    webm_upload = uploads.submit(upload_once, 'webm', pyclowder.files.upload_preview, webm_preview_file,
+                                                 {})
+            else:
+                self.logger.error("Video preview files were not created correctly!")
+                return []
 
-        return results
+            # The uploads run in the background, only the time spent waiting for them adds to the job
+            with instruments.timer('upload_wait'):
+                if webm:
+                    previews = {'mp4': mp4_upload.get(), 'webm': webm_upload.get()}
+                else:
+                    previews = {'mp4': mp4_upload.get()}
+
+            self.results = []
+
+            slidesmeta = {
+                'nrslides': 0,
+                'listslides': [],
+                'algorithm': self.algorithmsettings.get('algorithm', 'advanced'),
+                'settings': settings,
+                'previews': previews,
+                'cpu_budget': budget,
+            }
+            if shadow_results:
+                slidesmeta['shadow'] = shadow_results
+            if recording:
+                slidesmeta['recording'] = recording
+            self.logger.debug("tmp results: %s", results)
+
+            for idx, (frame_idx, time_idx, slidepath) in enumerate(results):
+                # last second/frame always gets added for WebVTT but hasn't got a slidepath set
+                if not slidepath:
+                    self.results.append((frame_idx, time_idx, None))
+                    continue
+
+                # Create section for file (currently not used)
+                #sectionid = sections_upload(connector, host, secret_key, {'file_id': resource['id']})
+                #slidemeta = {
+                #    'section_id': sectionid,
+                #}
+                #description = "Slide %2d at %s" % (idx + 1, datetime.timedelta(milliseconds=time_idx))
+                # upload preview & associated it with the section (most of them are already uploaded or on their way)
+                if slidepath not in slide_uploads:
+                    upload_slide(slidepath)
+                with instruments.timer('upload_wait'):
+                    previewid = slide_uploads[slidepath].get()
+
+                # add a description to every preview
+                #pyclowder.sections.upload_description(connector, host, secret_key, sectionid, {'description': description})
+
+                self.results.append((frame_idx, time_idx, previewid))
+
+            for thumbnail_upload in thumbnail_uploads:
+                with instruments.timer('upload_wait'):
+                    thumbnail_upload.get()
+
+            self.logger.debug("final results: %s", self.results)
+
+            # first and last frame will always be in self.results
+            if self.results and len(self.results) > 1:
+                slidesmeta['nrslides'] = len(self.results) - 1,  # the last frame always gets added too
+                slidesmeta['listslides'] = list_slides(self.results)
+
+            # Where the time of the job went so far (the upload of the metadata itself isn't in it)
+            slidesmeta['instrumentation'] = compact_summary(self.instruments_summary())
+
+            metadata = self.get_metadata(slidesmeta, 'file', resource['id'], host)
+            self.logger.debug("New metadata: %s", metadata)
+
+            # upload metadata
+            with instruments.timer('metadata'):
+                self.try_upload_preview_file(pyclowder.files.upload_metadata, connector, host, secret_key,
+                                             resource['id'], metadata)
+        finally:
+            uploads.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Find good trigger settings for a video: evaluate a grid of trigger settings on the stored per-frame signal of the
+video (the signal is recorded first if it isn't stored yet). With a ground truth file (the time of every slide
+transition, one per line) every combination is scored, otherwise only the number of transitions is shown.
+
+The masks and the settings of the algorithm come from the settings file of the extractor (unless --settings overrides
+them), so the signal is the one the extractor recorded.
+
+Usage: video-tune.py video --signal-store DIR [--ground-truth FILE] [--trigger-ratio 3 4 5 ...]
+"""
+
+import argparse
+import json
+import logging
+import shutil
+import sys
+import tempfile
+
+import yaml
+
+from extractorsettings import algorithm_settings, read_settings_file
+from slidedetection import (default_settings_advanced, default_settings_basic, open_signal_store,
+                            signal_settings_advanced, signal_settings_basic, slide_find_advanced, slide_find_basic)
+from tuning import evaluate_advanced, evaluate_basic, read_ground_truth, score_transitions
+
+
+def load_signal(video, algorithm, settings):
+    """Open the stored signal of the video, record it first if needed. (None, None) if the store can't be opened"""
+    if algorithm == 'basic':
+        store = open_signal_store(video, settings, 'basic', signal_settings_basic)
+        find_slides = slide_find_basic
+    else:
+        store = open_signal_store(video, settings, 'advanced', signal_settings_advanced)
+        find_slides = slide_find_advanced
+
+    if store is None:
+        # open_signal_store already logged why
+        return None, None
+
+    if not store.exists():
+        logging.warning("No stored signal for %s, processing the video first", video)
+        output_dir = tempfile.mkdtemp(prefix='video-tune')
+        try:
+            find_slides(video, output_dir, **settings)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    return store.load()
+
+
+def main():
+    """Parse the command line and evaluate the grid"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help="path to the video")
+    parser.add_argument('--signal-store', required=True, help="directory with the stored signals")
+    parser.add_argument('--algorithm', choices=['advanced', 'basic'], default='advanced')
+    parser.add_argument('--config', help="settings file of the extractor (default: config/settings.yml)")
+    parser.add_argument('--settings', default='{}', help="settings of the algorithm the signal depends on (JSON)")
+    parser.add_argument('--ground-truth', help="file with the times of the transitions")
+    parser.add_argument('--tolerance', type=float, default=2.0, help="tolerance (s) to match a transition")
+    parser.add_argument('--trigger-ratio', nargs='+', type=float, default=[3.0, 4.0, 5.0, 6.0, 7.0, 8.0])
+    parser.add_argument('--minimum-total-change', nargs='+', type=float, default=[0.02, 0.04, 0.06, 0.08, 0.1])
+    parser.add_argument('--minimum-slide-length', nargs='+', type=float, default=[10.0, 15.0, 20.0])
+    parser.add_argument('--trigger', nargs='+', type=float, default=[0.005, 0.01, 0.02, 0.05],
+                        help="trigger values for the basic algorithm")
+    parser.add_argument('--top', type=int, default=20, help="number of combinations to show")
+    parser.add_argument('--debug', action='store_true', help="show the debug output")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    try:
+        config = read_settings_file(args.config)
+    except (IOError, yaml.YAMLError) as err:
+        parser.error("Failed to read the settings file: %s" % err)
+    # The masks and the settings the extractor runs the algorithm with
+    settings = algorithm_settings(config, args.algorithm,
+                                  default_settings_basic if args.algorithm == 'basic' else default_settings_advanced)
+    settings['masks'] = config.get('masks', [])
+    settings.update(json.loads(args.settings))
+    settings['signal_store'] = args.signal_store
+    settings['workers'] = 1
+
+    # The minimum slide length has to cover the averaging time used to record the signal
+    lengths = []
+    if args.algorithm == 'advanced':
+        lengths = [length for length in args.minimum_slide_length
+                   if length >= settings['motion_capture_averaging_time']]
+        if not lengths:
+            parser.error("The minimum slide lengths must be at least the motion_capture_averaging_time (%s s)" %
+                         settings['motion_capture_averaging_time'])
+        # The frames right after a transition are only in the signal for minimum slide lengths of the recording or up
+        settings['minimum_slide_length'] = min(lengths)
+
+    signal, meta = load_signal(args.video, args.algorithm, settings)
+    if signal is None:
+        logging.error("Could not open the signal store %s", args.signal_store)
+        sys.exit(1)
+    if args.algorithm == 'basic':
+        results = evaluate_basic(signal, args.trigger)
+    else:
+        if min(lengths) < meta.get('minimum_slide_length', 0):
+            logging.warning("The signal was recorded with a minimum slide length of %s s, shorter lengths are "
+                            "approximated", meta['minimum_slide_length'])
+        results = evaluate_advanced(signal, meta, args.trigger_ratio, args.minimum_total_change, lengths)
+
+    truth = read_ground_truth(args.ground_truth) if args.ground_truth else None
+    rows = []
+    for parameters, transitions in results:
+        # The first frame is always a slide, not a transition
+        transitions = [timestamp for timestamp in transitions if timestamp > 0]
+        score = score_transitions(transitions, truth, args.tolerance * 1000) if truth is not None else None
+        rows.append((parameters, len(transitions), score))
+
+    if truth is not None:
+        rows.sort(key=lambda row: (-row[2]['f1'], row[2]['timing_error'] or 0))
+        print("%-70s %6s %9s %6s %6s %9s" % ('settings', 'slides', 'precision', 'recall', 'f1', 'error (s)'))
+    else:
+        print("%-70s %6s" % ('settings', 'slides'))
+
+    for parameters, count, score in rows[:args.top]:
+        description = ', '.join(['%s=%s' % item for item in sorted(parameters.items())])
+        if score is None:
+            print("%-70s %6d" % (description, count))
+        else:
+            error = '%9.2f' % (score['timing_error'] / 1000.0) if score['timing_error'] is not None else '%9s' % '-'
+            print("%-70s %6d %9.2f %6.2f %6.2f %s" % (description, count, score['precision'], score['recall'],
+                                                      score['f1'], error))
+
+
+if __name__ == "__main__":
+    main()
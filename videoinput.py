@@ -0,0 +1,276 @@
+"""
+Read a video without downloading it first
+
+Instead of a local copy, the video can be a file on a shared mount or an HTTP URL. The decoders (ffmpeg and OpenCV,
+through libavformat) read from a URL as the bytes arrive and jump around in the file (e.g. to the index at the end of
+an mp4, or to take a screenshot) with range requests, so the detection and the encoding start right away and the
+video is never copied to disk as a whole.
+
+Everything that reads the bytes of the video itself (e.g. the checksums of the cache) uses open_video_file, which
+returns a HTTPRangeFile for a URL: a read-only file object that only fetches the requested bytes.
+
+The key of Clowder is sent as a header, never in the URL. The decoders can't add a header without putting the key on
+their command line, so they read the video through a StreamProxy: a proxy on the loopback interface that adds the
+header to every request it forwards.
+"""
+
+import binascii
+import contextlib
+import logging
+import os
+import re
+import sys
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+
+import requests
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# The header with the key of Clowder
+KEY_HEADER = 'X-API-Key'
+
+
+def is_url(path):
+    """Check if a video is read over HTTP"""
+    return path.startswith('http://') or path.startswith('https://')
+
+
+def redact_url(url):
+    """The URL (or any text with URLs, e.g. the errors of ffmpeg) without the key, e.g. to log it"""
+    if not hasattr(url, 'startswith'):
+        return url
+    return re.sub(r'([?&]key=)[^&\s]*', r'\1...', url)
+
+
+class HTTPRangeFile(object):
+    """A read-only file object for a file on an HTTP server that supports range requests"""
+
+    def __init__(self, url, session=None, timeout=60, headers=None):
+        """
+        :param url: the URL of the file
+        :param session: requests.Session to use (None for a new one)
+        :param timeout: timeout (in seconds) of every request
+        :param headers: extra headers of every request (e.g. the key)
+        :raise IOError if the server doesn't support range requests
+        """
+        self.url = url
+        self.timeout = timeout
+        self._own_session = session is None
+        self.session = session or requests.Session()
+        self.headers = dict(headers or {})
+        self.position = 0
+
+        try:
+            response = self._get(0, 0)
+            self.size = int(response.headers['Content-Range'].rpartition('/')[2])
+        except (ValueError, requests.RequestException) as err:
+            self.close()
+            raise IOError("Failed to open %s: %s" % (redact_url(url), err))
+
+    def _get(self, start, end):
+        """Fetch the bytes from start to end (inclusive)"""
+        response = self.session.get(self.url, headers=dict(self.headers, Range='bytes=%d-%d' % (start, end)),
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        if response.status_code != 206 or 'Content-Range' not in response.headers:
+            raise IOError("%s doesn't support range requests" % redact_url(self.url))
+        return response
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to a position in the file (relative to the start, the current position or the end)"""
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+
+    def tell(self):
+        """The current position in the file"""
+        return self.position
+
+    def read(self, size=-1):
+        """Read size bytes (or the rest of the file if size is negative)"""
+        if self.position >= self.size or size == 0:
+            return b''
+
+        end = self.size if size < 0 else min(self.position + size, self.size)
+        try:
+            data = self._get(self.position, end - 1).content
+        except requests.RequestException as err:
+            raise IOError("Failed to read %s: %s" % (redact_url(self.url), err))
+        self.position += len(data)
+        return data
+
+    def close(self):
+        """Close the connection (if the session is our own)"""
+        if self._own_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def supports_ranges(url, headers=None):
+    """Check if a video can be streamed from a URL: the server has to support range requests"""
+    try:
+        HTTPRangeFile(url, headers=headers).close()
+    except IOError as err:
+        logger.info("Can't stream the video: %s", err)
+        return False
+
+    return True
+
+
+def open_video_file(path):
+    """Open the bytes of a video, a local file or a URL (see HTTPRangeFile)"""
+    if is_url(path):
+        return HTTPRangeFile(path)
+
+    return open(path, 'rb')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server with a thread per connection"""
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """A decoder closes the connection when it seeks, that is no error"""
+        if isinstance(sys.exc_info()[1], (IOError, OSError)):
+            logger.debug("Connection of %s closed early", client_address)
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
+
+class StreamProxy(object):
+    """
+    Serve a URL that needs extra headers (the key) on the loopback interface. The local URL holds a random token, so
+    other users of the host can't read through the proxy.
+    """
+    forwarded_headers = ['Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'Last-Modified']
+
+    def __init__(self, url, headers, timeout=60):
+        """
+        :param url: the URL of the video
+        :param headers: the headers to add to every request (e.g. the key)
+        :param timeout: timeout (in seconds) of every request
+        """
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        # The video is passed on as it is
+        self.session.headers['Accept-Encoding'] = 'identity'
+        prefix = '/%s/' % binascii.hexlify(os.urandom(16)).decode('ascii')
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Forward the requests (and their range) to the URL"""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Forward a GET request"""
+                proxy.forward(self, url, prefix, timeout, True)
+
+            def do_HEAD(self):  # pylint: disable=invalid-name
+                """Forward a HEAD request"""
+                proxy.forward(self, url, prefix, timeout, False)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d%s%s' % (self.server.server_address[1], prefix,
+                                                os.path.basename(url.partition('?')[0]) or 'video')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def forward(self, handler, url, prefix, timeout, body):
+        """Forward the request of a handler to the URL"""
+        if not handler.path.startswith(prefix):
+            handler.send_error(404)
+            return
+
+        headers = {}
+        if handler.headers.get('Range'):
+            headers['Range'] = handler.headers.get('Range')
+        try:
+            response = self.session.request('GET' if body else 'HEAD', url, headers=headers, stream=True,
+                                            timeout=timeout)
+        except requests.RequestException as err:
+            logger.error("Failed to read %s: %s", redact_url(url), err)
+            handler.send_error(502)
+            return
+
+        with contextlib.closing(response):
+            handler.send_response(response.status_code)
+            for name in self.forwarded_headers:
+                if name in response.headers:
+                    handler.send_header(name, response.headers[name])
+            handler.end_headers()
+            if not body:
+                return
+            try:
+                for chunk in response.iter_content(1 << 16):
+                    handler.wfile.write(chunk)
+            except (IOError, OSError, requests.RequestException):
+                # The decoder closes the connection when it seeks
+                pass
+
+    def close(self):
+        """Stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def resolve_video(filepath, mounted_paths, url, headers, download):
+    """
+    Find a way to read a video without downloading it: the file itself (on a mounted storage path), or else stream it
+    from the URL (through a StreamProxy). Only if the server doesn't support range requests it is downloaded.
+    :param filepath: the path of the video on the storage of Clowder
+    :param mounted_paths: dict with the paths where the storage of Clowder is mounted, by their path in Clowder
+    :param url: the URL of the video
+    :param headers: the headers to read the URL (e.g. the key)
+    :param download: function that downloads the video and returns the path of the download
+    :return tuple with the path or URL to read and a function to call when done with it (None if there is nothing
+    to clean up)
+    """
+    filepath = filepath or ''
+    candidates = [filepath] + [filepath.replace(source_path, mounted_path, 1)
+                               for source_path, mounted_path in (mounted_paths or {}).items()
+                               if filepath.startswith(source_path)]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            logger.info("Reading the video from %s", candidate)
+            return candidate, None
+
+    if supports_ranges(url, headers):
+        logger.info("Streaming the video from %s", redact_url(url))
+        proxy = StreamProxy(url, headers)
+        return proxy.url, proxy.close
+
+    logger.warning("Can't read the video without a download, downloading it")
+    path = download()
+
+    def remove():
+        """Remove the download"""
+        try:
+            os.remove(path)
+        except OSError as err:
+            logger.error("Failed to remove the download %s: %s", path, err)
+
+    return path, remove